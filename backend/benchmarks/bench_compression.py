@@ -0,0 +1,61 @@
+"""Per-request cost and size of rendering and compressing a list page.
+
+Renders one page of notes the way a handler returning a dict is
+rendered (jsonable_encoder, then Starlette's JSONResponse or the app's
+OrjsonResponse), then compresses the body in each supported encoding.
+"Per request" compression is what a cache miss (or an uncached route)
+pays; a cache hit serves the stored bytes and pays nothing.
+
+    python benchmarks/bench_compression.py --rows 50 --repeat 200
+"""
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from fastapi.encoders import jsonable_encoder  # noqa: E402
+from starlette.responses import JSONResponse  # noqa: E402
+
+from bench_serialization import make_rows  # noqa: E402
+from compression import compress, supported_encodings  # noqa: E402
+from serialization import OrjsonResponse  # noqa: E402
+
+
+def timed(fn, repeat):
+    """Best wall time of one call, in microseconds"""
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - started)
+    return round(best * 1e6, 1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=50, help="notes per page")
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    page = {"items": make_rows(args.rows), "next_cursor": None}
+    body = OrjsonResponse(jsonable_encoder(page)).body
+    result = {
+        "rows": args.rows,
+        "render_us": {
+            "json": timed(lambda: JSONResponse(jsonable_encoder(page)), args.repeat),
+            "orjson": timed(lambda: OrjsonResponse(jsonable_encoder(page)), args.repeat),
+        },
+        "bytes": {"identity": len(body)},
+        "compress_us_per_request": {},
+    }
+    for encoding in supported_encodings():
+        result["bytes"][encoding] = len(compress(body, encoding))
+        result["compress_us_per_request"][encoding] = timed(lambda: compress(body, encoding), args.repeat)
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""Per-row cost of the list read path, before and after native dates.
+
+Compares the legacy path (ISO strings -> parse_from_mongo -> Note(**row)
+-> response_model revalidation -> jsonable_encoder -> json.dumps) with
+the current one (projected native-date documents -> orjson).
+
+    python benchmarks/bench_serialization.py --rows 5000 --repeat 5
+"""
+import argparse
+import json
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import List
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from fastapi.encoders import jsonable_encoder  # noqa: E402
+from pydantic import TypeAdapter  # noqa: E402
+
+from models import Note  # noqa: E402
+from serialization import dumps  # noqa: E402
+
+
+def legacy_parse_from_mongo(item):
+    """The pre-migration read helper, kept here for comparison"""
+    if isinstance(item, dict):
+        for key, value in item.items():
+            if key.endswith('_at') and isinstance(value, str):
+                try:
+                    item[key] = datetime.fromisoformat(value)
+                except:  # noqa: E722
+                    pass
+    return item
+
+
+def make_rows(count):
+    start = datetime(2025, 9, 1, tzinfo=timezone.utc)
+    return [
+        {
+            "id": str(uuid.uuid4()),
+            "title": f"Unit {i % 5} notes part {i}.pdf",
+            "subject": "Design and Analysis of Algorithms",
+            "semester": str(3 + i % 3),
+            "size": "2 MB",
+            "file_url": f"https://drive.google.com/file/d/{uuid.uuid4().hex}/view?usp=drivesdk",
+            "uploaded_at": start + timedelta(minutes=i),
+        }
+        for i in range(count)
+    ]
+
+
+# Built once, as FastAPI does per route, so only the per-request work is timed
+NOTES_ADAPTER = TypeAdapter(List[Note])
+
+
+def legacy_path(rows):
+    notes = [Note(**legacy_parse_from_mongo(dict(row, _id=i))) for i, row in enumerate(rows)]
+    validated = NOTES_ADAPTER.validate_python([note.model_dump() for note in notes])
+    return json.dumps(jsonable_encoder(validated)).encode()
+
+
+def fast_path(rows):
+    return dumps({"items": rows, "next_cursor": None})
+
+
+def timed(fn, rows, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn(rows)
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=5000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    native_rows = make_rows(args.rows)
+    string_rows = [dict(row, uploaded_at=row["uploaded_at"].isoformat()) for row in native_rows]
+
+    legacy = timed(legacy_path, string_rows, args.repeat)
+    fast = timed(fast_path, native_rows, args.repeat)
+    result = {
+        "rows": args.rows,
+        "legacy_us_per_row": round(legacy / args.rows * 1e6, 2),
+        "fast_us_per_row": round(fast / args.rows * 1e6, 2),
+        "speedup": round(legacy / fast, 1),
+    }
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
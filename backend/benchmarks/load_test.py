@@ -0,0 +1,305 @@
+"""Concurrent load test for the API, run in-process.
+
+The FastAPI app is driven through httpx's ASGI transport, so there is
+no network hop or server process in the measurement. It talks to a
+local MongoDB (--mongo-url), with --mock to mongomock-motor if that is
+installed, or with --storage memory|sqlite to an offline storage engine
+(storage.py). The store is seeded with realistic volumes, then a
+weighted mix of list, search, thread, reply and upvote requests runs at
+the requested concurrency. The report (p50/p95/p99 latency, throughput
+and response bytes on the wire per route, process CPU per request) is
+written as JSON so runs can be compared across commits. Requests send
+--accept-encoding, "gzip, br" by default as a browser would; pass
+identity to measure uncompressed responses:
+
+    python benchmarks/load_test.py --mongo-url mongodb://localhost:27017 --out bench.json
+    python benchmarks/load_test.py --mock --notes 5000 --compare bench.json
+    python benchmarks/load_test.py --storage sqlite --compare bench.json
+    python benchmarks/load_test.py --storage memory --accept-encoding identity --out identity.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BACKEND_DIR))
+
+SUBJECTS = [
+    "Data Science", "Data Structures", "Digital Logic Design", "Principles of Artificial Intelligence",
+    "Design and Analysis of Algorithms", "Computer Networks", "Operating Systems", "Mathematics",
+]
+WORDS = (
+    "unit notes assignment revision regression tree graph sorting algorithm network kernel "
+    "process memory probability matrix calculus logic circuit search learning model exam pyq"
+).split()
+
+# (route template, weight)
+WORKLOAD = [
+    ("GET /notes", 25),
+    ("GET /notes?subject&semester", 15),
+    ("GET /discussions", 20),
+    ("GET /discussions/{id}/thread", 10),
+    ("GET /search/notes", 10),
+    ("GET /search/discussions", 5),
+    ("POST /discussions/{id}/replies", 5),
+    ("POST /discussions/{id}/upvote", 7),
+    ("POST /replies/{id}/upvote", 3),
+]
+
+
+def _words(rng, count):
+    return " ".join(rng.choice(WORDS) for _ in range(count))
+
+
+async def seed(storage, notes, discussions, hot_threads, replies_per_hot, rng):
+    """Bulk-load synthetic data through the repositories, bypassing the API"""
+    start = datetime.now(timezone.utc) - timedelta(days=120)
+    batch = []
+    for i in range(notes):
+        batch.append({
+            "id": str(uuid.uuid4()),
+            "title": f"{_words(rng, 3)} {i}.pdf",
+            "subject": rng.choice(SUBJECTS),
+            "semester": str(rng.randint(1, 8)),
+            "size": "2 MB",
+            "file_url": f"https://drive.google.com/file/d/{uuid.uuid4().hex}/view",
+            "uploaded_at": start + timedelta(seconds=rng.randint(0, 120 * 86400)),
+        })
+        if len(batch) == 5000:
+            await storage.notes.insert_batch(batch)
+            batch = []
+    if batch:
+        await storage.notes.insert_batch(batch)
+
+    discussion_ids = []
+    for i in range(discussions):
+        content = _words(rng, 60)
+        doc = {
+            "id": str(uuid.uuid4()),
+            "title": _words(rng, 6),
+            "content": content,
+            "excerpt": content[:200],
+            "author": "Anonymous",
+            "replies": 0,
+            "upvotes": rng.randint(0, 50),
+            "created_at": start + timedelta(seconds=rng.randint(0, 120 * 86400)),
+        }
+        discussion_ids.append(doc["id"])
+        await storage.discussions.insert(doc)
+
+    reply_ids = []
+    for discussion_id in discussion_ids[:hot_threads]:
+        created = start
+        replies = []
+        for _ in range(replies_per_hot):
+            created += timedelta(seconds=rng.randint(1, 600))
+            replies.append({
+                "id": str(uuid.uuid4()),
+                "discussion_id": discussion_id,
+                "content": _words(rng, 20),
+                "author": "Anonymous",
+                "upvotes": 0,
+                "created_at": created,
+            })
+        for reply in replies:
+            await storage.replies.insert(reply)
+        reply_ids.extend(reply["id"] for reply in replies[:100])
+    return discussion_ids, reply_ids
+
+
+def _request_for(route, rng, discussion_ids, reply_ids):
+    if route == "GET /notes":
+        return "GET", "/api/notes", {"limit": 50}, None
+    if route == "GET /notes?subject&semester":
+        return "GET", "/api/notes", {"subject": rng.choice(SUBJECTS), "semester": str(rng.randint(1, 8))}, None
+    if route == "GET /discussions":
+        return "GET", "/api/discussions", {"limit": 50}, None
+    if route == "GET /discussions/{id}/thread":
+        return "GET", f"/api/discussions/{rng.choice(discussion_ids)}/thread", {"limit": 50}, None
+    if route == "GET /search/notes":
+        return "GET", "/api/search/notes", {"q": _words(rng, rng.randint(1, 2))}, None
+    if route == "GET /search/discussions":
+        return "GET", "/api/search/discussions", {"q": rng.choice(WORDS)}, None
+    if route == "POST /discussions/{id}/replies":
+        body = {"content": _words(rng, 15), "author": "LoadTest"}
+        return "POST", f"/api/discussions/{rng.choice(discussion_ids)}/replies", None, body
+    if route == "POST /discussions/{id}/upvote":
+        # Skewed towards a few hot threads, like real traffic
+        return "POST", f"/api/discussions/{rng.choice(discussion_ids[:20])}/upvote", None, None
+    if route == "POST /replies/{id}/upvote":
+        return "POST", f"/api/replies/{rng.choice(reply_ids)}/upvote", None, None
+    raise ValueError(route)
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * (len(sorted_values) - 1)))))
+    return sorted_values[index]
+
+
+async def run_workload(http, duration, concurrency, discussion_ids, reply_ids, seed_value):
+    routes = [route for route, _ in WORKLOAD]
+    weights = [weight for _, weight in WORKLOAD]
+    latencies = defaultdict(list)
+    errors = defaultdict(int)
+    wire_bytes = defaultdict(int)
+    deadline = time.perf_counter() + duration
+
+    async def worker(worker_id):
+        rng = random.Random(seed_value + worker_id)
+        while time.perf_counter() < deadline:
+            route = rng.choices(routes, weights)[0]
+            method, url, params, body = _request_for(route, rng, discussion_ids, reply_ids)
+            started = time.perf_counter()
+            try:
+                response = await http.request(method, url, params=params, json=body)
+                ok = response.status_code < 400
+                wire_bytes[route] += response.num_bytes_downloaded
+            except Exception:
+                ok = False
+            latencies[route].append((time.perf_counter() - started) * 1000)
+            if not ok:
+                errors[route] += 1
+
+    started = time.perf_counter()
+    # Client and server share the process, so this is an upper bound on the server's share
+    cpu_started = time.process_time()
+    await asyncio.gather(*(worker(i) for i in range(concurrency)))
+    cpu = time.process_time() - cpu_started
+    elapsed = time.perf_counter() - started
+
+    report = {}
+    for route in routes:
+        samples = sorted(latencies[route])
+        report[route] = {
+            "requests": len(samples),
+            "errors": errors[route],
+            "throughput_rps": round(len(samples) / elapsed, 1),
+            "p50_ms": round(percentile(samples, 0.50), 2),
+            "p95_ms": round(percentile(samples, 0.95), 2),
+            "p99_ms": round(percentile(samples, 0.99), 2),
+            "bytes_per_request": round(wire_bytes[route] / len(samples)) if samples else 0,
+        }
+    total = sum(len(samples) for samples in latencies.values())
+    return report, {
+        "requests": total, "elapsed_s": round(elapsed, 2), "throughput_rps": round(total / elapsed, 1),
+        "cpu_ms_per_request": round(cpu / total * 1000, 3) if total else 0.0,
+        "bytes_per_request": round(sum(wire_bytes.values()) / total) if total else 0,
+    }
+
+
+def _git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR, text=True).strip()
+    except Exception:
+        return None
+
+
+def compare(current, baseline_path):
+    baseline = json.loads(Path(baseline_path).read_text())
+    print(f"\nvs {baseline_path} ({baseline.get('commit')}):")
+    for route, stats in current["routes"].items():
+        before = baseline["routes"].get(route)
+        if not before or not before["p95_ms"]:
+            continue
+        change = (stats["p95_ms"] - before["p95_ms"]) / before["p95_ms"] * 100
+        line = f"  {route:34s} p95 {before['p95_ms']:8.2f} -> {stats['p95_ms']:8.2f} ms ({change:+.1f}%)"
+        if before.get("bytes_per_request"):
+            line += f"  bytes {before['bytes_per_request']:7d} -> {stats['bytes_per_request']:7d}"
+        print(line)
+    for field, unit in (("cpu_ms_per_request", "ms"), ("bytes_per_request", "B")):
+        before, after = baseline["totals"].get(field), current["totals"][field]
+        if before:
+            change = (after - before) / before * 100
+            print(f"  {'per request':34s} {field.split('_per_')[0]:3s} {before:8} -> {after:8} {unit} ({change:+.1f}%)")
+
+
+async def main(args):
+    os.environ['MONGO_URL'] = args.mongo_url
+    os.environ['DB_NAME'] = args.db_name
+    os.environ['MONGO_STARTUP_JITTER_MS'] = '0'
+    os.environ['STORAGE_ENGINE'] = args.storage
+    if args.storage == 'sqlite':
+        os.environ['SQLITE_PATH'] = str(Path(tempfile.mkdtemp(prefix="kamati_bench_")) / "bench.db")
+    # Every simulated client shares one address; measure the handlers, not the limiter
+    os.environ.setdefault('RATE_LIMITS', '')
+
+    import httpx
+    import server
+
+    app = server.create_app()
+    if args.mock:
+        from mongomock_motor import AsyncMongoMockClient
+
+        server.mongo.client = AsyncMongoMockClient(tz_aware=True)
+    # Opened before the lifespan so the search index is built over the seeded data
+    await server.storage.open()
+    if args.storage == 'mongo' and not args.mock:
+        await server.mongo.client.drop_database(args.db_name)
+
+    rng = random.Random(args.seed)
+    seed_started = time.perf_counter()
+    discussion_ids, reply_ids = await seed(
+        server.storage, args.notes, args.discussions, args.hot_threads, args.replies_per_hot, rng
+    )
+    seed_elapsed = time.perf_counter() - seed_started
+
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        headers = {"Accept-Encoding": args.accept_encoding}
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", headers=headers) as http:
+            routes, totals = await run_workload(
+                http, args.duration, args.concurrency, discussion_ids, reply_ids, args.seed
+            )
+
+    result = {
+        "commit": _git_commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "config": {
+            "notes": args.notes, "discussions": args.discussions, "hot_threads": args.hot_threads,
+            "replies_per_hot": args.replies_per_hot, "concurrency": args.concurrency,
+            "duration_s": args.duration,
+            "store": args.storage if args.storage != "mongo" else "mongomock" if args.mock else "mongodb",
+            "accept_encoding": args.accept_encoding,
+        },
+        "seed_s": round(seed_elapsed, 2),
+        "totals": totals,
+        "routes": routes,
+    }
+    print(json.dumps(result, indent=2))
+    if args.out:
+        Path(args.out).write_text(json.dumps(result, indent=2))
+    if args.compare:
+        compare(result, args.compare)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="In-process concurrent load test for the API")
+    parser.add_argument("--mongo-url", default="mongodb://localhost:27017")
+    parser.add_argument("--db-name", default="kamati_bench")
+    parser.add_argument("--mock", action="store_true", help="use mongomock-motor instead of a MongoDB server")
+    parser.add_argument("--storage", choices=["mongo", "memory", "sqlite"], default="mongo",
+                        help="storage engine; memory and sqlite need no MongoDB (sqlite uses a fresh temp file)")
+    parser.add_argument("--notes", type=int, default=50000)
+    parser.add_argument("--discussions", type=int, default=2000)
+    parser.add_argument("--hot-threads", type=int, default=5)
+    parser.add_argument("--replies-per-hot", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=30.0, help="seconds of load")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--accept-encoding", default="gzip, br",
+                        help="Accept-Encoding sent with every request; identity disables compression")
+    parser.add_argument("--out", help="write the JSON report here")
+    parser.add_argument("--compare", help="baseline JSON report to diff p95 latencies against")
+    asyncio.run(main(parser.parse_args()))
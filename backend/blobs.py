@@ -0,0 +1,295 @@
+"""Content-addressed storage for uploaded note files.
+
+A blob is stored once under its SHA-256 however many notes point at it,
+so the same PDF uploaded twice costs one copy:
+
+    LocalBlobStore   BLOB_DIR/ab/cd/abcd...               (the default)
+    S3BlobStore      s3://BLOB_S3_BUCKET/BLOB_S3_PREFIXabcd...
+
+Set BLOB_BACKEND=s3 for the second. BLOB_S3_ENDPOINT_URL points it at
+any S3-compatible service instead of AWS, e.g. a local MinIO or
+`moto_server` while developing.
+
+Downloads honour a single HTTP Range and If-None-Match / If-Range on the
+digest ETag. Local blobs are sent straight from the file descriptor with
+the ASGI zerocopysend (or pathsend) extension when the server offers it,
+and otherwise read in chunks off the event loop. S3 downloads redirect
+to a presigned URL, so the bytes never pass through the API;
+BLOB_S3_REDIRECT=false proxies them instead, ranges included.
+"""
+import asyncio
+import os
+import shutil
+import tempfile
+import uuid
+from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import AsyncIterator, Optional, Tuple, Union
+from urllib.parse import quote
+
+from fastapi import HTTPException, Request, Response
+from fastapi.responses import RedirectResponse, StreamingResponse
+
+try:
+    import boto3
+    from botocore.exceptions import ClientError
+except ImportError:  # optional dependency
+    boto3 = None
+
+ROOT_DIR = Path(__file__).parent
+PDF_MEDIA_TYPE = "application/pdf"
+READ_CHUNK_BYTES = 256 * 1024
+CACHE_CONTROL = "public, max-age=86400"
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+def parse_range(header: str, size: int) -> Optional[Tuple[int, int]]:
+    """(first, last) byte of a single `bytes=` range, or None to send the whole blob
+
+    Multiple ranges and malformed headers are ignored, as RFC 9110 allows.
+    """
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None
+    first, dash, last = spec.strip().partition("-")
+    if not dash:
+        return None
+    try:
+        if not first:
+            # Suffix range: the last N bytes
+            length = int(last)
+            if length <= 0:
+                raise RangeNotSatisfiable()
+            return max(size - length, 0), size - 1
+        start = int(first)
+        end = int(last) if last else size - 1
+    except ValueError:
+        return None
+    if start >= size:
+        raise RangeNotSatisfiable()
+    if start > end:
+        return None
+    return start, min(end, size - 1)
+
+
+def content_disposition(filename: str) -> str:
+    fallback = "".join(c if c.isascii() and c.isprintable() and c not in '"\\' else "_" for c in filename)
+    return f"inline; filename=\"{fallback}\"; filename*=UTF-8''{quote(filename)}"
+
+
+def plan_response(request: Request, digest: str, size: int,
+                  filename: str) -> Union[Response, Tuple[int, int, int, dict]]:
+    """A finished 304/416 response, or (status, first byte, last byte, headers) to send"""
+    etag = f'"{digest}"'
+    headers = {
+        "ETag": etag,
+        "Accept-Ranges": "bytes",
+        "Cache-Control": CACHE_CONTROL,
+        "Content-Disposition": content_disposition(filename),
+        "X-Content-Type-Options": "nosniff",
+    }
+    if_none_match = request.headers.get("if-none-match", "")
+    if etag in (tag.strip() for tag in if_none_match.split(",")) or if_none_match.strip() == "*":
+        return Response(status_code=304, headers=headers)
+
+    byte_range = None
+    range_header = request.headers.get("range")
+    # A stale If-Range validator means the client's partial copy is of other bytes
+    if range_header and request.headers.get("if-range", etag) == etag:
+        try:
+            byte_range = parse_range(range_header, size)
+        except RangeNotSatisfiable:
+            return Response(status_code=416, headers=dict(headers, **{"Content-Range": f"bytes */{size}"}))
+    if byte_range is None:
+        return 200, 0, size - 1, dict(headers, **{"Content-Length": str(size)})
+    start, end = byte_range
+    headers.update({"Content-Range": f"bytes {start}-{end}/{size}", "Content-Length": str(end - start + 1)})
+    return 206, start, end, headers
+
+
+class FileRangeResponse(Response):
+    """Bytes start..end of a local file, handed to the server without copying when it can"""
+
+    def __init__(self, path: Path, start: int, end: int, status_code: int, headers: dict, media_type: str):
+        super().__init__(status_code=status_code, headers=headers, media_type=media_type)
+        self.path = path
+        self.start = start
+        self.end = end
+
+    async def __call__(self, scope, receive, send):
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        count = self.end - self.start + 1
+        extensions = scope.get("extensions", {})
+        if scope["method"] == "HEAD" or count <= 0:
+            await send({"type": "http.response.body", "body": b""})
+            return
+        if "http.response.pathsend" in extensions and self.status_code == 200:
+            await send({"type": "http.response.pathsend", "path": str(self.path)})
+            return
+        fd = os.open(self.path, os.O_RDONLY)
+        try:
+            if "http.response.zerocopysend" in extensions:
+                await send({"type": "http.response.zerocopysend", "file": fd, "offset": self.start, "count": count})
+                return
+            position = self.start
+            while count > 0:
+                data = await asyncio.to_thread(os.pread, fd, min(READ_CHUNK_BYTES, count), position)
+                if not data:
+                    break
+                position += len(data)
+                count -= len(data)
+                await send({"type": "http.response.body", "body": data, "more_body": count > 0})
+            if count > 0:
+                await send({"type": "http.response.body", "body": b""})
+        finally:
+            os.close(fd)
+
+
+class LocalBlobStore:
+    """Blobs as read-only files under root, fanned out by digest prefix"""
+
+    def __init__(self, root: Path):
+        self.root = Path(root)
+
+    def path(self, digest: str) -> Path:
+        return self.root / digest[:2] / digest[2:4] / digest
+
+    async def size(self, digest: str) -> Optional[int]:
+        """Stored size in bytes, or None if the blob is not stored"""
+        try:
+            return os.stat(self.path(digest)).st_size
+        except FileNotFoundError:
+            return None
+
+    async def put(self, digest: str, staged: Path) -> bool:
+        """Move a staged file in under its digest; False if it was already stored and the file was dropped"""
+        target = self.path(digest)
+        if target.exists():
+            staged.unlink(missing_ok=True)
+            return False
+        target.parent.mkdir(parents=True, exist_ok=True)
+        # Staging may be on another filesystem; the final rename is atomic either way
+        temporary = target.with_name(f".{digest}.{uuid.uuid4().hex}")
+        await asyncio.to_thread(shutil.move, str(staged), str(temporary))
+        os.chmod(temporary, 0o444)
+        os.replace(temporary, target)
+        return True
+
+    @asynccontextmanager
+    async def local_copy(self, digest: str) -> AsyncIterator[Path]:
+        """A readable path to the blob, for processing that needs a real file"""
+        yield self.path(digest)
+
+    async def response(self, request: Request, digest: str, filename: str,
+                       media_type: str = PDF_MEDIA_TYPE) -> Response:
+        size = await self.size(digest)
+        if size is None:
+            raise HTTPException(status_code=404, detail="File not found")
+        plan = plan_response(request, digest, size, filename)
+        if isinstance(plan, Response):
+            return plan
+        status_code, start, end, headers = plan
+        return FileRangeResponse(self.path(digest), start, end, status_code, headers, media_type)
+
+
+class S3BlobStore:
+    """Blobs as objects keyed by digest in an S3-compatible bucket"""
+
+    def __init__(self, bucket: str, prefix: str = "blobs/", endpoint_url: Optional[str] = None,
+                 region: Optional[str] = None, redirect: bool = True, url_ttl: int = 300):
+        if boto3 is None:
+            raise RuntimeError("BLOB_BACKEND=s3 requires the 'boto3' package")
+        self.bucket = bucket
+        self.prefix = prefix
+        self.redirect = redirect
+        self.url_ttl = url_ttl
+        # boto3 is blocking; every call below runs in a worker thread
+        self._s3 = boto3.client("s3", endpoint_url=endpoint_url, region_name=region)
+
+    def key(self, digest: str) -> str:
+        return f"{self.prefix}{digest}"
+
+    async def size(self, digest: str) -> Optional[int]:
+        try:
+            head = await asyncio.to_thread(self._s3.head_object, Bucket=self.bucket, Key=self.key(digest))
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+                return None
+            raise
+        return head["ContentLength"]
+
+    async def put(self, digest: str, staged: Path) -> bool:
+        try:
+            if await self.size(digest) is not None:
+                return False
+            # upload_file switches to a multipart upload for large files by itself
+            await asyncio.to_thread(
+                self._s3.upload_file, str(staged), self.bucket, self.key(digest),
+                ExtraArgs={"ContentType": PDF_MEDIA_TYPE},
+            )
+            return True
+        finally:
+            staged.unlink(missing_ok=True)
+
+    @asynccontextmanager
+    async def local_copy(self, digest: str) -> AsyncIterator[Path]:
+        """The blob downloaded to a temporary file, removed on exit"""
+        fd, name = tempfile.mkstemp(suffix=".pdf")
+        os.close(fd)
+        try:
+            await asyncio.to_thread(self._s3.download_file, self.bucket, self.key(digest), name)
+            yield Path(name)
+        finally:
+            os.unlink(name)
+
+    async def _stream(self, body) -> AsyncIterator[bytes]:
+        try:
+            while chunk := await asyncio.to_thread(body.read, READ_CHUNK_BYTES):
+                yield chunk
+        finally:
+            body.close()
+
+    async def response(self, request: Request, digest: str, filename: str,
+                       media_type: str = PDF_MEDIA_TYPE) -> Response:
+        if self.redirect:
+            url = await asyncio.to_thread(
+                self._s3.generate_presigned_url, "get_object",
+                Params={
+                    "Bucket": self.bucket, "Key": self.key(digest),
+                    "ResponseContentType": media_type,
+                    "ResponseContentDisposition": content_disposition(filename),
+                },
+                ExpiresIn=self.url_ttl,
+            )
+            return RedirectResponse(url, status_code=307, headers={"Cache-Control": "no-store"})
+
+        size = await self.size(digest)
+        if size is None:
+            raise HTTPException(status_code=404, detail="File not found")
+        plan = plan_response(request, digest, size, filename)
+        if isinstance(plan, Response):
+            return plan
+        status_code, start, end, headers = plan
+        if request.method == "HEAD":
+            return Response(status_code=status_code, headers=headers, media_type=media_type)
+        obj = await asyncio.to_thread(
+            self._s3.get_object, Bucket=self.bucket, Key=self.key(digest), Range=f"bytes={start}-{end}"
+        )
+        return StreamingResponse(self._stream(obj["Body"]), status_code=status_code, headers=headers,
+                                 media_type=media_type)
+
+
+def blobs_from_env():
+    if os.environ.get('BLOB_BACKEND', 'local') == 's3':
+        return S3BlobStore(
+            os.environ['BLOB_S3_BUCKET'],
+            prefix=os.environ.get('BLOB_S3_PREFIX', 'blobs/'),
+            endpoint_url=os.environ.get('BLOB_S3_ENDPOINT_URL') or None,
+            region=os.environ.get('BLOB_S3_REGION') or None,
+            redirect=os.environ.get('BLOB_S3_REDIRECT', 'true').strip().lower() in ('1', 'true', 'yes', 'on'),
+            url_ttl=int(os.environ.get('BLOB_S3_URL_TTL_SECONDS', '300')),
+        )
+    return LocalBlobStore(Path(os.environ.get('BLOB_DIR', str(ROOT_DIR / 'blobs'))))
@@ -0,0 +1,162 @@
+"""Response cache for read-heavy list endpoints.
+
+Entries are keyed on route + query string + the current generation of
+every tag the response depends on. Writers invalidate by bumping a tag's
+generation, so stale entries are never read again and simply age out.
+Each entry stores the ETag alongside the rendered JSON body so a
+matching If-None-Match costs a 304 with no body. A body large enough to
+compress is also stored once per Content-Encoding it has been asked
+for, under the same key plus the encoding, so a hit is served without
+compressing it again. Each encoding is sent with its own ETag
+(compression.encoded_etag).
+
+The in-process backend is per worker; with several workers set
+CACHE_BACKEND=redis so invalidations are shared.
+"""
+import hashlib
+import os
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Iterable, Optional
+
+from fastapi import Request, Response
+
+from compression import MIN_COMPRESS_BYTES, compress, encoded_etag, negotiate
+from serialization import timed_dumps
+
+try:
+    import redis.asyncio as aioredis
+except ImportError:  # optional dependency
+    aioredis = None
+
+
+class MemoryBackend:
+    """LRU with per-entry TTL; generations are kept outside the LRU"""
+
+    def __init__(self, max_entries: int = 1024):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        # Evicting a generation would reset it and resurrect stale entries
+        self._generations = {}
+
+    async def get(self, key: str) -> Optional[bytes]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    async def set(self, key: str, value: bytes, ttl: float):
+        self._entries[key] = (time.monotonic() + ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def generations(self, tags: Iterable[str]) -> list:
+        return [self._generations.get(tag, 0) for tag in tags]
+
+    async def bump(self, tags: Iterable[str]):
+        for tag in tags:
+            self._generations[tag] = self._generations.get(tag, 0) + 1
+
+    async def clear(self):
+        self._entries.clear()
+
+
+class RedisBackend:
+    """Shared backend for multi-worker deployments"""
+
+    def __init__(self, url: str, prefix: str = "kamati:cache:"):
+        if aioredis is None:
+            raise RuntimeError("CACHE_BACKEND=redis requires the 'redis' package")
+        self._redis = aioredis.from_url(url)
+        self._prefix = prefix
+
+    async def get(self, key: str) -> Optional[bytes]:
+        return await self._redis.get(self._prefix + key)
+
+    async def set(self, key: str, value: bytes, ttl: float):
+        await self._redis.set(self._prefix + key, value, px=int(ttl * 1000))
+
+    async def generations(self, tags: Iterable[str]) -> list:
+        tags = list(tags)
+        if not tags:
+            return []
+        values = await self._redis.mget([self._prefix + "gen:" + tag for tag in tags])
+        return [int(value) if value else 0 for value in values]
+
+    async def bump(self, tags: Iterable[str]):
+        async with self._redis.pipeline(transaction=False) as pipe:
+            for tag in tags:
+                pipe.incr(self._prefix + "gen:" + tag)
+            await pipe.execute()
+
+    async def clear(self):
+        async for key in self._redis.scan_iter(match=self._prefix + "*"):
+            if not key.decode().startswith(self._prefix + "gen:"):
+                await self._redis.delete(key)
+
+
+class ResponseCache:
+    def __init__(self, backend, ttl: float = 30.0, min_compress_bytes: int = MIN_COMPRESS_BYTES):
+        self.backend = backend
+        self.ttl = ttl
+        self.min_compress_bytes = min_compress_bytes
+
+    async def _key(self, request: Request, tags: list) -> str:
+        params = "&".join(f"{k}={v}" for k, v in sorted(request.query_params.multi_items()))
+        generations = await self.backend.generations(tags)
+        versions = ",".join(f"{tag}@{gen}" for tag, gen in zip(tags, generations))
+        return f"{request.url.path}?{params}|{versions}"
+
+    async def invalidate(self, *tags: str):
+        await self.backend.bump(tags)
+
+    async def respond(self, request: Request, tags: Iterable[str], produce: Callable[[], Awaitable]) -> Response:
+        """Serve a JSON body from cache, or produce, render and store it
+
+        produce() may return ready-made JSON bytes or any orjson-encodable value.
+        """
+        tags = list(tags)
+        key = await self._key(request, tags)
+        encoding = negotiate(request.headers.get("accept-encoding", ""))
+        # Only bodies of at least min_compress_bytes are ever stored encoded
+        entry = await self.backend.get(f"{key}|{encoding}") if encoding else None
+        if entry is None:
+            entry = await self.backend.get(key)
+            if entry is None:
+                body = await produce()
+                if not isinstance(body, bytes):
+                    body = timed_dumps(body)
+                etag = '"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"'
+                entry = etag.encode() + b"\n" + body
+                await self.backend.set(key, entry, self.ttl)
+            etag, body = entry.split(b"\n", 1)
+            if encoding and len(body) >= self.min_compress_bytes:
+                entry = etag + b"\n" + compress(body, encoding)
+                await self.backend.set(f"{key}|{encoding}", entry, self.ttl)
+            else:
+                encoding = None
+        etag, body = entry.split(b"\n", 1)
+        etag = encoded_etag(etag.decode(), encoding)
+
+        headers = {"ETag": etag, "Cache-Control": "no-cache", "Vary": "Accept-Encoding"}
+        if_none_match = request.headers.get("if-none-match", "")
+        if etag in (tag.strip() for tag in if_none_match.split(",")) or if_none_match.strip() == "*":
+            return Response(status_code=304, headers=headers)
+        if encoding:
+            headers["Content-Encoding"] = encoding
+        return Response(content=body, media_type="application/json", headers=headers)
+
+
+def cache_from_env(min_compress_bytes: int = MIN_COMPRESS_BYTES) -> ResponseCache:
+    ttl = float(os.environ.get('CACHE_TTL_SECONDS', '30'))
+    if os.environ.get('CACHE_BACKEND', 'memory') == 'redis':
+        backend = RedisBackend(os.environ.get('REDIS_URL', 'redis://localhost:6379/0'))
+    else:
+        backend = MemoryBackend(int(os.environ.get('CACHE_MAX_ENTRIES', '1024')))
+    return ResponseCache(backend, ttl, min_compress_bytes)
@@ -0,0 +1,202 @@
+"""The notes catalog behind GET /api/catalog.
+
+A snapshot is every note grouped by subject and semester:
+
+    {"version": 42, "full": true, "subjects": {"Data Science": {"3": [note, ...]}}}
+
+Each note write takes the next catalog version from a counter document
+and appends one entry to the `catalog_changes` log:
+
+    {"version": 43, "op": "upsert", "note": {...}}
+    {"version": 44, "op": "remove", "id": "..."}
+
+A client that already holds version N asks for ?since=N and gets only
+the entries after it:
+
+    {"version": 44, "full": false, "since": 42, "changes": [...]}
+
+Applying an entry twice is harmless (upsert/remove by id), so a
+snapshot may already contain changes from just after its version. Log
+entries expire after CHANGE_RETENTION_DAYS; a client older than the log,
+or more than MAX_DELTA_CHANGES behind, gets a full snapshot instead.
+
+Snapshots are rendered and compressed once per version per process and
+carry a strong ETag per version and encoding, so an unchanged catalog
+costs one counter read and a 304. The version counter and log live in MongoDB; with another
+storage engine `db` is None, nothing is logged and every request gets a
+freshly read snapshot at version 0.
+"""
+import asyncio
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from fastapi import Request, Response
+from pymongo import ReturnDocument
+
+from compression import MIN_COMPRESS_BYTES, compress, encoded_etag, negotiate
+from serialization import timed_dumps
+
+logger = logging.getLogger(__name__)
+
+CHANGES_COLLECTION = "catalog_changes"
+COUNTERS_COLLECTION = "counters"
+VERSION_ID = "catalog_version"
+CHANGE_RETENTION_DAYS = 30
+MAX_DELTA_CHANGES = 500
+# A missing version younger than this is a write still landing, not a lost one
+GAP_GRACE = timedelta(seconds=10)
+
+CATALOG_PROJECTION = {
+    "_id": 0, "id": 1, "title": 1, "subject": 1, "semester": 1, "size": 1, "size_bytes": 1, "file_url": 1,
+    "uploaded_at": 1,
+}
+_ENTRY_FIELDS = ("id", "title", "size", "size_bytes", "file_url", "uploaded_at")
+
+
+def catalog_entry(note: dict) -> dict:
+    """A note as listed under its subject and semester"""
+    return {field: note.get(field) for field in _ENTRY_FIELDS}
+
+
+def change_note(note: dict) -> dict:
+    """A note as carried by a change entry, which also needs its grouping"""
+    return {field: note.get(field) for field in CATALOG_PROJECTION if field != "_id"}
+
+
+async def record_changes(db, upserted: Iterable[dict] = (), removed: Iterable[str] = ()):
+    """Append one log entry per written or deleted note, under consecutive versions
+
+    If the log cannot be written, every client is sent back to a full
+    snapshot rather than silently missing the change.
+    """
+    changes = [{"op": "upsert", "note": change_note(note)} for note in upserted]
+    changes += [{"op": "remove", "id": note_id} for note_id in removed]
+    if not changes or db is None:
+        return
+    try:
+        counter = await db[COUNTERS_COLLECTION].find_one_and_update(
+            {"_id": VERSION_ID}, {"$inc": {"value": len(changes)}},
+            upsert=True, return_document=ReturnDocument.AFTER,
+        )
+        first = counter["value"] - len(changes) + 1
+        now = datetime.now(timezone.utc)
+        await db[CHANGES_COLLECTION].insert_many(
+            [dict(change, version=first + offset, at=now) for offset, change in enumerate(changes)],
+            ordered=False,
+        )
+    except Exception:
+        logger.exception("Catalog change log write failed; forcing clients to resync")
+        try:
+            await db[COUNTERS_COLLECTION].update_one(
+                {"_id": VERSION_ID}, [{"$set": {"floor": {"$ifNull": ["$value", 0]}}}], upsert=True
+            )
+        except Exception:
+            logger.exception("Catalog resync floor update failed")
+
+
+async def catalog_state(db) -> Tuple[int, int]:
+    """(current version, oldest version a delta can start from)"""
+    counter = await db[COUNTERS_COLLECTION].find_one({"_id": VERSION_ID}) or {}
+    version = counter.get("value", 0)
+    oldest = await db[CHANGES_COLLECTION].find_one({}, {"_id": 0, "version": 1}, sort=[("version", 1)])
+    floor = oldest["version"] - 1 if oldest else version
+    return version, max(floor, counter.get("floor", 0))
+
+
+async def read_snapshot(db, notes) -> dict:
+    # The version is read first: every note write at or below it is already visible
+    version = (await catalog_state(db))[0] if db is not None else 0
+    subjects: Dict[str, Dict[str, List[dict]]] = {}
+    count = 0
+    async for note in notes.by_subject(CATALOG_PROJECTION):
+        subjects.setdefault(note.get("subject"), {}).setdefault(note.get("semester"), []).append(catalog_entry(note))
+        count += 1
+    return {"version": version, "full": True, "count": count, "subjects": subjects}
+
+
+async def read_changes(db, since: int) -> Optional[Tuple[int, List[dict]]]:
+    """(version reached, changes) after `since`, or None if a snapshot is cheaper"""
+    grace_cutoff = datetime.now(timezone.utc) - GAP_GRACE
+    reached, changes = since, []
+    cursor = db[CHANGES_COLLECTION].find({"version": {"$gt": since}}, {"_id": 0}).sort("version", 1)
+    async for entry in cursor.limit(MAX_DELTA_CHANGES + 1):
+        # Stop short of a version whose entry is still being written
+        if entry["version"] != reached + 1 and entry["at"] > grace_cutoff:
+            break
+        if len(changes) == MAX_DELTA_CHANGES:
+            return None
+        reached = entry["version"]
+        entry.pop("version")
+        entry.pop("at")
+        changes.append(entry)
+    return reached, changes
+
+
+def _etag(version: int) -> str:
+    return f'"catalog-{version}"'
+
+
+def _not_modified(request: Request, etag: str) -> bool:
+    if_none_match = request.headers.get("if-none-match", "")
+    return etag in (tag.strip() for tag in if_none_match.split(",")) or if_none_match.strip() == "*"
+
+
+def _encoded_response(body: bytes, encoding: Optional[str], headers: dict) -> Response:
+    headers = dict(headers, Vary="Accept-Encoding")
+    if encoding:
+        headers["Content-Encoding"] = encoding
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
+class Catalog:
+    """Per-process holder of the latest rendered snapshot"""
+
+    def __init__(self, min_compress_bytes: int = MIN_COMPRESS_BYTES):
+        self.min_compress_bytes = min_compress_bytes
+        self._version: Optional[int] = None
+        self._bodies: Dict[Optional[str], bytes] = {}
+        self._lock = asyncio.Lock()
+
+    async def _snapshot_bodies(self, db, notes, version: int) -> Tuple[int, Dict[Optional[str], bytes]]:
+        if self._version is None or self._version < version:
+            async with self._lock:
+                # Another request may have rendered it while this one waited
+                if self._version is None or self._version < version:
+                    snapshot = await read_snapshot(db, notes)
+                    self._bodies = {None: timed_dumps(snapshot)}
+                    self._version = snapshot["version"]
+        return self._version, self._bodies
+
+    def _uncached_response(self, body: bytes, encoding: Optional[str]) -> Response:
+        if encoding and len(body) < self.min_compress_bytes:
+            encoding = None
+        headers = {"Cache-Control": "no-cache"}
+        return _encoded_response(compress(body, encoding) if encoding else body, encoding, headers)
+
+    def _encode(self, bodies: Dict[Optional[str], bytes], encoding: Optional[str]) -> bytes:
+        if encoding not in bodies:
+            bodies[encoding] = compress(bodies[None], encoding)
+        return bodies[encoding]
+
+    async def respond(self, request: Request, db, notes, since: Optional[int] = None) -> Response:
+        encoding = negotiate(request.headers.get("accept-encoding", ""))
+        if db is None:
+            return self._uncached_response(timed_dumps(await read_snapshot(None, notes)), encoding)
+        version, floor = await catalog_state(db)
+        if since is not None and floor <= since <= version:
+            delta = await read_changes(db, since)
+            if delta is not None:
+                reached, changes = delta
+                body = timed_dumps({"version": reached, "full": False, "since": since, "changes": changes})
+                return self._uncached_response(body, encoding)
+
+        etag = encoded_etag(_etag(version), encoding)
+        if _not_modified(request, etag):
+            return Response(status_code=304, headers={"ETag": etag, "Cache-Control": "no-cache",
+                                                      "Vary": "Accept-Encoding"})
+        version, bodies = await self._snapshot_bodies(db, notes, version)
+        return _encoded_response(
+            self._encode(bodies, encoding), encoding,
+            {"ETag": encoded_etag(_etag(version), encoding), "Cache-Control": "no-cache"},
+        )
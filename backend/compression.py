@@ -0,0 +1,177 @@
+"""Content-Encoding negotiation for large JSON bodies.
+
+gzip is always available; brotli is used when the 'brotli' package is
+installed (it is in requirements.txt, but the API runs without it) and
+the client accepts it. Bodies under MIN_COMPRESS_BYTES
+(COMPRESS_MIN_BYTES) are sent as-is, since the headers would cost more
+than the saving.
+
+Each encoding of a body is a different representation, so it gets its
+own strong ETag: the identity ETag with the encoding appended,
+"abc" -> "abc-gzip" (encoded_etag). A cache or client never mistakes
+gzip bytes for identity ones, and If-None-Match still matches the
+representation the client holds.
+
+CompressionMiddleware applies this to every response. Responses that
+already carry a Content-Encoding are left alone, so the response cache
+and the catalog can serve bytes they compressed once and stored. Event
+streams, byte ranges and binary media types (PDFs, thumbnails) are never
+compressed; a streamed body (NDJSON export) is compressed incrementally
+and flushed per chunk, so each line reaches the client when it is sent.
+"""
+import gzip
+import zlib
+from typing import Optional
+
+from starlette.datastructures import Headers, MutableHeaders
+
+try:
+    import brotli
+except ImportError:  # optional dependency
+    brotli = None
+
+MIN_COMPRESS_BYTES = 1024
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+COMPRESSIBLE_TYPES = ("application/json", "application/x-ndjson", "application/javascript", "image/svg+xml")
+
+
+def supported_encodings() -> tuple:
+    return ("br", "gzip") if brotli is not None else ("gzip",)
+
+
+def negotiate(accept_encoding: str) -> Optional[str]:
+    """Best encoding the client accepts (br over gzip), or None for identity"""
+    accepted = {}
+    for part in accept_encoding.split(","):
+        coding, _, params = part.strip().partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        if coding:
+            accepted[coding.strip().lower()] = quality
+    for encoding in supported_encodings():
+        if accepted.get(encoding, accepted.get("*", 0.0)) > 0:
+            return encoding
+    return None
+
+
+def encoded_etag(etag: str, encoding: Optional[str]) -> str:
+    """The ETag of the representation of `etag`'s body in `encoding`"""
+    if not encoding or not etag.endswith('"'):
+        return etag
+    return f'{etag[:-1]}-{encoding}"'
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    if encoding == "gzip":
+        return gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0)
+    raise ValueError(f"Unsupported encoding {encoding!r}")
+
+
+def compressible(content_type: str) -> bool:
+    media_type = content_type.split(";", 1)[0].strip().lower()
+    if media_type == "text/event-stream":
+        # Each event must reach the client as soon as it is written
+        return False
+    return media_type.startswith("text/") or media_type.endswith("+json") or media_type in COMPRESSIBLE_TYPES
+
+
+class _StreamEncoder:
+    """Incremental compressor for bodies sent in several chunks"""
+
+    def __init__(self, encoding: str):
+        if encoding == "br":
+            self._brotli = brotli.Compressor(quality=BROTLI_QUALITY)
+        elif encoding == "gzip":
+            self._brotli = None
+            self._zlib = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, zlib.MAX_WBITS | 16)
+        else:
+            raise ValueError(f"Unsupported encoding {encoding!r}")
+
+    def process(self, chunk: bytes) -> bytes:
+        """Compress a chunk and flush it, so the client can decode everything sent so far"""
+        if self._brotli:
+            return self._brotli.process(chunk) + self._brotli.flush()
+        return self._zlib.compress(chunk) + self._zlib.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self) -> bytes:
+        return self._brotli.finish() if self._brotli else self._zlib.flush()
+
+
+class CompressionMiddleware:
+    """Compress response bodies in the best encoding the client accepts"""
+
+    def __init__(self, app, minimum_size: int = MIN_COMPRESS_BYTES):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    @staticmethod
+    def _eligible(status: int, headers: Headers) -> bool:
+        return (
+            200 <= status < 300 and status not in (204, 206)
+            and "content-encoding" not in headers
+            and "content-range" not in headers
+            and "no-transform" not in headers.get("cache-control", "")
+            and compressible(headers.get("content-type", ""))
+        )
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        encoding = negotiate(Headers(scope=scope).get("accept-encoding", ""))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+        start = None
+        encoder: Optional[_StreamEncoder] = None
+        passthrough = False
+
+        async def send_wrapper(message):
+            nonlocal start, encoder, passthrough
+            if message["type"] == "http.response.start":
+                # Held until the first body chunk shows whether compressing pays off
+                start = message
+                return
+            if passthrough:
+                await send(message)
+                return
+            if encoder is None:
+                headers = MutableHeaders(raw=start["headers"])
+                body = message.get("body", b"")
+                more_body = message.get("more_body", False)
+                if (message["type"] != "http.response.body" or not self._eligible(start["status"], headers)
+                        or (not more_body and len(body) < self.minimum_size)):
+                    passthrough = True
+                    await send(start)
+                    await send(message)
+                    return
+                headers["Content-Encoding"] = encoding
+                headers.add_vary_header("Accept-Encoding")
+                if "etag" in headers:
+                    headers["ETag"] = encoded_etag(headers["etag"], encoding)
+                if not more_body:
+                    body = compress(body, encoding)
+                    headers["Content-Length"] = str(len(body))
+                    await send(start)
+                    await send({"type": "http.response.body", "body": body})
+                    return
+                if "content-length" in headers:
+                    del headers["Content-Length"]
+                encoder = _StreamEncoder(encoding)
+                await send(start)
+            more_body = message.get("more_body", False)
+            chunk = encoder.process(message.get("body", b""))
+            if not more_body:
+                chunk += encoder.finish()
+            if chunk or not more_body:
+                await send({"type": "http.response.body", "body": chunk, "more_body": more_body})
+
+        await self.app(scope, receive, send_wrapper)
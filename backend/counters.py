@@ -0,0 +1,139 @@
+"""Write-behind buffer for counter increments (upvotes).
+
+Increments are coalesced per (collection, id, field) in memory and
+written with one repository increment() per collection (an unordered
+bulk_write on MongoDB) every flush interval or once the number of
+buffered operations reaches a threshold, whichever comes first. A clean shutdown flushes everything; a hard crash loses at most
+one interval's worth of increments. Reads call merge() so users see
+their own clicks before the flush lands; a batch being written counts
+as pending until its write succeeds.
+"""
+import asyncio
+import logging
+from collections import OrderedDict, defaultdict
+from typing import Callable, Dict, Iterable, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+Key = Tuple[str, str, str]
+
+
+class CounterBuffer:
+    def __init__(self, flush_interval: float = 0.25, max_pending_ops: int = 500,
+                 on_flush: Optional[Callable] = None, known_ids: int = 10000):
+        self.flush_interval = flush_interval
+        self.max_pending_ops = max_pending_ops
+        self.on_flush = on_flush
+        self._pending: Dict[Key, int] = defaultdict(int)
+        # Swapped out of _pending by flush() and still being written
+        self._in_flight: Dict[Key, int] = {}
+        self._ops = 0
+        self._storage = None
+        self._task = None
+        self._wake = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        # Ids recently confirmed to exist, with their parent id if any
+        self._known: "OrderedDict[Tuple[str, str], Optional[str]]" = OrderedDict()
+        self._known_limit = known_ids
+
+    # Existence cache, so hot documents skip the lookup on every click
+
+    def known(self, collection: str, doc_id: str):
+        key = (collection, doc_id)
+        if key in self._known:
+            self._known.move_to_end(key)
+            return True, self._known[key]
+        return False, None
+
+    def remember(self, collection: str, doc_id: str, parent: Optional[str] = None):
+        self._known[(collection, doc_id)] = parent
+        self._known.move_to_end((collection, doc_id))
+        while len(self._known) > self._known_limit:
+            self._known.popitem(last=False)
+
+    def forget(self, collection: str, doc_id: str):
+        self._known.pop((collection, doc_id), None)
+        for key in [key for key in self._pending if key[0] == collection and key[1] == doc_id]:
+            del self._pending[key]
+        for key in [key for key in self._in_flight if key[0] == collection and key[1] == doc_id]:
+            del self._in_flight[key]
+
+    # Buffering
+
+    def increment(self, collection: str, doc_id: str, field: str = "upvotes", amount: int = 1):
+        self._pending[(collection, doc_id, field)] += amount
+        self._ops += 1
+        if self._ops >= self.max_pending_ops:
+            self._wake.set()
+
+    def pending(self, collection: str, doc_id: str, field: str = "upvotes") -> int:
+        key = (collection, doc_id, field)
+        return self._pending.get(key, 0) + self._in_flight.get(key, 0)
+
+    def merge(self, collection: str, docs: Iterable[dict], field: str = "upvotes"):
+        """Add unflushed deltas to documents read from the database"""
+        if not self._pending and not self._in_flight:
+            return docs
+        for doc in docs:
+            delta = self.pending(collection, doc.get("id"), field)
+            if delta and field in doc:
+                doc[field] += delta
+        return docs
+
+    async def flush(self):
+        async with self._flush_lock:
+            if not self._pending or self._storage is None:
+                return
+            batch, self._pending, self._ops = self._pending, defaultdict(int), 0
+            self._in_flight = dict(batch)
+            by_collection = defaultdict(lambda: defaultdict(dict))
+            for (collection, doc_id, field), delta in batch.items():
+                if delta:
+                    by_collection[collection][doc_id][field] = delta
+            written = {}
+            try:
+                for collection, deltas in by_collection.items():
+                    try:
+                        await self._storage[collection].increment(deltas)
+                    except Exception:
+                        # Put the deltas back so the next flush retries them
+                        logger.exception("Counter flush to %s failed; requeueing %d updates",
+                                         collection, len(deltas))
+                        for key in [key for key in self._in_flight if key[0] == collection]:
+                            self._pending[key] += self._in_flight.pop(key)
+                    else:
+                        # Written, so reads now see these deltas in the documents themselves
+                        for key in [key for key in self._in_flight if key[0] == collection]:
+                            written[key] = self._in_flight.pop(key)
+            finally:
+                self._in_flight = {}
+            # Requeued deltas are reported by the flush that finally writes them
+            if self.on_flush and written:
+                await self.on_flush(written)
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Counter flush loop error")
+
+    def start(self, storage):
+        self._storage = storage
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
@@ -0,0 +1,115 @@
+"""MongoDB connection lifecycle.
+
+One Motor client per process, created when the app starts rather than at
+import, with pool limits and timeouts from Settings. Startup waits for
+the deployment to answer a ping. A random delay comes first, then
+retries with jittered exponential backoff, so a fleet of workers that
+boots together does not hit the cluster in the same instant. pymongo's
+maxConnecting caps how many sockets each pool opens at once. After the
+ping, a few concurrent pings warm the pool.
+
+`db` reads from the primary. `reader` is the handle that list and search
+routes use; with MONGO_SECONDARY_READS it prefers secondaries and may
+lag the primary slightly.
+"""
+import asyncio
+import logging
+import random
+import time
+from typing import Optional
+
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo.read_preferences import SecondaryPreferred
+
+from metrics import command_metrics
+from settings import Settings
+
+logger = logging.getLogger(__name__)
+
+READY_PING_TIMEOUT = 2.0
+
+
+class MongoConnection:
+    def __init__(self, settings: Settings):
+        self.settings = settings
+        # Tests and benchmarks may install a client before open()
+        self.client = None
+        self.db = None
+        self.reader = None
+        self.ready = False
+        self.started_at: Optional[float] = None
+
+    def open(self):
+        s = self.settings
+        if self.client is None:
+            self.client = AsyncIOMotorClient(
+                s.mongo_url,
+                tz_aware=True,
+                maxPoolSize=s.max_pool_size,
+                minPoolSize=s.min_pool_size,
+                maxConnecting=s.max_connecting,
+                waitQueueTimeoutMS=s.wait_queue_timeout_ms,
+                serverSelectionTimeoutMS=s.server_selection_timeout_ms,
+                readPreference=s.read_preference,
+                event_listeners=[command_metrics],
+            )
+        self.db = self.client[s.db_name]
+        if s.secondary_reads:
+            max_staleness = s.max_staleness_seconds if s.max_staleness_seconds >= 90 else -1
+            self.reader = self.client.get_database(
+                s.db_name, read_preference=SecondaryPreferred(max_staleness=max_staleness)
+            )
+        else:
+            self.reader = self.db
+        return self
+
+    async def ping(self, timeout: Optional[float] = None):
+        command = self.client.admin.command("ping")
+        if timeout is None:
+            return await command
+        return await asyncio.wait_for(command, timeout)
+
+    async def wait_until_ready(self):
+        """Ping until the deployment answers, with a jittered start and backoff"""
+        s = self.settings
+        if s.startup_jitter_ms > 0:
+            await asyncio.sleep(random.uniform(0, s.startup_jitter_ms / 1000))
+        backoff = s.connect_backoff_ms / 1000
+        for attempt in range(1, s.connect_attempts + 1):
+            try:
+                await self.ping()
+                break
+            except Exception as e:
+                if attempt == s.connect_attempts:
+                    raise
+                delay = random.uniform(0, backoff)
+                logger.warning("MongoDB not reachable (attempt %d/%d: %s); retrying in %.1fs",
+                               attempt, s.connect_attempts, e, delay)
+                await asyncio.sleep(delay)
+                backoff = min(backoff * 2, s.connect_backoff_max_ms / 1000)
+        await self.warm_up()
+        self.ready = True
+        self.started_at = time.time()
+
+    async def warm_up(self):
+        """Open pooled connections ahead of the first requests"""
+        count = min(self.settings.warmup_connections, self.settings.max_pool_size)
+        if count > 0:
+            await asyncio.gather(*(self.ping() for _ in range(count)), return_exceptions=True)
+            logger.info("Warmed %d MongoDB connections", count)
+
+    async def check(self) -> dict:
+        """Readiness: started up and the deployment answers a ping now"""
+        if not self.ready:
+            return {"ready": False, "reason": "starting"}
+        try:
+            started = time.perf_counter()
+            await self.ping(READY_PING_TIMEOUT)
+            return {"ready": True, "ping_ms": round((time.perf_counter() - started) * 1000, 2)}
+        except Exception as e:
+            return {"ready": False, "reason": f"MongoDB unreachable: {e}"}
+
+    def close(self):
+        self.ready = False
+        if self.client is not None:
+            self.client.close()
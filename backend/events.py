@@ -0,0 +1,297 @@
+"""Push channel for discussion activity: GET /api/events (Server-Sent Events).
+
+Events, one JSON object each:
+
+    discussion.created  {"discussion": {...list fields}}
+    discussion.updated  {"id", "upvotes", "replies"}
+    discussion.deleted  {"id"}
+    reply.created       {"reply": {...}}
+    reply.updated       {"id", "discussion_id", "upvotes"}
+    reply.deleted       {"id", "discussion_id"}
+    resync              {}  reload the list; events may have been missed
+
+Counts are absolute, so an event applied on top of a list that already
+includes it changes nothing. A new connection starts with a resync.
+
+The hub is in-process pub/sub. Each connection has a bounded queue; a
+connection that falls EVENTS_MAX_QUEUE events behind has its queue
+dropped and receives a single resync instead, so one slow client never
+holds memory or delays the others. The last EVENTS_REPLAY frames are
+kept so a client reconnecting with Last-Event-ID gets exactly what it
+missed.
+
+EVENTS_SOURCE selects where events come from:
+  local         the write handlers publish (one worker)
+  changestream  every worker follows MongoDB change streams on
+                discussions and replies, so clients see writes made
+                by any worker; needs a replica set, and MongoDB 6.0+
+                for delete events
+"""
+import asyncio
+import logging
+import os
+import secrets
+import weakref
+from collections import deque
+from typing import Iterable, Optional, Set
+
+from fastapi import HTTPException, Request
+from fastapi.responses import StreamingResponse
+from pymongo.errors import OperationFailure, PyMongoError
+
+from metrics import EVENT_RESYNCS, EVENTS_PUBLISHED
+from serialization import dumps
+
+logger = logging.getLogger(__name__)
+
+SSE_MEDIA_TYPE = "text/event-stream"
+DISCUSSION_EVENT_FIELDS = ("id", "title", "excerpt", "author", "replies", "upvotes", "created_at")
+REPLY_EVENT_FIELDS = ("id", "discussion_id", "content", "author", "upvotes", "created_at")
+# Sent on connect: tells EventSource how long to wait before reconnecting
+RETRY_MS = 3000
+
+_CLOSE = object()
+_hubs: "weakref.WeakSet[EventHub]" = weakref.WeakSet()
+
+
+def _frame(event_id: Optional[str], event: str, data: dict) -> bytes:
+    head = f"id: {event_id}\n" if event_id else ""
+    return f"{head}event: {event}\n".encode() + b"data: " + dumps(data) + b"\n\n"
+
+
+def _pick(doc: dict, fields: Iterable[str]) -> dict:
+    return {field: doc.get(field) for field in fields}
+
+
+class EventHub:
+    def __init__(self, source: str = "local", max_queue: int = 256, replay_events: int = 1024,
+                 max_subscribers: int = 1000, heartbeat: float = 15.0):
+        if source not in ("local", "changestream"):
+            raise ValueError(f"Unknown EVENTS_SOURCE {source!r}")
+        self.source = source
+        self.max_queue = max_queue
+        self.max_subscribers = max_subscribers
+        self.heartbeat = heartbeat
+        # Event ids restart with the process; the epoch tells a reconnecting client apart
+        self._epoch = secrets.token_hex(4)
+        self._sequence = 0
+        # Oldest event id a reconnecting client can still be replayed from
+        self._floor = 0
+        self._recent: deque = deque(maxlen=replay_events)
+        self._subscribers: Set[asyncio.Queue] = set()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        _hubs.add(self)
+
+    @property
+    def subscriber_count(self) -> int:
+        return len(self._subscribers)
+
+    # Publishing
+
+    def _resync_frame(self) -> bytes:
+        return _frame(f"{self._epoch}-{self._sequence}", "resync", {})
+
+    def publish(self, event: str, data: dict):
+        self._sequence += 1
+        frame = _frame(f"{self._epoch}-{self._sequence}", event, data)
+        self._recent.append((self._sequence, frame))
+        EVENTS_PUBLISHED.inc(event)
+        for queue in self._subscribers:
+            try:
+                queue.put_nowait(frame)
+            except asyncio.QueueFull:
+                # Too far behind: drop its backlog and let it reload instead
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait(self._resync_frame())
+                EVENT_RESYNCS.inc("overflow")
+
+    def notify(self, event: str, data: dict):
+        """Publish a write made by this worker, unless change streams already deliver it"""
+        if self.source == "local":
+            self.publish(event, data)
+
+    def discussion_created(self, discussion: dict):
+        self.notify("discussion.created", {"discussion": _pick(discussion, DISCUSSION_EVENT_FIELDS)})
+
+    def reply_created(self, reply: dict):
+        self.notify("reply.created", {"reply": _pick(reply, REPLY_EVENT_FIELDS)})
+
+    async def notify_counts(self, storage, discussion_ids: Iterable[str] = (), reply_ids: Iterable[str] = ()):
+        """Publish the current counters of documents whose counters just changed"""
+        if self.source != "local":
+            return
+        if not self._subscribers:
+            # Skip the reads; a client reconnecting across this gap reloads instead
+            self._sequence += 1
+            self._floor = self._sequence
+            self._recent.clear()
+            return
+        discussion_ids, reply_ids = list(discussion_ids), list(reply_ids)
+        if discussion_ids:
+            for doc in await storage.discussions.find_many(discussion_ids, {"_id": 0, "id": 1, "upvotes": 1, "replies": 1}):
+                self.publish("discussion.updated", doc)
+        if reply_ids:
+            for doc in await storage.replies.find_many(reply_ids, {"_id": 0, "id": 1, "discussion_id": 1, "upvotes": 1}):
+                self.publish("reply.updated", doc)
+
+    # Subscribing
+
+    def _replay(self, last_event_id: str) -> Optional[list]:
+        """Frames after last_event_id, or None if they are no longer all held"""
+        epoch, _, sequence = last_event_id.partition("-")
+        if epoch != self._epoch or not sequence.isdigit():
+            return None
+        sequence = int(sequence)
+        if sequence > self._sequence or sequence < self._floor:
+            return None
+        if self._recent and sequence < self._recent[0][0] - 1:
+            return None
+        return [frame for number, frame in self._recent if number > sequence]
+
+    def subscribe(self, last_event_id: Optional[str] = None) -> asyncio.Queue:
+        if len(self._subscribers) >= self.max_subscribers:
+            raise HTTPException(status_code=503, detail="Too many event streams open", headers={"Retry-After": "5"})
+        self._loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue(self.max_queue)
+        missed = self._replay(last_event_id) if last_event_id else None
+        if missed is None or len(missed) >= self.max_queue:
+            if last_event_id:
+                EVENT_RESYNCS.inc("replay")
+            queue.put_nowait(self._resync_frame())
+        else:
+            for frame in missed:
+                queue.put_nowait(frame)
+        self._subscribers.add(queue)
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        self._subscribers.discard(queue)
+
+    def close(self):
+        """End every open stream, e.g. when the worker starts draining"""
+        for queue in list(self._subscribers):
+            while not queue.empty():
+                queue.get_nowait()
+            queue.put_nowait(_CLOSE)
+        self._subscribers.clear()
+
+    async def _frames(self, queue: asyncio.Queue):
+        try:
+            yield f"retry: {RETRY_MS}\n\n".encode()
+            while True:
+                try:
+                    item = await asyncio.wait_for(queue.get(), self.heartbeat)
+                except asyncio.TimeoutError:
+                    # Keeps proxies from closing an idle stream
+                    yield b": ping\n\n"
+                    continue
+                if item is _CLOSE:
+                    return
+                yield item
+        finally:
+            self.unsubscribe(queue)
+
+    def stream(self, request: Request) -> StreamingResponse:
+        queue = self.subscribe(request.headers.get("last-event-id"))
+        return StreamingResponse(
+            self._frames(queue),
+            media_type=SSE_MEDIA_TYPE,
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        )
+
+
+def close_streams():
+    """End the streams of every hub in this process; safe to call from a signal handler"""
+    for hub in list(_hubs):
+        if hub._loop is not None and not hub._loop.is_closed():
+            hub._loop.call_soon_threadsafe(hub.close)
+
+
+def hub_from_env() -> EventHub:
+    return EventHub(
+        source=os.environ.get('EVENTS_SOURCE', 'local'),
+        max_queue=int(os.environ.get('EVENTS_MAX_QUEUE', '256')),
+        replay_events=int(os.environ.get('EVENTS_REPLAY', '1024')),
+        max_subscribers=int(os.environ.get('EVENTS_MAX_SUBSCRIBERS', '1000')),
+        heartbeat=float(os.environ.get('EVENTS_HEARTBEAT_SECONDS', '15')),
+    )
+
+
+# Change streams
+
+_WATCHED = ("discussions", "replies")
+_COUNTER_FIELDS = {"discussions": ("upvotes", "replies"), "replies": ("upvotes",)}
+# Inserts, deletes, tombstones and counter changes only; hot_score re-decays would otherwise flood the stream
+_WATCH_PIPELINE = [{"$match": {
+    "ns.coll": {"$in": list(_WATCHED)},
+    "$or": [
+        {"operationType": {"$in": ["insert", "delete"]}},
+        {"operationType": "update", "$or": [
+            {f"updateDescription.updatedFields.{field}": {"$exists": True}}
+            for field in ("upvotes", "replies", "deleted_at")
+        ]},
+    ],
+}}]
+
+
+def change_event(change: dict):
+    """Map a change stream document to (event, data), or None if it cannot be described"""
+    collection, operation = change["ns"]["coll"], change["operationType"]
+    if operation == "insert":
+        doc = change["fullDocument"]
+        if collection == "discussions":
+            return "discussion.created", {"discussion": _pick(doc, DISCUSSION_EVENT_FIELDS)}
+        return "reply.created", {"reply": _pick(doc, REPLY_EVENT_FIELDS)}
+    if operation == "update":
+        doc = change.get("fullDocument")
+        if doc is None:
+            return None
+        if collection == "discussions" and doc.get("deleted_at") is not None:
+            return "discussion.deleted", {"id": doc.get("id")}
+        if collection == "discussions":
+            return "discussion.updated", _pick(doc, ("id",) + _COUNTER_FIELDS[collection])
+        return "reply.updated", _pick(doc, ("id", "discussion_id") + _COUNTER_FIELDS[collection])
+    # Deletes only carry the ObjectId; the pre-image has our id
+    before = change.get("fullDocumentBeforeChange")
+    if before is None:
+        return None
+    if collection == "discussions":
+        return "discussion.deleted", {"id": before.get("id")}
+    return "reply.deleted", {"id": before.get("id"), "discussion_id": before.get("discussion_id")}
+
+
+async def enable_pre_images(db):
+    for collection in _WATCHED:
+        try:
+            await db.command("collMod", collection, changeStreamPreAndPostImages={"enabled": True})
+        except PyMongoError as e:
+            logger.warning("Pre-images unavailable on %s (%s); its deletes will trigger a resync", collection, e)
+
+
+async def follow_changes(db, hub: EventHub, retry_delay: float = 1.0):
+    """Publish discussion and reply changes from MongoDB until cancelled"""
+    await enable_pre_images(db)
+    resume_token = None
+    while True:
+        try:
+            async with db.watch(
+                _WATCH_PIPELINE,
+                full_document="updateLookup",
+                full_document_before_change="whenAvailable",
+                resume_after=resume_token,
+            ) as stream:
+                async for change in stream:
+                    resume_token = stream.resume_token
+                    described = change_event(change)
+                    hub.publish(*(described or ("resync", {})))
+        except asyncio.CancelledError:
+            raise
+        except OperationFailure as e:
+            # The resume point may have rolled off the oplog; start over from now
+            logger.warning("Change stream failed (%s); restarting and resyncing clients", e)
+            resume_token = None
+            hub.publish("resync", {})
+        except Exception:
+            logger.exception("Change stream interrupted; resuming")
+        await asyncio.sleep(retry_delay)
@@ -0,0 +1,75 @@
+"""PDF analysis, run inside the processing pool's worker processes.
+
+Nothing from the web stack is imported here, so a freshly spawned
+worker starts quickly. PyMuPDF gives text, page count and a
+first-page thumbnail; with only `pypdf` installed there is no thumbnail.
+"""
+import os
+from typing import Iterable, Optional
+
+try:
+    import pymupdf as fitz
+except ImportError:  # optional dependency
+    fitz = None
+
+try:
+    import pypdf
+except ImportError:  # optional dependency
+    pypdf = None
+
+
+class UnreadablePDF(Exception):
+    """The file itself cannot be parsed; retrying will not help"""
+
+
+def available() -> bool:
+    return fitz is not None or pypdf is not None
+
+
+def report_pid(pids) -> None:
+    """Pool initializer: tell the parent which process this is, so it can stop a stuck parse"""
+    pids.put(os.getpid())
+
+
+def _collect(texts: Iterable[str], limit: int) -> str:
+    # Pages are extracted lazily, so a long document stops being read at the cap
+    parts, total = [], 0
+    for text in texts:
+        if total >= limit:
+            break
+        parts.append(text[:limit - total])
+        total += len(parts[-1])
+    return "\n".join(parts)
+
+
+def _thumbnail(page, width: int) -> Optional[bytes]:
+    scale = width / page.rect.width if page.rect.width else 1.0
+    return page.get_pixmap(matrix=fitz.Matrix(scale, scale), alpha=False).tobytes("png")
+
+
+def analyze_pdf(path: str, max_text_chars: int, thumbnail_width: int) -> dict:
+    """Text, page count, byte size and a first-page PNG of the PDF at path"""
+    if not available():
+        raise RuntimeError("PDF processing requires the 'pymupdf' or 'pypdf' package")
+    size = os.path.getsize(path)
+    try:
+        if fitz is not None:
+            with fitz.open(path) as document:
+                if document.needs_pass:
+                    raise UnreadablePDF("PDF is password protected")
+                pages = document.page_count
+                text = _collect((page.get_text() for page in document), max_text_chars)
+                thumbnail = _thumbnail(document.load_page(0), thumbnail_width) if pages else None
+        else:
+            reader = pypdf.PdfReader(path)
+            if reader.is_encrypted:
+                raise UnreadablePDF("PDF is password protected")
+            pages = len(reader.pages)
+            text = _collect((page.extract_text() or "" for page in reader.pages), max_text_chars)
+            thumbnail = None
+    except UnreadablePDF:
+        raise
+    except Exception as e:
+        # The path is the server's own; keep it out of the job status
+        raise UnreadablePDF(f"{type(e).__name__}: {str(e).replace(path, 'file')}") from None
+    return {"pages": pages, "size_bytes": size, "text": text, "thumbnail": thumbnail}
@@ -0,0 +1,50 @@
+"""Sparse fieldsets for read endpoints.
+
+Every read route has a default projection, and clients can narrow or
+widen it with `?fields=a,b,c`. The projection is pushed into the Motor
+find call, so unrequested fields never leave the database. List views
+of discussions default to a stored `excerpt` instead of the full
+`content`, which only get_discussion returns by default.
+"""
+from typing import Iterable, Optional, Type
+
+from fastapi import HTTPException
+from pydantic import BaseModel
+
+EXCERPT_LENGTH = 200
+
+
+def make_excerpt(text: Optional[str]) -> Optional[str]:
+    if text is None or len(text) <= EXCERPT_LENGTH:
+        return text
+    return text[:EXCERPT_LENGTH] + "…"
+
+
+def resolve_projection(model: Type[BaseModel], fields: Optional[str], default: Iterable[str],
+                       required: Iterable[str] = ("id",)) -> dict:
+    """Mongo projection for a `fields=` parameter, falling back to the route default"""
+    if fields:
+        wanted = [name.strip() for name in fields.split(",") if name.strip()]
+        unknown = sorted(set(wanted) - set(model.model_fields))
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+    else:
+        wanted = list(default)
+    # Keyset pagination needs the sort key and id of the last row
+    projection = {"_id": 0}
+    for name in [*required, *wanted]:
+        projection[name] = 1
+    return projection
+
+
+async def backfill_excerpts(db):
+    """Give discussions written before excerpts existed their excerpt, server-side"""
+    result = await db.discussions.update_many(
+        {"excerpt": {"$exists": False}},
+        [{"$set": {"excerpt": {"$cond": [
+            {"$gt": [{"$strLenCP": "$content"}, EXCERPT_LENGTH]},
+            {"$concat": [{"$substrCP": ["$content", 0, EXCERPT_LENGTH]}, "…"]},
+            "$content",
+        ]}}}],
+    )
+    return result.modified_count
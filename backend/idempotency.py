@@ -0,0 +1,150 @@
+"""Idempotency-Key support for the create endpoints.
+
+A client that may retry a write sends the same `Idempotency-Key` header
+on every attempt. The first attempt claims the key, runs the write and
+stores the response; a retry gets the stored response back, marked with
+`Idempotent-Replayed: true`, without touching the data collections, so a
+retried reply is not inserted or counted twice.
+
+  - a key reused with a different body or on a different route: 422
+  - a retry while the first attempt is still running: 409, Retry-After
+  - a first attempt that fails releases the key, so it can be retried
+  - a claim left by a crashed worker is taken over after PENDING_TIMEOUT
+
+Keys live in the TTL-indexed `idempotency_keys` collection by default,
+shared by every worker; IDEMPOTENCY_BACKEND=memory keeps them in a
+per-process LRU instead, which is also the default when the storage
+engine is not MongoDB. Either way they are kept for KEY_TTL.
+"""
+import hashlib
+import logging
+import os
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Awaitable, Callable, Optional
+
+from fastapi import HTTPException, Response
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from serialization import dumps, timed_dumps
+
+logger = logging.getLogger(__name__)
+
+KEYS_COLLECTION = "idempotency_keys"
+KEY_TTL = timedelta(hours=24)
+PENDING_TIMEOUT = timedelta(seconds=60)
+MAX_KEY_LENGTH = 255
+
+
+class MemoryBackend:
+    """Claims in an LRU; a single event loop makes claim() atomic"""
+
+    def __init__(self, max_keys: int = 10000):
+        self.max_keys = max_keys
+        self._entries: "OrderedDict[str, dict]" = OrderedDict()
+
+    async def claim(self, db, key: str, fingerprint: str) -> Optional[dict]:
+        now = time.monotonic()
+        entry = self._entries.get(key)
+        if entry is not None and now - entry["claimed"] > KEY_TTL.total_seconds():
+            entry = None
+        stale = (entry is not None and entry["state"] == "pending"
+                 and now - entry["claimed"] > PENDING_TIMEOUT.total_seconds())
+        if entry is None or stale:
+            self._entries[key] = {"fingerprint": fingerprint, "state": "pending", "claimed": now}
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_keys:
+                self._entries.popitem(last=False)
+            return None
+        return entry
+
+    async def complete(self, db, key: str, status: int, body: bytes):
+        entry = self._entries.get(key)
+        if entry is not None:
+            entry.update(state="done", status=status, body=body)
+
+    async def release(self, db, key: str):
+        self._entries.pop(key, None)
+
+
+class MongoBackend:
+    """Claims in a collection; the unique _id makes the first insert win"""
+
+    async def claim(self, db, key: str, fingerprint: str) -> Optional[dict]:
+        now = datetime.now(timezone.utc)
+        try:
+            await db[KEYS_COLLECTION].insert_one(
+                {"_id": key, "fingerprint": fingerprint, "state": "pending", "created_at": now}
+            )
+            return None
+        except DuplicateKeyError:
+            pass
+        # Take over a claim whose worker died before completing it
+        taken = await db[KEYS_COLLECTION].find_one_and_update(
+            {"_id": key, "state": "pending", "created_at": {"$lt": now - PENDING_TIMEOUT}},
+            {"$set": {"fingerprint": fingerprint, "created_at": now}},
+            return_document=ReturnDocument.AFTER,
+        )
+        if taken is not None:
+            return None
+        entry = await db[KEYS_COLLECTION].find_one({"_id": key})
+        if entry is None:
+            # Released or expired in between; claim it afresh
+            return await self.claim(db, key, fingerprint)
+        return entry
+
+    async def complete(self, db, key: str, status: int, body: bytes):
+        await db[KEYS_COLLECTION].update_one(
+            {"_id": key}, {"$set": {"state": "done", "status": status, "body": body}}
+        )
+
+    async def release(self, db, key: str):
+        await db[KEYS_COLLECTION].delete_one({"_id": key, "state": "pending"})
+
+
+class IdempotencyStore:
+    def __init__(self, backend):
+        self.backend = backend
+
+    async def run(self, db, key: Optional[str], scope: str, payload: dict,
+                  perform: Callable[[], Awaitable], status_code: int = 200) -> Response:
+        """Run perform() once per key and respond with its JSON-encoded result"""
+        if key is None:
+            return Response(content=timed_dumps(await perform()), status_code=status_code, media_type="application/json")
+        if not key or len(key) > MAX_KEY_LENGTH:
+            raise HTTPException(status_code=400, detail=f"Idempotency-Key must be 1-{MAX_KEY_LENGTH} characters")
+
+        fingerprint = hashlib.blake2b(scope.encode() + b"\n" + dumps(payload), digest_size=16).hexdigest()
+        entry = await self.backend.claim(db, key, fingerprint)
+        if entry is not None:
+            if entry["fingerprint"] != fingerprint:
+                raise HTTPException(status_code=422, detail="Idempotency-Key was already used for a different request")
+            if entry["state"] != "done":
+                raise HTTPException(
+                    status_code=409, detail="A request with this Idempotency-Key is still in progress",
+                    headers={"Retry-After": "1"},
+                )
+            return Response(
+                content=entry["body"], status_code=entry["status"], media_type="application/json",
+                headers={"Idempotent-Replayed": "true"},
+            )
+
+        try:
+            body = timed_dumps(await perform())
+        except Exception:
+            await self.backend.release(db, key)
+            raise
+        try:
+            await self.backend.complete(db, key, status_code, body)
+        except Exception:
+            # The write itself succeeded; a retry waits out PENDING_TIMEOUT and runs again
+            logger.exception("Storing the response for an idempotency key failed")
+        return Response(content=body, status_code=status_code, media_type="application/json")
+
+
+def idempotency_from_env(default: str = 'mongo') -> IdempotencyStore:
+    if os.environ.get('IDEMPOTENCY_BACKEND', default) == 'memory':
+        return IdempotencyStore(MemoryBackend(int(os.environ.get('IDEMPOTENCY_MAX_KEYS', '10000'))))
+    return IdempotencyStore(MongoBackend())
@@ -0,0 +1,183 @@
+"""Declared MongoDB indexes for every query shape the API issues.
+
+Run directly to inspect or reconcile a database:
+
+    python indexes.py            # report missing / extra indexes
+    python indexes.py --apply    # create anything missing
+    python indexes.py --apply --prune   # also drop undeclared indexes
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+from pathlib import Path
+
+from pymongo import ASCENDING, DESCENDING, IndexModel
+from pymongo.errors import OperationFailure
+
+logger = logging.getLogger(__name__)
+
+REQUIRED_INDEXES = {
+    # List indexes lead with deleted_at: reads match it as null (purge.LIVE), the purger as non-null
+    "notes": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        IndexModel([("deleted_at", ASCENDING), ("uploaded_at", DESCENDING), ("id", DESCENDING)], name="recent"),
+        IndexModel(
+            [("deleted_at", ASCENDING), ("subject", ASCENDING), ("semester", ASCENDING),
+             ("uploaded_at", DESCENDING), ("id", DESCENDING)],
+            name="subject_semester_recent",
+        ),
+        IndexModel(
+            [("deleted_at", ASCENDING), ("subject", ASCENDING), ("uploaded_at", DESCENDING), ("id", DESCENDING)],
+            name="subject_recent",
+        ),
+        IndexModel(
+            [("deleted_at", ASCENDING), ("semester", ASCENDING), ("uploaded_at", DESCENDING), ("id", DESCENDING)],
+            name="semester_recent",
+        ),
+        # Processing and search catch-up find the notes sharing an uploaded PDF
+        IndexModel([("sha256", ASCENDING)], name="sha256", sparse=True),
+        # Bulk ingestion upserts on file_url; notes without a URL and tombstones are exempt,
+        # so a deleted note's URL can be posted again before the purger runs
+        IndexModel(
+            [("file_url", ASCENDING)],
+            name="file_url_unique",
+            unique=True,
+            partialFilterExpression={"file_url": {"$type": "string"}, "deleted_at": {"$type": "null"}},
+        ),
+    ],
+    "discussions": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        IndexModel([("deleted_at", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)], name="recent"),
+        # Ranked feeds (ranking.SORT_FIELDS)
+        IndexModel([("deleted_at", ASCENDING), ("hot_score", DESCENDING), ("id", DESCENDING)], name="hot"),
+        IndexModel([("deleted_at", ASCENDING), ("upvotes", DESCENDING), ("id", DESCENDING)], name="top"),
+        IndexModel([("deleted_at", ASCENDING), ("replies", DESCENDING), ("id", DESCENDING)], name="active"),
+    ],
+    "replies": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        IndexModel(
+            [("discussion_id", ASCENDING), ("created_at", ASCENDING), ("id", ASCENDING)],
+            name="discussion_created",
+        ),
+    ],
+    "feedback": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        IndexModel([("created_at", DESCENDING), ("id", DESCENDING)], name="recent"),
+    ],
+    # Catalog deltas are read by version; entries expire after catalog.CHANGE_RETENTION_DAYS
+    "catalog_changes": [
+        IndexModel([("version", ASCENDING)], name="version_unique", unique=True),
+        IndexModel([("at", ASCENDING)], name="expire", expireAfterSeconds=30 * 24 * 3600),
+    ],
+    # Stored responses for Idempotency-Key retries (idempotency.KEY_TTL)
+    "idempotency_keys": [
+        IndexModel([("created_at", ASCENDING)], name="expire", expireAfterSeconds=24 * 3600),
+    ],
+    # PDF analysis queue (processing.DocumentProcessor); finished jobs are kept 30 days
+    "processing_jobs": [
+        IndexModel([("state", ASCENDING), ("next_attempt_at", ASCENDING)], name="state_due"),
+        IndexModel([("finished_at", ASCENDING)], name="expire", expireAfterSeconds=30 * 24 * 3600),
+    ],
+    # Analysis results per blob; search catch-up scans recently processed ones
+    "documents": [
+        IndexModel([("processed_at", ASCENDING)], name="processed"),
+    ],
+    # Resumable upload sessions, dropped once expires_at passes (uploads.UploadManager)
+    "uploads": [
+        IndexModel([("expires_at", ASCENDING)], name="expire", expireAfterSeconds=0),
+    ],
+}
+
+# Options that change index semantics; anything else (v, ns, background) is noise
+_COMPARED_OPTIONS = ("unique", "sparse", "partialFilterExpression", "expireAfterSeconds")
+
+
+def _signature(index_doc):
+    keys = tuple(
+        (field, int(direction) if isinstance(direction, (int, float)) else direction)
+        for field, direction in index_doc["key"].items()
+    )
+    options = tuple((opt, json.dumps(index_doc.get(opt), sort_keys=True, default=str)) for opt in _COMPARED_OPTIONS)
+    return keys, options
+
+
+async def inspect_indexes(db):
+    """Compare declared indexes with what the database actually has"""
+    report = {}
+    for collection, models in REQUIRED_INDEXES.items():
+        existing = {}
+        async for index_doc in db[collection].list_indexes():
+            if index_doc["name"] != "_id_":
+                existing[index_doc["name"]] = index_doc
+
+        missing, mismatched, present = [], [], []
+        for model in models:
+            wanted = model.document
+            name = wanted["name"]
+            if name not in existing:
+                missing.append(name)
+            elif _signature(existing[name]) != _signature(wanted):
+                mismatched.append(name)
+            else:
+                present.append(name)
+
+        declared = {model.document["name"] for model in models}
+        extra = sorted(name for name in existing if name not in declared)
+        report[collection] = {"present": present, "missing": missing, "mismatched": mismatched, "extra": extra}
+    return report
+
+
+def is_healthy(report):
+    return not any(entry["missing"] or entry["mismatched"] for entry in report.values())
+
+
+async def ensure_indexes(db, prune=False):
+    """Create missing indexes, rebuild mismatched ones and optionally drop extras"""
+    report = await inspect_indexes(db)
+    for collection, entry in report.items():
+        models = {model.document["name"]: model for model in REQUIRED_INDEXES[collection]}
+        for name in entry["mismatched"]:
+            logger.warning("Rebuilding index %s.%s with declared definition", collection, name)
+            await db[collection].drop_index(name)
+        for name in entry["missing"] + entry["mismatched"]:
+            try:
+                await db[collection].create_indexes([models[name]])
+                logger.info("Created index %s.%s", collection, name)
+            except OperationFailure as e:
+                # e.g. existing duplicates block a unique index; keep going with the rest
+                logger.error("Could not create index %s.%s: %s", collection, name, e)
+        for name in entry["extra"]:
+            if prune:
+                await db[collection].drop_index(name)
+                logger.info("Dropped undeclared index %s.%s", collection, name)
+            else:
+                logger.warning("Undeclared index %s.%s left in place", collection, name)
+    return await inspect_indexes(db)
+
+
+async def _main(args):
+    from dotenv import load_dotenv
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    load_dotenv(Path(__file__).parent / '.env')
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'])
+    try:
+        db = client[os.environ['DB_NAME']]
+        if args.apply:
+            report = await ensure_indexes(db, prune=args.prune)
+        else:
+            report = await inspect_indexes(db)
+        print(json.dumps(report, indent=2))
+        return 0 if is_healthy(report) else 1
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Inspect or reconcile the API's MongoDB indexes")
+    parser.add_argument("--apply", action="store_true", help="create missing and rebuild mismatched indexes")
+    parser.add_argument("--prune", action="store_true", help="with --apply, drop indexes that are not declared")
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    raise SystemExit(asyncio.run(_main(parser.parse_args())))
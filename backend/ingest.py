@@ -0,0 +1,250 @@
+"""Bulk note ingestion.
+
+Shared by POST /api/notes/bulk and the catalog importer below. Rows are
+validated in batches and written with one notes repository
+insert_batch() per batch (an unordered bulk_write on MongoDB). Rows that
+carry a file_url are deduplicated on it, so re-running an import never
+duplicates a note.
+
+Import the static frontend catalog in one shot:
+
+    python ingest.py ../frontend/src/notes/notesData.js
+    python ingest.py ../frontend/src/notes/notesData.js --api http://localhost:8001/api
+"""
+import argparse
+import asyncio
+import json
+import os
+from pathlib import Path
+from typing import AsyncIterator, Iterable, Tuple
+
+from fastapi import HTTPException, Request
+from pydantic import ValidationError
+from catalog import record_changes
+from models import Note, NoteImport
+from storage import DUPLICATE, INSERTED, MongoNotesRepo
+
+DEFAULT_BATCH_SIZE = 500
+NDJSON_TYPES = ("application/x-ndjson", "application/ndjson", "application/jsonl")
+
+Row = Tuple[int, object]
+
+
+async def iter_request_rows(request: Request) -> AsyncIterator[Row]:
+    """Yield (row number, parsed row or error) from a JSON array or NDJSON body"""
+    content_type = request.headers.get("content-type", "").split(";")[0].strip().lower()
+    if content_type in NDJSON_TYPES:
+        row_number, buffer = 0, b""
+        async for chunk in request.stream():
+            buffer += chunk
+            *lines, buffer = buffer.split(b"\n")
+            for line in lines:
+                if line.strip():
+                    yield row_number, _loads(line)
+                    row_number += 1
+        if buffer.strip():
+            yield row_number, _loads(buffer)
+        return
+
+    try:
+        rows = json.loads(await request.body())
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Body must be a JSON array or NDJSON")
+    if not isinstance(rows, list):
+        raise HTTPException(status_code=400, detail="Body must be a JSON array or NDJSON")
+    for row_number, row in enumerate(rows):
+        yield row_number, row
+
+
+def _loads(line: bytes):
+    try:
+        return json.loads(line)
+    except ValueError as e:
+        return e
+
+
+async def _aiter(rows: Iterable[Row]) -> AsyncIterator[Row]:
+    for row in rows:
+        yield row
+
+
+async def ingest_notes(notes, rows, batch_size: int = DEFAULT_BATCH_SIZE):
+    """Validate and write rows in batches; returns (report, newly inserted documents)"""
+    if not hasattr(rows, "__aiter__"):
+        rows = _aiter(rows)
+    report = {"received": 0, "inserted": 0, "duplicates": 0, "errors": []}
+    inserted = []
+    batch = []
+
+    async for row_number, raw in rows:
+        report["received"] += 1
+        if isinstance(raw, Exception):
+            report["errors"].append({"row": row_number, "error": f"Invalid JSON: {raw}"})
+            continue
+        if not isinstance(raw, dict):
+            report["errors"].append({"row": row_number, "error": "Row must be a JSON object"})
+            continue
+        try:
+            row = NoteImport(**raw)
+        except ValidationError as e:
+            report["errors"].append({"row": row_number, "error": e.errors(include_url=False)})
+            continue
+        note = Note(**{key: value for key, value in row.dict().items() if value is not None})
+        batch.append((row_number, note.dict()))
+        if len(batch) >= batch_size:
+            inserted += await _write_batch(notes, batch, report)
+            batch = []
+
+    if batch:
+        inserted += await _write_batch(notes, batch, report)
+    return report, inserted
+
+
+async def _write_batch(notes, batch, report):
+    outcomes = await notes.insert_batch([doc for _, doc in batch])
+    inserted = []
+    for (row_number, doc), outcome in zip(batch, outcomes):
+        if outcome == INSERTED:
+            report["inserted"] += 1
+            inserted.append(doc)
+        elif outcome == DUPLICATE:
+            report["duplicates"] += 1
+        else:
+            report["errors"].append({"row": row_number, "error": outcome})
+    return inserted
+
+
+# Catalog importer
+
+def _js_object_to_json(source: str) -> str:
+    """Convert a plain JS object literal (unquoted keys, trailing commas, comments) to JSON"""
+    out, i, n = [], 0, len(source)
+    while i < n:
+        ch = source[i]
+        if ch in "\"'":
+            j, chars = i + 1, []
+            while source[j] != ch:
+                if source[j] == "\\":
+                    chars.append(source[j:j + 2])
+                    j += 2
+                    continue
+                chars.append(source[j])
+                j += 1
+            text = "".join(chars)
+            if ch == "'":
+                text = text.replace("\\'", "'").replace('"', '\\"')
+            out.append('"' + text + '"')
+            i = j + 1
+        elif source.startswith("//", i):
+            i = source.find("\n", i)
+            i = n if i == -1 else i
+        elif source.startswith("/*", i):
+            i = source.index("*/", i) + 2
+        elif ch.isalpha() or ch in "_$":
+            j = i
+            while j < n and (source[j].isalnum() or source[j] in "_$"):
+                j += 1
+            word = source[i:j]
+            k = j
+            while k < n and source[k].isspace():
+                k += 1
+            out.append(f'"{word}"' if k < n and source[k] == ":" else word)
+            i = j
+        elif ch == ",":
+            k = i + 1
+            while k < n and (source[k].isspace()):
+                k += 1
+            if k < n and source[k] in "}]":
+                i += 1
+                continue
+            out.append(ch)
+            i += 1
+        else:
+            out.append(ch)
+            i += 1
+    return "".join(out)
+
+
+def parse_notes_data(text: str) -> dict:
+    """Extract the notesData object from frontend/src/notes/notesData.js"""
+    start = text.index("{", text.index("notesData"))
+    depth, i, quote = 0, start, None
+    while True:
+        ch = text[i]
+        if quote:
+            if ch == "\\":
+                i += 1
+            elif ch == quote:
+                quote = None
+        elif ch in "\"'":
+            quote = ch
+        elif ch == "{":
+            depth += 1
+        elif ch == "}":
+            depth -= 1
+            if depth == 0:
+                break
+        i += 1
+    return json.loads(_js_object_to_json(text[start:i + 1]))
+
+
+def catalog_rows(notes_data: dict):
+    """Flatten {subject: [entries]} into bulk-ingestion rows"""
+    rows = []
+    for subject, entries in notes_data.items():
+        for entry in entries:
+            row = {
+                "title": entry.get("title"),
+                "subject": subject,
+                "semester": entry.get("semester"),
+                "size": entry.get("size"),
+                "file_url": entry.get("url"),
+            }
+            if entry.get("uploaded_at"):
+                row["uploaded_at"] = entry["uploaded_at"]
+            rows.append(row)
+    return rows
+
+
+async def _import_to_db(rows, batch_size):
+    from dotenv import load_dotenv
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    load_dotenv(Path(__file__).parent / '.env')
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'], tz_aware=True)
+    try:
+        db = client[os.environ['DB_NAME']]
+        report, inserted = await ingest_notes(MongoNotesRepo(db, db), enumerate(rows), batch_size)
+        # Running servers pick the new notes up as catalog deltas
+        await record_changes(db, upserted=inserted)
+        return report
+    finally:
+        client.close()
+
+
+def _import_to_api(rows, api_url):
+    import requests
+
+    body = "\n".join(json.dumps(row) for row in rows)
+    response = requests.post(
+        f"{api_url.rstrip('/')}/notes/bulk",
+        data=body.encode(),
+        headers={"Content-Type": "application/x-ndjson"},
+    )
+    response.raise_for_status()
+    return response.json()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Import the static notesData catalog into the notes collection")
+    parser.add_argument("path", help="path to notesData.js")
+    parser.add_argument("--api", help="post to a running API (e.g. http://localhost:8001/api) instead of MongoDB")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    args = parser.parse_args()
+
+    rows = catalog_rows(parse_notes_data(Path(args.path).read_text(encoding="utf-8")))
+    if args.api:
+        result = _import_to_api(rows, args.api)
+    else:
+        result = asyncio.run(_import_to_db(rows, args.batch_size))
+    print(json.dumps(result, indent=2))
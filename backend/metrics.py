@@ -0,0 +1,259 @@
+"""Request and database instrumentation, exposed in Prometheus text format.
+
+MetricsMiddleware times every request and labels it with the route
+template (/api/discussions/{discussion_id}), not the raw path, so the
+series stay bounded. CommandMetrics is a pymongo command listener: it
+times each command per collection and operation, counts the documents
+each find/aggregate/getMore batch returns, and logs commands slower
+than SLOW_QUERY_MS. Serialization time is recorded by
+serialization.timed_dumps.
+
+Nothing here depends on prometheus_client; the registry renders the
+exposition format itself.
+"""
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+from typing import Dict, Iterable, Tuple
+
+from pymongo import monitoring
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+DOCUMENT_BUCKETS = (0, 1, 5, 10, 25, 50, 100, 200, 500, 1000, 5000, 10000)
+SERIALIZATION_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1)
+
+Labels = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _label_text(names: Iterable[str], values: Labels, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self._values: Dict[Labels, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values: str, amount: float = 1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help_text}"
+        yield f"# TYPE {self.name} counter"
+        with self._lock:
+            items = list(self._values.items())
+        for label_values, value in items:
+            yield f"{self.name}{_label_text(self.labels, label_values)} {value}"
+
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, labels: Tuple[str, ...] = (), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.buckets = tuple(buckets)
+        # label values -> [per-bucket counts..., +Inf count, sum]
+        self._series: Dict[Labels, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *label_values: str):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [0] * (len(self.buckets) + 2)
+            series[index] += 1
+            series[-1] += value
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help_text}"
+        yield f"# TYPE {self.name} histogram"
+        with self._lock:
+            items = [(label_values, list(series)) for label_values, series in self._series.items()]
+        for label_values, series in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                le = _label_text(self.labels, label_values, f'le="{bound}"')
+                yield f"{self.name}_bucket{le} {cumulative}"
+            cumulative += series[-2]
+            le = _label_text(self.labels, label_values, 'le="+Inf"')
+            yield f"{self.name}_bucket{le} {cumulative}"
+            labels = _label_text(self.labels, label_values)
+            yield f"{self.name}_sum{labels} {series[-1]}"
+            yield f"{self.name}_count{labels} {cumulative}"
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+HTTP_REQUEST_SECONDS = registry.register(Histogram(
+    "http_request_duration_seconds", "Request latency by route template", ("method", "route")
+))
+HTTP_RESPONSES = registry.register(Counter(
+    "http_responses_total", "Responses by route template and status code", ("method", "route", "status")
+))
+MONGO_COMMAND_SECONDS = registry.register(Histogram(
+    "mongo_command_duration_seconds", "MongoDB command latency", ("collection", "command")
+))
+MONGO_COMMAND_FAILURES = registry.register(Counter(
+    "mongo_command_failures_total", "Failed MongoDB commands", ("collection", "command")
+))
+MONGO_DOCUMENTS_RETURNED = registry.register(Histogram(
+    "mongo_documents_returned", "Documents returned per cursor batch", ("collection", "command"),
+    buckets=DOCUMENT_BUCKETS,
+))
+SERIALIZATION_SECONDS = registry.register(Histogram(
+    "response_serialization_seconds", "Time spent encoding response bodies", buckets=SERIALIZATION_BUCKETS
+))
+EVENTS_PUBLISHED = registry.register(Counter(
+    "events_published_total", "Events published to the push hub", ("event",)
+))
+EVENT_RESYNCS = registry.register(Counter(
+    "event_resyncs_total", "Subscribers told to reload instead of receiving missed events", ("reason",)
+))
+PURGED_DOCUMENTS = registry.register(Counter(
+    "purged_documents_total", "Tombstoned documents and their children removed by the purger", ("collection",)
+))
+UPLOADS_COMPLETED = registry.register(Counter(
+    "uploads_completed_total", "Completed uploads, by whether the blob was new or already stored", ("result",)
+))
+PROCESSING_JOBS = registry.register(Counter(
+    "processing_jobs_total", "Finished PDF processing attempts by outcome", ("result",)
+))
+DOCUMENT_PROCESSING_SECONDS = registry.register(Histogram(
+    "document_processing_seconds", "Time to analyse one PDF in the process pool"
+))
+
+PROMETHEUS_MEDIA_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class MetricsMiddleware:
+    """Time requests and label them with the matched route's path template"""
+
+    def __init__(self, app):
+        self.app = app
+        self._templates = {}
+
+    def _template(self, scope) -> str:
+        endpoint = scope.get("endpoint")
+        if endpoint is None:
+            return "unmatched"
+        template = self._templates.get(endpoint)
+        if template is None:
+            template = "unmatched"
+            for route in scope["app"].routes:
+                if getattr(route, "endpoint", None) is endpoint:
+                    template = route.path
+                    break
+            self._templates[endpoint] = template
+        return template
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        status = 500
+        started = time.perf_counter()
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            # The router records the matched endpoint in the scope
+            route = self._template(scope)
+            method = scope["method"]
+            HTTP_REQUEST_SECONDS.observe(time.perf_counter() - started, method, route)
+            HTTP_RESPONSES.inc(method, route, str(status))
+
+
+# getMore names the collection in a separate field
+_COLLECTION_FIELD = {"getMore": "collection"}
+_CURSOR_COMMANDS = {"find", "aggregate", "getMore"}
+
+
+class CommandMetrics(monitoring.CommandListener):
+    def __init__(self, slow_query_ms: float = 0):
+        self.slow_query_ms = slow_query_ms
+        self._inflight: Dict[Tuple, Tuple[str, dict]] = {}
+
+    def _key(self, event):
+        return (event.connection_id, event.request_id)
+
+    def started(self, event):
+        command = event.command
+        collection = command.get(_COLLECTION_FIELD.get(event.command_name, event.command_name))
+        if not isinstance(collection, str):
+            collection = "admin" if event.database_name == "admin" else "-"
+        # Only keep the command body when it might have to be logged as slow
+        self._inflight[self._key(event)] = (collection, command if self.slow_query_ms else None)
+
+    def _finish(self, event):
+        collection, command = self._inflight.pop(self._key(event), ("-", None))
+        seconds = event.duration_micros / 1_000_000
+        MONGO_COMMAND_SECONDS.observe(seconds, collection, event.command_name)
+        if self.slow_query_ms and seconds * 1000 >= self.slow_query_ms:
+            logger.warning(
+                "Slow MongoDB %s on %s took %.1f ms: %s",
+                event.command_name, collection, seconds * 1000, _summarize(command),
+            )
+        return collection
+
+    def succeeded(self, event):
+        collection = self._finish(event)
+        if event.command_name in _CURSOR_COMMANDS:
+            cursor = event.reply.get("cursor") or {}
+            batch = cursor.get("firstBatch", cursor.get("nextBatch"))
+            if batch is not None:
+                MONGO_DOCUMENTS_RETURNED.observe(len(batch), collection, event.command_name)
+
+    def failed(self, event):
+        collection = self._finish(event)
+        MONGO_COMMAND_FAILURES.inc(collection, event.command_name)
+
+
+def _summarize(command) -> str:
+    """The parts of a command worth logging, without documents or session ids"""
+    if not command:
+        return ""
+    keep = ("filter", "sort", "limit", "projection", "pipeline", "batchSize")
+    summary = {key: command[key] for key in keep if key in command}
+    text = repr(summary)
+    return text if len(text) <= 1000 else text[:1000] + "..."
+
+
+command_metrics = CommandMetrics(float(os.environ.get('SLOW_QUERY_MS', '0')))
@@ -0,0 +1,88 @@
+"""Convert legacy ISO-string timestamps to native BSON dates.
+
+Older rows were written with datetimes serialized as strings. Sorting
+and keyset pagination need every row to hold a real date, so this walks
+each collection in batches and rewrites any `*_at` string in place.
+Safe to re-run; rows that are already dates are never touched.
+
+    python migrate_dates.py
+"""
+import asyncio
+import logging
+import os
+from datetime import datetime, timezone
+from pathlib import Path
+
+from pymongo import UpdateOne
+
+logger = logging.getLogger(__name__)
+
+DATE_FIELDS = {
+    "notes": ["uploaded_at"],
+    "discussions": ["created_at"],
+    "replies": ["created_at"],
+    "feedback": ["created_at"],
+}
+
+BATCH_SIZE = 1000
+
+
+def _parse(value: str):
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed
+
+
+async def migrate_collection(collection, field: str) -> int:
+    converted, last_id = 0, None
+    while True:
+        query = {field: {"$type": "string"}}
+        if last_id is not None:
+            query["_id"] = {"$gt": last_id}
+        rows = await collection.find(query, {"_id": 1, field: 1}).sort("_id", 1).to_list(length=BATCH_SIZE)
+        if not rows:
+            return converted
+        last_id = rows[-1]["_id"]
+        operations = []
+        for row in rows:
+            parsed = _parse(row[field])
+            if parsed is None:
+                logger.warning("Leaving unparseable %s.%s=%r on %s", collection.name, field, row[field], row["_id"])
+                continue
+            operations.append(UpdateOne({"_id": row["_id"]}, {"$set": {field: parsed}}))
+        if operations:
+            await collection.bulk_write(operations, ordered=False)
+            converted += len(operations)
+
+
+async def migrate_dates(db) -> dict:
+    """Rewrite string timestamps in every collection; returns counts per field"""
+    report = {}
+    for collection, fields in DATE_FIELDS.items():
+        for field in fields:
+            count = await migrate_collection(db[collection], field)
+            if count:
+                logger.info("Converted %d %s.%s values to dates", count, collection, field)
+            report[f"{collection}.{field}"] = count
+    return report
+
+
+async def _main():
+    from dotenv import load_dotenv
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    load_dotenv(Path(__file__).parent / '.env')
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'])
+    try:
+        print(await migrate_dates(client[os.environ['DB_NAME']]))
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    asyncio.run(_main())
@@ -0,0 +1,76 @@
+from pydantic import BaseModel, Field
+from typing import Optional
+import uuid
+from datetime import datetime, timezone
+
+class Note(BaseModel):
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    title: str
+    subject: str
+    semester: str
+    size: Optional[str] = None
+    file_url: Optional[str] = None
+    # Set for uploaded files: the stored byte count and the blob's content address
+    size_bytes: Optional[int] = None
+    sha256: Optional[str] = None
+    # Filled in by background processing of the uploaded PDF
+    page_count: Optional[int] = None
+    thumbnail_url: Optional[str] = None
+    uploaded_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+
+class NoteCreate(BaseModel):
+    title: str
+    subject: str
+    semester: str
+    size: Optional[str] = None
+    file_url: Optional[str] = None
+
+class NoteImport(NoteCreate):
+    """A catalog row for bulk ingestion; keeps the original upload date when known"""
+    uploaded_at: Optional[datetime] = None
+
+class NoteUpload(BaseModel):
+    """What a completed upload becomes; size and file_url come from the stored file"""
+    title: str
+    subject: str
+    semester: str
+
+class Discussion(BaseModel):
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    title: str
+    content: str
+    excerpt: Optional[str] = None
+    author: Optional[str] = "Anonymous"
+    replies: int = 0
+    upvotes: int = 0
+    hot_score: float = 0.0
+    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+
+class DiscussionCreate(BaseModel):
+    title: str
+    content: str
+    author: Optional[str] = "Anonymous"
+
+class Reply(BaseModel):
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    discussion_id: str
+    content: str
+    author: Optional[str] = "Anonymous"
+    upvotes: int = 0
+    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+
+class ReplyCreate(BaseModel):
+    content: str
+    author: Optional[str] = "Anonymous"
+
+class Feedback(BaseModel):
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    rating: int
+    comment: Optional[str] = None
+    name: Optional[str] = None
+    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+
+class FeedbackCreate(BaseModel):
+    rating: int
+    comment: Optional[str] = None
+    name: Optional[str] = None
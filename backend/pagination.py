@@ -0,0 +1,87 @@
+import base64
+import json
+from datetime import datetime
+from typing import Any, Generic, List, Optional, Tuple, TypeVar
+
+from fastapi import HTTPException
+from pydantic import BaseModel
+
+T = TypeVar("T")
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+
+class Page(BaseModel, Generic[T]):
+    items: List[T]
+    next_cursor: Optional[str] = None
+
+
+def _encode_value(value):
+    if isinstance(value, datetime):
+        return {"$date": value.isoformat()}
+    return value
+
+
+def _decode_value(value):
+    if isinstance(value, dict) and "$date" in value:
+        return datetime.fromisoformat(value["$date"])
+    return value
+
+
+def encode_cursor(sort_field: str, sort_value: Any, item_id: str) -> str:
+    """Pack the (sort value, id) seek position, and the field it was sorted on, into an opaque token"""
+    raw = json.dumps([sort_field, _encode_value(sort_value), item_id], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, sort_field: str) -> Tuple[Any, str]:
+    """Unpack a token produced by encode_cursor for the same sort field"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        cursor_field, sort_value, item_id = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        sort_value, item_id = _decode_value(sort_value), str(item_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    # A position in one order means nothing in another, and values of another type would not compare
+    if cursor_field != sort_field:
+        raise HTTPException(status_code=400, detail="Cursor belongs to a different sort order")
+    return sort_value, item_id
+
+
+def seek_filter(sort_field: str, cursor: Optional[str], descending: bool = True) -> dict:
+    """Build the keyset condition that resumes after the cursor position"""
+    if not cursor:
+        return {}
+    sort_value, item_id = decode_cursor(cursor, sort_field)
+    op = "$lt" if descending else "$gt"
+    return {
+        "$or": [
+            {sort_field: {op: sort_value}},
+            {sort_field: sort_value, "id": {op: item_id}},
+        ]
+    }
+
+
+def sort_spec(sort_field: str, descending: bool = True) -> list:
+    direction = -1 if descending else 1
+    return [(sort_field, direction), ("id", direction)]
+
+
+async def fetch_page(collection, filter_query: dict, sort_field: str, limit: int,
+                     cursor: Optional[str] = None, descending: bool = True, projection: Optional[dict] = None):
+    """Fetch one keyset page; returns (documents, next_cursor)"""
+    seek = seek_filter(sort_field, cursor, descending)
+    if seek and filter_query:
+        query = {"$and": [filter_query, seek]}
+    else:
+        query = seek or filter_query
+
+    # One extra row tells us whether another page exists without a count
+    docs = await collection.find(query, projection).sort(sort_spec(sort_field, descending)).limit(limit + 1).to_list(length=limit + 1)
+    next_cursor = None
+    if len(docs) > limit:
+        docs = docs[:limit]
+        last = docs[-1]
+        next_cursor = encode_cursor(sort_field, last[sort_field], last["id"])
+    return docs, next_cursor
@@ -0,0 +1,310 @@
+"""Background analysis of uploaded note PDFs.
+
+Completing an upload queues a job for the new note in `processing_jobs`.
+Each API worker runs a DocumentProcessor that claims due jobs and hands
+the PDF to a bounded process pool (extract.analyze_pdf), so parsing and
+rendering never run on the event loop. The results are kept per blob in
+`documents`: text (up to MAX_TEXT_CHARS), page count, byte size and a
+first-page PNG thumbnail, so the same PDF uploaded twice is analysed
+once. The note gets page_count, size_bytes and thumbnail_url, and its
+text joins the notes search index.
+
+A job goes queued -> running -> done. A failed attempt is queued again
+after a backoff (BACKOFF_BASE, doubling up to BACKOFF_MAX) until
+max_attempts, then marked failed; a PDF that cannot be parsed fails at
+once. A running job holds a lease, so a job whose worker died is picked
+up again once the lease lapses.
+
+The pool defaults to half the machine's cores, shared between the
+WEB_CONCURRENCY API workers, and at least one process each;
+PROCESSING_WORKERS overrides it per API worker.
+
+    python processing.py                 # job counts by state
+    python processing.py --backfill      # queue uploaded notes that never had a job
+    python processing.py --retry-failed  # give failed jobs a fresh set of attempts
+"""
+import argparse
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from time import perf_counter
+from typing import Awaitable, Callable, Optional
+
+from bson import Binary
+from fastapi import HTTPException, Request, Response
+from pymongo import ReturnDocument
+
+import extract
+from metrics import DOCUMENT_PROCESSING_SECONDS, PROCESSING_JOBS
+from purge import LIVE
+from search import NOTE_SEARCH_FIELDS
+
+logger = logging.getLogger(__name__)
+
+JOBS_COLLECTION = "processing_jobs"
+DOCUMENTS_COLLECTION = "documents"
+MAX_TEXT_CHARS = 50000
+THUMBNAIL_WIDTH = 320
+BACKOFF_BASE = timedelta(seconds=30)
+BACKOFF_MAX = timedelta(hours=1)
+# A child is replaced after this many PDFs, so leaks in the PDF library stay bounded
+MAX_TASKS_PER_CHILD = 50
+
+
+def default_workers() -> int:
+    web_workers = max(1, int(os.environ.get('WEB_CONCURRENCY', '1')))
+    return max(1, (os.cpu_count() or 1) // (2 * web_workers))
+
+
+def backoff(attempts: int) -> timedelta:
+    return min(BACKOFF_BASE * 2 ** max(attempts - 1, 0), BACKOFF_MAX)
+
+
+async def queue_job(db, note_id: str, digest: str) -> bool:
+    """Queue a note's PDF for analysis; False if it already has a job"""
+    now = datetime.now(timezone.utc)
+    result = await db[JOBS_COLLECTION].update_one(
+        {"_id": note_id},
+        {"$setOnInsert": {"sha256": digest, "state": "queued", "attempts": 0, "next_attempt_at": now,
+                          "created_at": now}},
+        upsert=True,
+    )
+    return result.upserted_id is not None
+
+
+class DocumentProcessor:
+    def __init__(self, blobs, workers: int, timeout: float = 120, max_attempts: int = 5,
+                 on_processed: Optional[Callable[[dict, Optional[str]], Awaitable[None]]] = None):
+        self.blobs = blobs
+        self.workers = workers
+        self.timeout = timeout
+        self.max_attempts = max_attempts
+        # Called with the updated note and its text, to refresh search and cached lists
+        self.on_processed = on_processed
+        self.owner = f"{os.uname().nodename}:{os.getpid()}"
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._pids = None
+        self._wake = asyncio.Event()
+
+    @property
+    def available(self) -> bool:
+        return extract.available()
+
+    def wake(self):
+        self._wake.set()
+
+    async def enqueue(self, db, note_id: str, digest: str):
+        await queue_job(db, note_id, digest)
+        self.wake()
+
+    def _executor(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            # spawn, not fork: the API process has Motor's threads running
+            context = multiprocessing.get_context("spawn")
+            self._pids = context.SimpleQueue()
+            self._pool = ProcessPoolExecutor(
+                self.workers, mp_context=context, max_tasks_per_child=MAX_TASKS_PER_CHILD,
+                initializer=extract.report_pid, initargs=(self._pids,),
+            )
+        return self._pool
+
+    def close(self):
+        pool, self._pool = self._pool, None
+        if pool is not None:
+            # shutdown() cannot stop a running parse; terminate the children so a stuck one gives its core back
+            pids = set()
+            while not self._pids.empty():
+                pids.add(self._pids.get())
+            self._pids.close()
+            for process in multiprocessing.active_children():
+                if process.pid in pids:
+                    process.terminate()
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    async def _claim(self, db) -> Optional[dict]:
+        now = datetime.now(timezone.utc)
+        return await db[JOBS_COLLECTION].find_one_and_update(
+            {"$or": [
+                {"state": "queued", "next_attempt_at": {"$lte": now}},
+                {"state": "running", "lease_until": {"$lt": now}},
+            ]},
+            {"$set": {"state": "running", "owner": self.owner, "started_at": now,
+                      "lease_until": now + timedelta(seconds=self.timeout * 2)},
+             "$inc": {"attempts": 1}},
+            sort=[("next_attempt_at", 1)],
+            return_document=ReturnDocument.AFTER,
+        )
+
+    async def _analyze(self, digest: str) -> dict:
+        loop = asyncio.get_running_loop()
+        started = perf_counter()
+        async with self.blobs.local_copy(digest) as path:
+            future = loop.run_in_executor(
+                self._executor(), extract.analyze_pdf, str(path), MAX_TEXT_CHARS, THUMBNAIL_WIDTH
+            )
+            try:
+                result = await asyncio.wait_for(future, self.timeout)
+            except asyncio.TimeoutError:
+                # Jobs sharing the pool fail with BrokenProcessPool and are retried
+                self.close()
+                raise
+        DOCUMENT_PROCESSING_SECONDS.observe(perf_counter() - started)
+        thumbnail = result["thumbnail"]
+        return {
+            "_id": digest,
+            "pages": result["pages"],
+            "size_bytes": result["size_bytes"],
+            "text": result["text"],
+            "thumbnail": Binary(thumbnail) if thumbnail else None,
+            "has_thumbnail": bool(thumbnail),
+            "processed_at": datetime.now(timezone.utc),
+        }
+
+    async def _apply(self, db, note_id: str, document: dict):
+        fields = {"page_count": document["pages"], "size_bytes": document["size_bytes"]}
+        if document.get("has_thumbnail"):
+            fields["thumbnail_url"] = f"/api/files/{note_id}/thumbnail"
+        note = await db.notes.find_one_and_update(
+            {"id": note_id, **LIVE}, {"$set": fields}, projection=NOTE_SEARCH_FIELDS, return_document=ReturnDocument.AFTER
+        )
+        if note is not None and self.on_processed is not None:
+            await self.on_processed(note, document.get("text"))
+
+    async def _settle(self, db, job: dict, update: dict):
+        if update["state"] != "queued":
+            update["finished_at"] = datetime.now(timezone.utc)
+        await db[JOBS_COLLECTION].update_one(
+            {"_id": job["_id"], "state": "running", "owner": self.owner},
+            {"$set": update, "$unset": {"lease_until": ""}},
+        )
+
+    async def process(self, db, job: dict):
+        try:
+            # An identical PDF may already have been analysed for another note
+            document = await db[DOCUMENTS_COLLECTION].find_one({"_id": job["sha256"]}, {"thumbnail": 0})
+            if document is None:
+                document = await self._analyze(job["sha256"])
+                await db[DOCUMENTS_COLLECTION].replace_one({"_id": job["sha256"]}, document, upsert=True)
+            await self._apply(db, job["_id"], document)
+        except extract.UnreadablePDF as e:
+            logger.warning("Note %s has an unreadable PDF: %s", job["_id"], e)
+            await self._settle(db, job, {"state": "failed", "error": str(e)})
+            PROCESSING_JOBS.inc("failed")
+        except Exception as e:
+            if isinstance(e, BrokenProcessPool):
+                self.close()
+            error = f"{type(e).__name__}: {e}"
+            if job["attempts"] >= self.max_attempts:
+                logger.error("Processing note %s failed for good after %d attempts: %s", job["_id"], job["attempts"], error)
+                await self._settle(db, job, {"state": "failed", "error": error})
+                PROCESSING_JOBS.inc("failed")
+            else:
+                logger.warning("Processing note %s failed, retrying: %s", job["_id"], error)
+                next_attempt = datetime.now(timezone.utc) + backoff(job["attempts"])
+                await self._settle(db, job, {"state": "queued", "error": error, "next_attempt_at": next_attempt})
+                PROCESSING_JOBS.inc("retried")
+        else:
+            await self._settle(db, job, {"state": "done", "error": None})
+            PROCESSING_JOBS.inc("done")
+
+    async def run(self, db, interval: float):
+        """Keep up to `workers` jobs in the pool; sleeps until woken or the next interval"""
+        running = set()
+        try:
+            while True:
+                self._wake.clear()
+                while len(running) < self.workers:
+                    try:
+                        job = await self._claim(db)
+                    except Exception:
+                        logger.exception("Claiming a processing job failed; retrying next interval")
+                        break
+                    if job is None:
+                        break
+                    task = asyncio.create_task(self.process(db, job))
+                    running.add(task)
+                    task.add_done_callback(running.discard)
+                    # A freed slot claims the next job straight away
+                    task.add_done_callback(lambda _: self._wake.set())
+                try:
+                    await asyncio.wait_for(self._wake.wait(), timeout=interval)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            for task in running:
+                task.cancel()
+            self.close()
+
+
+async def job_status(db, note_id: str) -> dict:
+    job = await db[JOBS_COLLECTION].find_one({"_id": note_id})
+    if job is None:
+        raise HTTPException(status_code=404, detail="No processing job for this note")
+    status = {
+        "note_id": note_id,
+        "state": job["state"],
+        "attempts": job["attempts"],
+        "error": job.get("error"),
+        "created_at": job["created_at"],
+        "started_at": job.get("started_at"),
+        "finished_at": job.get("finished_at"),
+    }
+    if job["state"] == "queued":
+        status["next_attempt_at"] = job["next_attempt_at"]
+    return status
+
+
+async def thumbnail_response(request: Request, db, digest: str) -> Response:
+    document = await db[DOCUMENTS_COLLECTION].find_one({"_id": digest, "has_thumbnail": True}, {"thumbnail": 1})
+    if document is None:
+        raise HTTPException(status_code=404, detail="Thumbnail not available")
+    etag = f'"thumb-{digest}"'
+    headers = {"ETag": etag, "Cache-Control": "public, max-age=86400"}
+    if etag in (tag.strip() for tag in request.headers.get("if-none-match", "").split(",")):
+        return Response(status_code=304, headers=headers)
+    return Response(content=bytes(document["thumbnail"]), media_type="image/png", headers=headers)
+
+
+async def queue_counts(db) -> dict:
+    counts = {"queued": 0, "running": 0, "done": 0, "failed": 0}
+    async for row in db[JOBS_COLLECTION].aggregate([{"$group": {"_id": "$state", "count": {"$sum": 1}}}]):
+        counts[row["_id"]] = row["count"]
+    return counts
+
+
+async def _main(args):
+    from dotenv import load_dotenv
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    load_dotenv(Path(__file__).parent / '.env')
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'], tz_aware=True)
+    try:
+        db = client[os.environ['DB_NAME']]
+        if args.backfill:
+            queued = 0
+            async for note in db.notes.find({"sha256": {"$ne": None}, **LIVE}, {"_id": 0, "id": 1, "sha256": 1}):
+                queued += await queue_job(db, note["id"], note["sha256"])
+            print(f"Queued {queued} notes")
+        if args.retry_failed:
+            result = await db[JOBS_COLLECTION].update_many(
+                {"state": "failed"},
+                {"$set": {"state": "queued", "attempts": 0, "next_attempt_at": datetime.now(timezone.utc)}},
+            )
+            print(f"Requeued {result.modified_count} failed jobs")
+        print(json.dumps(await queue_counts(db), indent=2))
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Inspect or requeue note PDF processing jobs")
+    parser.add_argument("--backfill", action="store_true", help="queue every uploaded note that has no job")
+    parser.add_argument("--retry-failed", action="store_true", help="requeue failed jobs with fresh attempts")
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    asyncio.run(_main(parser.parse_args()))
@@ -0,0 +1,189 @@
+"""Soft delete, and the background purge of tombstoned documents.
+
+Deleting a note or discussion only stamps `deleted_at` on it, so the
+request costs one single-document write however large the thread is.
+Reads add LIVE to their filter; every list index leads with deleted_at,
+so live documents are still one index range.
+
+The Purger then removes tombstones for good, off the request path:
+
+  - a discussion's replies, PURGE_BATCH_SIZE at a time, then the
+    discussion itself
+  - tombstoned notes, in batches of the same size
+
+After each batch it sleeps for at least as long as the batch took, so
+purging never holds the database more than half the time however slow
+it is under load. Progress is kept on the tombstone (purge.replies_deleted),
+and a renewed lease (purge.lease_until) keeps two workers off the same
+discussion; a purge interrupted by a crash or deploy is picked up by
+whichever worker next finds the lease expired.
+
+    python purge.py            # report what is waiting to be purged
+    python purge.py --run      # purge everything now
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from time import perf_counter
+from typing import Optional
+
+from pymongo import ReturnDocument
+
+from metrics import PURGED_DOCUMENTS
+from stats import day_of, record as record_stats, replies_changed
+
+logger = logging.getLogger(__name__)
+
+# Matches documents that have not been deleted (deleted_at missing or null)
+LIVE = {"deleted_at": None}
+TOMBSTONED = {"deleted_at": {"$ne": None}}
+LEASE = timedelta(seconds=60)
+
+
+def tombstone(now: Optional[datetime] = None) -> dict:
+    return {"$set": {"deleted_at": now or datetime.now(timezone.utc)}}
+
+
+async def backfill_live_notes(db) -> int:
+    """Give notes written without a deleted_at field an explicit null, as the live-only indexes expect"""
+    result = await db.notes.update_many({"deleted_at": {"$exists": False}}, {"$set": LIVE})
+    return result.modified_count
+
+
+class Purger:
+    def __init__(self, batch_size: int = 500, pause: float = 0.1):
+        self.batch_size = batch_size
+        self.pause = pause
+        self.owner = f"{os.uname().nodename}:{os.getpid()}"
+        self._wake = asyncio.Event()
+
+    def wake(self):
+        """Start a pass now instead of at the next interval"""
+        self._wake.set()
+
+    async def _throttle(self, started: float):
+        await asyncio.sleep(max(self.pause, perf_counter() - started))
+
+    async def _claim(self, db) -> Optional[dict]:
+        now = datetime.now(timezone.utc)
+        return await db.discussions.find_one_and_update(
+            {**TOMBSTONED, "$or": [{"purge.lease_until": {"$exists": False}}, {"purge.lease_until": {"$lt": now}}]},
+            {"$set": {"purge.owner": self.owner, "purge.lease_until": now + LEASE}},
+            projection={"_id": 1, "id": 1, "purge": 1},
+            sort=[("deleted_at", 1)],
+            return_document=ReturnDocument.AFTER,
+        )
+
+    async def purge_discussion(self, db, discussion: dict) -> int:
+        """Delete a claimed discussion's replies in batches, then the discussion; returns replies deleted"""
+        deleted = 0
+        while True:
+            started = perf_counter()
+            batch = await db.replies.find(
+                {"discussion_id": discussion["id"]}, {"_id": 1, "created_at": 1}
+            ).limit(self.batch_size).to_list(length=self.batch_size)
+            if not batch:
+                break
+            result = await db.replies.delete_many({"_id": {"$in": [reply["_id"] for reply in batch]}})
+            await record_stats(db, replies_changed(Counter(day_of(reply["created_at"]) for reply in batch), -1))
+            deleted += result.deleted_count
+            PURGED_DOCUMENTS.inc("replies", amount=result.deleted_count)
+            now = datetime.now(timezone.utc)
+            await db.discussions.update_one(
+                {"_id": discussion["_id"]},
+                {"$inc": {"purge.replies_deleted": result.deleted_count},
+                 "$set": {"purge.lease_until": now + LEASE, "purge.updated_at": now}},
+            )
+            await self._throttle(started)
+        await db.discussions.delete_one({"_id": discussion["_id"]})
+        PURGED_DOCUMENTS.inc("discussions")
+        logger.info("Purged discussion %s with %d replies", discussion["id"], deleted)
+        return deleted
+
+    async def purge_notes(self, db) -> int:
+        deleted = 0
+        while True:
+            started = perf_counter()
+            batch = await db.notes.find(TOMBSTONED, {"_id": 1}).limit(self.batch_size).to_list(length=self.batch_size)
+            if not batch:
+                return deleted
+            result = await db.notes.delete_many({"_id": {"$in": [note["_id"] for note in batch]}, **TOMBSTONED})
+            deleted += result.deleted_count
+            PURGED_DOCUMENTS.inc("notes", amount=result.deleted_count)
+            await self._throttle(started)
+
+    async def run_once(self, db) -> dict:
+        """Purge everything currently tombstoned that no other worker holds"""
+        discussions = replies = 0
+        while (discussion := await self._claim(db)) is not None:
+            replies += await self.purge_discussion(db, discussion)
+            discussions += 1
+        notes = await self.purge_notes(db)
+        return {"discussions": discussions, "replies": replies, "notes": notes}
+
+    async def run(self, db, interval: float):
+        # The first pass resumes purges interrupted by a restart
+        while True:
+            self._wake.clear()
+            try:
+                await self.run_once(db)
+            except Exception:
+                logger.exception("Purge pass failed; retrying next interval")
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=interval)
+            except asyncio.TimeoutError:
+                pass
+
+
+async def purge_status(db) -> dict:
+    """What is waiting to be purged, with progress for discussions being purged now"""
+    now = datetime.now(timezone.utc)
+    in_progress = []
+    cursor = db.discussions.find(
+        {**TOMBSTONED, "purge.lease_until": {"$gte": now}}, {"_id": 0, "id": 1, "deleted_at": 1, "purge": 1}
+    )
+    async for discussion in cursor:
+        purge = discussion.get("purge", {})
+        in_progress.append({
+            "id": discussion["id"],
+            "deleted_at": discussion["deleted_at"],
+            "owner": purge.get("owner"),
+            "replies_deleted": purge.get("replies_deleted", 0),
+            "replies_remaining": await db.replies.count_documents({"discussion_id": discussion["id"]}),
+            "updated_at": purge.get("updated_at"),
+        })
+    return {
+        "discussions": {"pending": await db.discussions.count_documents(TOMBSTONED), "in_progress": in_progress},
+        "notes": {"pending": await db.notes.count_documents(TOMBSTONED)},
+    }
+
+
+async def _main(args):
+    from dotenv import load_dotenv
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    load_dotenv(Path(__file__).parent / '.env')
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'], tz_aware=True)
+    try:
+        db = client[os.environ['DB_NAME']]
+        if args.run:
+            purger = Purger(args.batch_size, args.pause_ms / 1000)
+            print(json.dumps(await purger.run_once(db), indent=2))
+        else:
+            print(json.dumps(await purge_status(db), indent=2, default=str))
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Inspect or run the purge of soft-deleted notes and discussions")
+    parser.add_argument("--run", action="store_true", help="purge every tombstone no worker is purging now")
+    parser.add_argument("--batch-size", type=int, default=int(os.environ.get('PURGE_BATCH_SIZE', '500')))
+    parser.add_argument("--pause-ms", type=int, default=int(os.environ.get('PURGE_PAUSE_MS', '100')))
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    asyncio.run(_main(parser.parse_args()))
@@ -0,0 +1,94 @@
+"""Materialized ranking fields for the discussion feed.
+
+    new     created_at                    (newest first)
+    top     upvotes                       (most upvoted)
+    active  replies                       (most replied)
+    hot     hot_score                     (trending)
+
+Each ranking has a descending (field, id) index, so a feed page is an
+index range scan resumed from the keyset cursor. upvotes and replies are
+the live counters. hot_score is
+
+    (upvotes + REPLY_WEIGHT * replies + 1) / (age_hours + 2) ** GRAVITY
+
+It is refreshed for a discussion whenever its counters change, using a
+pipeline update that computes it in the database. A background pass also
+re-decays every discussion younger than HOT_WINDOW_DAYS and zeroes
+older ones. Scores move between passes, so a paged hot feed can repeat
+or skip an item that changed rank mid-scroll. With several workers only
+the one holding the decay lease (a document in `leases`) runs the pass;
+if it dies, the lease expires after one period and another takes over.
+"""
+import logging
+import os
+from datetime import datetime, timedelta, timezone
+from typing import Iterable, Optional
+
+from pymongo.errors import DuplicateKeyError
+
+logger = logging.getLogger(__name__)
+
+REPLY_WEIGHT = 2.0
+GRAVITY = 1.8
+HOT_WINDOW_DAYS = 30
+LEASES_COLLECTION = "leases"
+DECAY_LEASE_ID = "hot_decay"
+
+SORT_FIELDS = {
+    "new": "created_at",
+    "hot": "hot_score",
+    "top": "upvotes",
+    "active": "replies",
+}
+
+_AGE_HOURS = {"$divide": [{"$subtract": ["$$NOW", "$created_at"]}, 3600 * 1000]}
+_POINTS = {"$add": [
+    {"$ifNull": ["$upvotes", 0]},
+    {"$multiply": [REPLY_WEIGHT, {"$ifNull": ["$replies", 0]}]},
+    1,
+]}
+HOT_SCORE_UPDATE = [{"$set": {"hot_score": {
+    "$divide": [_POINTS, {"$pow": [{"$add": [{"$max": [_AGE_HOURS, 0]}, 2]}, GRAVITY]}]
+}}}]
+
+
+def hot_score(upvotes: int, replies: int, created_at: datetime, now: Optional[datetime] = None) -> float:
+    """Same formula as HOT_SCORE_UPDATE, for documents built in Python"""
+    now = now or datetime.now(timezone.utc)
+    age_hours = max((now - created_at).total_seconds() / 3600, 0)
+    return (upvotes + REPLY_WEIGHT * replies + 1) / (age_hours + 2) ** GRAVITY
+
+
+async def refresh_hot_scores(db, discussion_ids: Iterable[str]):
+    """Recompute hot_score for discussions whose counters just changed"""
+    ids = list(discussion_ids)
+    if ids:
+        await db.discussions.update_many({"id": {"$in": ids}}, HOT_SCORE_UPDATE)
+
+
+async def claim_decay_pass(db, period: float, owner: Optional[str] = None) -> bool:
+    """Take or renew the decay lease for one period; False while another worker holds it"""
+    owner = owner or f"{os.uname().nodename}:{os.getpid()}"
+    now = datetime.now(timezone.utc)
+    try:
+        await db[LEASES_COLLECTION].update_one(
+            {"_id": DECAY_LEASE_ID, "$or": [{"owner": owner}, {"lease_until": {"$lt": now}}]},
+            {"$set": {"owner": owner, "lease_until": now + timedelta(seconds=period)}},
+            upsert=True,
+        )
+    except DuplicateKeyError:
+        # The lease exists and is held by someone else, so the upsert tried to insert a second one
+        return False
+    return True
+
+
+async def decay_hot_scores(db, window_days: int = HOT_WINDOW_DAYS) -> int:
+    """Re-decay recent discussions and zero the ones that aged out of the window"""
+    cutoff = datetime.now(timezone.utc) - timedelta(days=window_days)
+    recent = await db.discussions.update_many({"created_at": {"$gte": cutoff}}, HOT_SCORE_UPDATE)
+    aged = await db.discussions.update_many(
+        {"hot_score": {"$gt": 0}, "created_at": {"$lt": cutoff}}, {"$set": {"hot_score": 0.0}}
+    )
+    # Older discussions written before the field existed still need a value to page on
+    missing = await db.discussions.update_many({"hot_score": {"$exists": False}}, {"$set": {"hot_score": 0.0}})
+    return recent.modified_count + aged.modified_count + missing.modified_count
@@ -0,0 +1,227 @@
+"""Admission control: per-client token buckets and a global in-flight cap.
+
+Routes are grouped into classes (write, vote, search, upload), each with its own
+bucket per client IP, configured as RATE_LIMITS="write=20/min,vote=120/min".
+A bucket holds up to N tokens and refills at N per period, so a client
+can burst N requests and then sustain the configured rate. A rejected
+request gets 429 with Retry-After set to the time until the next token.
+
+Buckets live in process memory by default; RATE_LIMIT_BACKEND=redis
+shares them between workers with one atomic script call per request.
+
+The client address is the socket peer by default, since any client can
+send X-Forwarded-For. Behind a proxy, set TRUSTED_PROXY_HOPS to the number
+of proxies that append to it (1 for a single ingress) and the address is
+read that many places from the right. Left at 0 there, every client would
+share the proxy's buckets, which is logged as a warning.
+
+AdmissionMiddleware caps the requests being handled at once. Past the
+cap a request waits briefly for a slot, then is shed with 503 and
+Retry-After. It is shed before it can queue for a pooled MongoDB
+connection and time out there. The slot is released once the response
+starts, so a streamed body (an NDJSON export read slowly) does not hold
+it for the whole download.
+"""
+import asyncio
+import logging
+import math
+import os
+import re
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+from fastapi import HTTPException, Request
+
+from serialization import dumps
+
+try:
+    import redis.asyncio as aioredis
+except ImportError:  # optional dependency
+    aioredis = None
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_RATE_LIMITS = "write=20/min,vote=120/min,search=60/min,upload=600/min"
+DEFAULT_TRUSTED_PROXY_HOPS = 0
+_PERIODS = {"s": 1, "sec": 1, "second": 1, "min": 60, "minute": 60, "h": 3600, "hour": 3600}
+
+
+def parse_rate_limits(spec: str) -> Dict[str, Tuple[float, float]]:
+    """Parse "write=20/min,search=5/s" into {route_class: (capacity, tokens per second)}"""
+    limits = {}
+    for part in filter(None, (item.strip() for item in spec.split(","))):
+        route_class, _, rate = part.partition("=")
+        count, _, period = rate.partition("/")
+        if period not in _PERIODS:
+            raise ValueError(f"Unknown rate limit period in {part!r}")
+        capacity = float(count)
+        limits[route_class.strip()] = (capacity, capacity / _PERIODS[period])
+    return limits
+
+
+class MemoryBucketBackend:
+    """Token buckets in an LRU, so idle clients are forgotten first"""
+
+    def __init__(self, max_keys: int = 100000):
+        self.max_keys = max_keys
+        self._buckets: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()
+
+    async def take(self, key: str, capacity: float, refill_rate: float) -> float:
+        """Take one token; returns 0 if allowed, else seconds until one is available"""
+        now = time.monotonic()
+        tokens, updated = self._buckets.get(key, (capacity, now))
+        tokens = min(capacity, tokens + (now - updated) * refill_rate)
+        if tokens >= 1:
+            self._buckets[key] = (tokens - 1, now)
+            wait = 0.0
+        else:
+            self._buckets[key] = (tokens, now)
+            wait = (1 - tokens) / refill_rate
+        self._buckets.move_to_end(key)
+        while len(self._buckets) > self.max_keys:
+            self._buckets.popitem(last=False)
+        return wait
+
+
+# KEYS[1] bucket; ARGV capacity, refill per second, now (seconds)
+_TAKE_SCRIPT = """
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(state[1]) or capacity
+local updated = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - updated) * rate)
+local wait = 0
+if tokens >= 1 then
+  tokens = tokens - 1
+else
+  wait = (1 - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'updated', now)
+redis.call('PEXPIRE', KEYS[1], math.ceil(capacity / rate * 1000) + 1000)
+return tostring(wait)
+"""
+
+
+class RedisBucketBackend:
+    """Buckets shared by every worker; the refill and take run atomically in Redis"""
+
+    def __init__(self, url: str, prefix: str = "kamati:ratelimit:"):
+        if aioredis is None:
+            raise RuntimeError("RATE_LIMIT_BACKEND=redis requires the 'redis' package")
+        self._redis = aioredis.from_url(url)
+        self._prefix = prefix
+        self._script = self._redis.register_script(_TAKE_SCRIPT)
+
+    async def take(self, key: str, capacity: float, refill_rate: float) -> float:
+        wait = await self._script(keys=[self._prefix + key], args=[capacity, refill_rate, time.time()])
+        return float(wait)
+
+
+class RateLimiter:
+    def __init__(self, backend, limits: Dict[str, Tuple[float, float]],
+                 trusted_proxy_hops: int = DEFAULT_TRUSTED_PROXY_HOPS):
+        self.backend = backend
+        self.limits = limits
+        self.trusted_proxy_hops = trusted_proxy_hops
+        self._warned_untrusted = False
+
+    def client_key(self, request: Request) -> str:
+        """The client address, read from X-Forwarded-For only through trusted proxies"""
+        if self.trusted_proxy_hops:
+            forwarded = [hop.strip() for hop in request.headers.get("x-forwarded-for", "").split(",") if hop.strip()]
+            if len(forwarded) >= self.trusted_proxy_hops:
+                return forwarded[-self.trusted_proxy_hops]
+        elif "x-forwarded-for" in request.headers and not self._warned_untrusted:
+            self._warned_untrusted = True
+            logger.warning("Requests arrive through a proxy (X-Forwarded-For) but TRUSTED_PROXY_HOPS=0; "
+                           "every client shares the proxy's rate limit buckets")
+        return request.client.host if request.client else "unknown"
+
+    async def check(self, route_class: str, request: Request):
+        limit = self.limits.get(route_class)
+        if limit is None:
+            return
+        capacity, refill_rate = limit
+        wait = await self.backend.take(f"{route_class}:{self.client_key(request)}", capacity, refill_rate)
+        if wait > 0:
+            raise HTTPException(
+                status_code=429,
+                detail="Too many requests, slow down",
+                headers={"Retry-After": str(max(1, math.ceil(wait)))},
+            )
+
+
+def limiter_from_env() -> RateLimiter:
+    limits = parse_rate_limits(os.environ.get('RATE_LIMITS', DEFAULT_RATE_LIMITS))
+    if os.environ.get('RATE_LIMIT_BACKEND', 'memory') == 'redis':
+        backend = RedisBucketBackend(os.environ.get('REDIS_URL', 'redis://localhost:6379/0'))
+    else:
+        backend = MemoryBucketBackend(int(os.environ.get('RATE_LIMIT_MAX_KEYS', '100000')))
+    hops = int(os.environ.get('TRUSTED_PROXY_HOPS', str(DEFAULT_TRUSTED_PROXY_HOPS)))
+    return RateLimiter(backend, limits, hops)
+
+
+class AdmissionMiddleware:
+    """Shed requests with 503 once too many are in flight"""
+
+    def __init__(self, app, max_in_flight: int, queue_timeout: float = 0.05,
+                 exempt_paths: Tuple[str, ...] = ("/healthz", "/readyz", "/metrics"),
+                 exempt_prefixes: Tuple[str, ...] = (),
+                 exempt_routes: Tuple[Tuple[str, str], ...] = ()):
+        self.app = app
+        self.max_in_flight = max_in_flight
+        self.queue_timeout = queue_timeout
+        self.exempt_paths = exempt_paths
+        self.exempt_prefixes = exempt_prefixes
+        # (method, full-path regex) pairs, for a route whose neighbours under the same prefix are admitted
+        self.exempt_routes = [(method, re.compile(pattern)) for method, pattern in exempt_routes]
+        self._slots: Optional[asyncio.Semaphore] = None
+
+    async def _reject(self, send):
+        body = dumps({"detail": "Server busy, retry shortly"})
+        await send({
+            "type": "http.response.start",
+            "status": 503,
+            "headers": [(b"content-type", b"application/json"), (b"retry-after", b"1"),
+                        (b"content-length", str(len(body)).encode())],
+        })
+        await send({"type": "http.response.body", "body": body})
+
+    def _exempt(self, scope) -> bool:
+        path = scope["path"]
+        if path in self.exempt_paths or path.startswith(self.exempt_prefixes):
+            return True
+        return any(scope["method"] == method and pattern.fullmatch(path) for method, pattern in self.exempt_routes)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or self.max_in_flight <= 0 or self._exempt(scope):
+            await self.app(scope, receive, send)
+            return
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_in_flight)
+        try:
+            await asyncio.wait_for(self._slots.acquire(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            await self._reject(send)
+            return
+        released = False
+
+        def release():
+            nonlocal released
+            if not released:
+                released = True
+                self._slots.release()
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                # Headers are out; a streamed body may take as long as the client takes to read it
+                release()
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            release()
@@ -0,0 +1,312 @@
+"""In-process full-text search with BM25 ranking.
+
+Each SearchIndex is an inverted index over a few weighted text fields.
+It lives in the API process, is built from the database at startup and
+kept current by the write handlers, so it works the same against any
+store that can iterate documents. With several workers, each one also
+runs catch_up() periodically to pick up documents inserted by the
+others.
+"""
+import bisect
+import math
+import re
+from collections import Counter, OrderedDict, defaultdict
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from bson import ObjectId
+
+from purge import LIVE
+
+_TOKEN_RE = re.compile(r"[^\W_]+", re.UNICODE)
+
+STOPWORDS = frozenset(
+    "a an and are as at be by for from how i in is it of on or that the this to was what when where which who why with".split()
+)
+
+# Longest suffix first; the replacement keeps related forms on one stem
+_SUFFIXES = (
+    ("ational", "ate"), ("ization", "ize"), ("fulness", "ful"), ("iveness", "ive"),
+    ("ousness", "ous"), ("tional", "tion"), ("ations", "ate"), ("ation", "ate"),
+    ("ments", "ment"), ("ities", "ity"), ("ingly", ""), ("ness", ""), ("sses", "ss"),
+    ("ies", "y"), ("ing", ""), ("ers", "er"), ("ed", ""), ("ly", ""), ("es", ""), ("s", ""),
+)
+
+PREFIX_WEIGHT = 0.8
+FUZZY_WEIGHT = 0.6
+MAX_EXPANSIONS = 20
+# Bounds on the work one query can cause
+MAX_QUERY_LENGTH = 200
+MAX_QUERY_TERMS = 8
+MAX_FUZZY_TOKEN_LENGTH = 24
+
+
+def tokenize(text: Optional[str]) -> List[str]:
+    if not text:
+        return []
+    return [word for word in _TOKEN_RE.findall(text.lower()) if word not in STOPWORDS]
+
+
+def stem(word: str) -> str:
+    if len(word) <= 3 or word.isdigit():
+        return word
+    for suffix, replacement in _SUFFIXES:
+        if word.endswith(suffix) and len(word) - len(suffix) >= 3:
+            if suffix == "s" and word.endswith("ss"):
+                return word
+            return word[: -len(suffix)] + replacement
+    return word
+
+
+def _deletions(word: str) -> Iterable[str]:
+    yield word
+    for i in range(len(word)):
+        yield word[:i] + word[i + 1:]
+
+
+class SearchIndex:
+    """Weighted-field inverted index with BM25 scoring"""
+
+    def __init__(self, fields: Dict[str, float], k1: float = 1.2, b: float = 0.75):
+        self.fields = fields
+        self.k1 = k1
+        self.b = b
+        self._docs: Dict[str, dict] = {}
+        self._postings: Dict[str, Dict[str, float]] = defaultdict(dict)
+        self._total_length = 0.0
+        # Surface words drive prefix and typo expansion; each maps to its stem
+        self._words: Dict[str, int] = {}
+        self._sorted_words: List[str] = []
+        self._deletes: Dict[str, set] = defaultdict(set)
+
+    def __len__(self):
+        return len(self._docs)
+
+    def __contains__(self, doc_id):
+        return doc_id in self._docs
+
+    def clear(self):
+        self.__init__(self.fields, self.k1, self.b)
+
+    # Maintenance
+
+    def add(self, doc_id: str, fields: Dict[str, Optional[str]], attrs: Optional[dict] = None):
+        """Index a document, replacing any previous version"""
+        if doc_id in self._docs:
+            self.remove(doc_id)
+        self._docs[doc_id] = {"length": 0.0, "words": {}, "attrs": attrs or {}}
+        for field, text in fields.items():
+            self._apply(doc_id, field, tokenize(text), 1)
+
+    def extend(self, doc_id: str, field: str, text: Optional[str]):
+        """Append text to one field of an indexed document"""
+        if doc_id in self._docs:
+            self._apply(doc_id, field, tokenize(text), 1)
+
+    def retract(self, doc_id: str, field: str, text: Optional[str]):
+        """Remove previously appended text from one field"""
+        if doc_id in self._docs:
+            self._apply(doc_id, field, tokenize(text), -1)
+
+    def remove(self, doc_id: str):
+        doc = self._docs.get(doc_id)
+        if doc is None:
+            return
+        for field, words in list(doc["words"].items()):
+            self._apply(doc_id, field, list(words.elements()), -1)
+        del self._docs[doc_id]
+
+    def _apply(self, doc_id, field, words, sign):
+        weight = self.fields.get(field)
+        if not weight or not words:
+            return
+        doc = self._docs[doc_id]
+        field_words = doc["words"].setdefault(field, Counter())
+        for word in words:
+            if sign < 0 and field_words[word] <= 0:
+                continue
+            field_words[word] += sign
+            if field_words[word] == 0:
+                del field_words[word]
+            term = stem(word)
+            postings = self._postings[term]
+            tf = postings.get(doc_id, 0.0) + sign * weight
+            if tf > 1e-9:
+                postings[doc_id] = tf
+            else:
+                postings.pop(doc_id, None)
+                if not postings:
+                    del self._postings[term]
+            doc["length"] += sign * weight
+            self._total_length += sign * weight
+            self._track_word(word, sign)
+
+    def _track_word(self, word, sign):
+        count = self._words.get(word, 0) + sign
+        if count > 0:
+            if word not in self._words:
+                bisect.insort(self._sorted_words, word)
+                for variant in _deletions(word):
+                    self._deletes[variant].add(word)
+            self._words[word] = count
+        elif word in self._words:
+            del self._words[word]
+            pos = bisect.bisect_left(self._sorted_words, word)
+            del self._sorted_words[pos]
+            for variant in _deletions(word):
+                self._deletes[variant].discard(word)
+                if not self._deletes[variant]:
+                    del self._deletes[variant]
+
+    # Querying
+
+    def _expand(self, token: str, allow_prefix: bool) -> Dict[str, float]:
+        """Map a query token to index terms with a match-quality weight"""
+        terms = {}
+        exact = stem(token)
+        if exact in self._postings:
+            terms[exact] = 1.0
+        if allow_prefix and len(token) >= 2:
+            start = bisect.bisect_left(self._sorted_words, token)
+            for word in self._sorted_words[start:start + MAX_EXPANSIONS]:
+                if not word.startswith(token):
+                    break
+                terms.setdefault(stem(word), PREFIX_WEIGHT)
+        if not terms and 4 <= len(token) <= MAX_FUZZY_TOKEN_LENGTH:
+            # Symmetric-delete lookup finds every word within one edit
+            candidates = set()
+            for variant in _deletions(token):
+                candidates.update(self._deletes.get(variant, ()))
+            for word in sorted(candidates)[:MAX_EXPANSIONS]:
+                terms.setdefault(stem(word), FUZZY_WEIGHT)
+        return terms
+
+    def search(self, query: str, filters: Optional[dict] = None, limit: int = 50) -> List[Tuple[str, float]]:
+        """Return (doc_id, score) pairs, best first"""
+        tokens = list(dict.fromkeys(tokenize(query)))[:MAX_QUERY_TERMS]
+        if not tokens or not self._docs:
+            return []
+        n_docs = len(self._docs)
+        avg_length = self._total_length / n_docs if n_docs else 0.0
+        scores: Dict[str, float] = defaultdict(float)
+        for position, token in enumerate(tokens):
+            # Only the token being typed is treated as a prefix
+            expansions = self._expand(token, allow_prefix=position == len(tokens) - 1)
+            for term, quality in expansions.items():
+                postings = self._postings.get(term, {})
+                df = len(postings)
+                idf = math.log(1 + (n_docs - df + 0.5) / (df + 0.5))
+                for doc_id, tf in postings.items():
+                    length = self._docs[doc_id]["length"]
+                    norm = self.k1 * (1 - self.b + self.b * length / avg_length) if avg_length else self.k1
+                    scores[doc_id] += quality * idf * tf * (self.k1 + 1) / (tf + norm)
+
+        if filters:
+            wanted = {key: value for key, value in filters.items() if value is not None}
+            scores = {
+                doc_id: score for doc_id, score in scores.items()
+                if all(self._docs[doc_id]["attrs"].get(key) == value for key, value in wanted.items())
+            }
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+        return ranked[:limit]
+
+
+# text is what processing extracted from an uploaded PDF
+notes_index = SearchIndex({"title": 2.0, "subject": 1.0, "text": 0.5})
+discussions_index = SearchIndex({"title": 2.0, "content": 1.0, "replies": 0.5})
+
+
+def index_note(note: dict, text: Optional[str] = None):
+    notes_index.add(
+        note["id"],
+        {"title": note.get("title"), "subject": note.get("subject"), "text": text},
+        {"subject": note.get("subject"), "semester": note.get("semester")},
+    )
+
+
+def index_discussion(discussion: dict, reply_texts: Iterable[str] = ()):
+    discussions_index.add(
+        discussion["id"],
+        {"title": discussion.get("title"), "content": discussion.get("content"), "replies": " ".join(reply_texts)},
+    )
+
+
+# Reply ids already folded into discussions_index, so catch-up never adds one twice
+_indexed_replies: "OrderedDict[str, None]" = OrderedDict()
+_INDEXED_REPLIES_LIMIT = 50000
+
+
+def index_reply(reply: dict):
+    reply_id = reply.get("id")
+    if reply_id is not None:
+        if reply_id in _indexed_replies:
+            return
+        _indexed_replies[reply_id] = None
+        if len(_indexed_replies) > _INDEXED_REPLIES_LIMIT:
+            _indexed_replies.popitem(last=False)
+    discussions_index.extend(reply["discussion_id"], "replies", reply.get("content"))
+
+
+NOTE_SEARCH_FIELDS = {"_id": 0, "id": 1, "title": 1, "subject": 1, "semester": 1, "sha256": 1}
+DISCUSSION_SEARCH_FIELDS = {"_id": 0, "id": 1, "title": 1, "content": 1}
+REPLY_SEARCH_FIELDS = {"_id": 0, "id": 1, "discussion_id": 1, "content": 1}
+
+# Re-scan this far back so inserts committed slightly out of order are not missed
+CATCH_UP_OVERLAP = timedelta(seconds=30)
+
+
+def watermark() -> ObjectId:
+    return ObjectId.from_datetime(datetime.now(timezone.utc) - CATCH_UP_OVERLAP)
+
+
+async def _texts(db, notes: List[dict]) -> Dict[str, str]:
+    """Extracted text of the uploaded PDFs behind notes, by sha256"""
+    digests = list({note["sha256"] for note in notes if note.get("sha256")})
+    if not digests:
+        return {}
+    return {doc["_id"]: doc.get("text") async for doc in db.documents.find({"_id": {"$in": digests}}, {"text": 1})}
+
+
+async def build_indexes(storage, db=None):
+    """Populate both indexes from the repositories in one pass per collection
+
+    With MongoDB, db also supplies the extracted text of uploaded PDFs.
+    """
+    notes_index.clear()
+    discussions_index.clear()
+    _indexed_replies.clear()
+    notes = [note async for note in storage.notes.stream(NOTE_SEARCH_FIELDS)]
+    texts = await _texts(db, notes) if db is not None else {}
+    for note in notes:
+        index_note(note, texts.get(note.get("sha256")))
+    async for discussion in storage.discussions.stream("created_at", DISCUSSION_SEARCH_FIELDS):
+        index_discussion(discussion)
+    async for reply in storage.replies.stream(REPLY_SEARCH_FIELDS):
+        index_reply(reply)
+
+
+async def catch_up(db, since: ObjectId) -> ObjectId:
+    """Index documents inserted since the watermark; returns the next watermark
+
+    ObjectIds are time-ordered whichever process generated them, and the
+    default _id index serves the range scan. Deletions made by other
+    workers are not replayed; search results are re-read from the
+    database with purge.LIVE, so deleted documents drop out there. Notes
+    whose PDF was processed since the watermark are re-indexed with its
+    text.
+    """
+    next_mark = watermark()
+    recent = {"_id": {"$gte": since}}
+    notes = [note async for note in db.notes.find({**recent, **LIVE}, NOTE_SEARCH_FIELDS)
+             if note["id"] not in notes_index]
+    async for document in db.documents.find({"processed_at": {"$gte": since.generation_time}}, {"_id": 1}):
+        notes += [note async for note in db.notes.find({"sha256": document["_id"], **LIVE}, NOTE_SEARCH_FIELDS)]
+    texts = await _texts(db, notes)
+    for note in notes:
+        index_note(note, texts.get(note.get("sha256")))
+    async for discussion in db.discussions.find({**recent, **LIVE}, DISCUSSION_SEARCH_FIELDS):
+        if discussion["id"] not in discussions_index:
+            index_discussion(discussion)
+    async for reply in db.replies.find({**recent, **LIVE}, REPLY_SEARCH_FIELDS):
+        index_reply(reply)
+    return next_mark
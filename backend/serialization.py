@@ -0,0 +1,44 @@
+"""Fast JSON output for documents read straight from MongoDB.
+
+Read paths project exactly the fields the response needs and the dates
+are native BSON datetimes, so the documents are already in response
+shape. They are encoded with orjson in one pass instead of being
+re-validated through the Pydantic models.
+
+OrjsonResponse is also the app's default response class, so handlers
+that return plain dicts or models are rendered with orjson too.
+"""
+from time import perf_counter
+from typing import Optional
+
+import orjson
+from fastapi import Response
+
+from metrics import SERIALIZATION_SECONDS
+
+# UTC datetimes render as "...Z", matching Pydantic's own output
+_OPTIONS = orjson.OPT_UTC_Z | orjson.OPT_NAIVE_UTC
+
+
+def dumps(obj) -> bytes:
+    return orjson.dumps(obj, option=_OPTIONS)
+
+
+def timed_dumps(obj) -> bytes:
+    """dumps() for whole response bodies, recorded in the serialization histogram"""
+    started = perf_counter()
+    body = dumps(obj)
+    SERIALIZATION_SECONDS.observe(perf_counter() - started)
+    return body
+
+
+class OrjsonResponse(Response):
+    media_type = "application/json"
+
+    def render(self, content) -> bytes:
+        return timed_dumps(content)
+
+
+def json_response(obj, status_code: int = 200, headers: Optional[dict] = None) -> Response:
+    return OrjsonResponse(obj, status_code=status_code, headers=headers)
+
@@ -0,0 +1,194 @@
+"""Run the API on every core, with graceful drains and rolling restarts.
+
+    python serve.py [--workers N] [--host 0.0.0.0] [--port 8001] [--graceful-timeout 30]
+
+The supervisor binds the listening socket once and spawns N uvicorn
+workers on it (default: WEB_CONCURRENCY, else one per core). Each worker
+calls server.create_app() itself, so the Motor pool, caches and buffers
+are per process and nothing is inherited across a fork.
+
+Signals to the supervisor:
+  SIGTERM / SIGINT  drain: workers stop accepting, finish in-flight
+                    requests for up to --graceful-timeout seconds, then
+                    run the lifespan shutdown, which flushes buffered
+                    upvotes and closes the pool.
+  SIGHUP            rolling restart: workers are replaced one at a time,
+                    and an old worker is drained only after its
+                    replacement has finished startup.
+
+Workers that die unexpectedly are respawned. With more than one worker
+set CACHE_BACKEND=redis, so cache invalidations reach every process, and
+EVENTS_SOURCE=changestream, so /api/events streams see every worker's
+writes; search catch-up is switched on automatically. STORAGE_ENGINE=memory
+and sqlite always run a single worker.
+"""
+import argparse
+import logging
+import multiprocessing
+import os
+import signal
+import time
+
+import uvicorn
+
+logger = logging.getLogger("serve")
+
+READY_TIMEOUT = 120.0
+# A worker that keeps failing startup is respawned at most this often
+RESPAWN_DELAY = 5.0
+
+# Workers start from a fresh interpreter, so no event loop or client is inherited
+spawn = multiprocessing.get_context("spawn")
+
+
+class ReadyServer(uvicorn.Server):
+    """uvicorn server that reports back once startup has completed"""
+
+    def __init__(self, config, ready):
+        super().__init__(config)
+        self.ready = ready
+
+    async def startup(self, sockets=None):
+        await super().startup(sockets=sockets)
+        if not self.should_exit:
+            self.ready.set()
+
+    def handle_exit(self, sig, frame):
+        # Open event streams would otherwise hold the drain until the graceful timeout
+        from events import close_streams
+        close_streams()
+        super().handle_exit(sig, frame)
+
+
+def run_worker(config: uvicorn.Config, ready, sockets):
+    """Entry point of a worker process"""
+    # A spawned interpreter starts without the supervisor's logging setup
+    config.configure_logging()
+    ReadyServer(config, ready).run(sockets=sockets)
+
+
+class Supervisor:
+    def __init__(self, config: uvicorn.Config, workers: int):
+        self.config = config
+        self.workers = workers
+        self.processes = []
+        self.spawned_at = []
+        self.should_exit = False
+        self.should_restart = False
+        # Past the graceful timeout uvicorn cancels the remaining requests itself
+        self.drain_timeout = (config.timeout_graceful_shutdown or 30) + 10
+
+    def spawn_worker(self):
+        ready = spawn.Event()
+        process = spawn.Process(target=run_worker, args=(self.config, ready, [self.socket]))
+        # The child unpickles the event after start() returns; keep it alive until then
+        process.ready = ready
+        process.start()
+        return process
+
+    def stop_worker(self, process):
+        if process.is_alive():
+            os.kill(process.pid, signal.SIGTERM)
+        self.reap(process)
+
+    def reap(self, process):
+        process.join(self.drain_timeout)
+        if process.is_alive():
+            logger.warning("Worker %d did not drain in time; killing it", process.pid)
+            process.kill()
+            process.join()
+
+    def rolling_restart(self):
+        for index, process in enumerate(list(self.processes)):
+            if self.should_exit:
+                return
+            replacement = self.spawn_worker()
+            if not replacement.ready.wait(READY_TIMEOUT) or not replacement.is_alive():
+                logger.error("Replacement worker failed to start; keeping worker %d", process.pid)
+                self.stop_worker(replacement)
+                return
+            self.processes[index] = replacement
+            self.stop_worker(process)
+            logger.info("Replaced worker %d with %d", process.pid, replacement.pid)
+
+    def _signal(self, signum, frame):
+        if signum == signal.SIGHUP:
+            self.should_restart = True
+        else:
+            self.should_exit = True
+
+    def run(self):
+        self.socket = self.config.bind_socket()
+        for signum in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP):
+            signal.signal(signum, self._signal)
+        logger.info("Starting %d workers on %s:%d", self.workers, self.config.host, self.config.port)
+        self.processes = [self.spawn_worker() for _ in range(self.workers)]
+        self.spawned_at = [time.monotonic()] * self.workers
+
+        while not self.should_exit:
+            if self.should_restart:
+                self.should_restart = False
+                logger.info("Rolling restart requested")
+                self.rolling_restart()
+            for index, process in enumerate(self.processes):
+                if process.is_alive() or self.should_exit:
+                    continue
+                if time.monotonic() - self.spawned_at[index] < RESPAWN_DELAY:
+                    continue
+                logger.warning("Worker %d exited with %s; respawning", process.pid, process.exitcode)
+                self.processes[index] = self.spawn_worker()
+                self.spawned_at[index] = time.monotonic()
+            time.sleep(0.5)
+
+        logger.info("Draining %d workers", len(self.processes))
+        for process in self.processes:
+            if process.is_alive():
+                os.kill(process.pid, signal.SIGTERM)
+        for process in self.processes:
+            self.reap(process)
+        self.socket.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the API with one worker per core")
+    parser.add_argument("--host", default=os.environ.get('HOST', '0.0.0.0'))
+    parser.add_argument("--port", type=int, default=int(os.environ.get('PORT', '8001')))
+    parser.add_argument("--workers", type=int,
+                        default=int(os.environ.get('WEB_CONCURRENCY', str(os.cpu_count() or 1))))
+    parser.add_argument("--graceful-timeout", type=int,
+                        default=int(os.environ.get('GRACEFUL_TIMEOUT_SECONDS', '30')),
+                        help="seconds a draining worker may spend on in-flight requests")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    engine = os.environ.get('STORAGE_ENGINE', 'mongo')
+    if engine != 'mongo' and args.workers > 1:
+        # An in-memory store is private to its process, and SQLite search indexes would never catch up
+        logger.warning("STORAGE_ENGINE=%s runs a single worker; ignoring --workers %d", engine, args.workers)
+        args.workers = 1
+    # Workers size their PDF processing pools by this
+    os.environ['WEB_CONCURRENCY'] = str(args.workers)
+    if args.workers > 1:
+        # Inherited by the spawned workers
+        os.environ.setdefault('SEARCH_CATCH_UP_SECONDS', '5')
+        if os.environ.get('CACHE_BACKEND', 'memory') != 'redis':
+            logger.warning("CACHE_BACKEND is per process; lists may be stale for up to CACHE_TTL_SECONDS "
+                           "across workers. Set CACHE_BACKEND=redis to share invalidations.")
+        if os.environ.get('EVENTS_SOURCE', 'local') != 'changestream':
+            logger.warning("EVENTS_SOURCE=local only pushes writes made by the same worker. "
+                           "Set EVENTS_SOURCE=changestream (replica set) so every stream sees every write.")
+
+    config = uvicorn.Config(
+        "server:create_app",
+        factory=True,
+        host=args.host,
+        port=args.port,
+        workers=args.workers,
+        proxy_headers=True,
+        timeout_graceful_shutdown=args.graceful_timeout,
+    )
+    Supervisor(config, args.workers).run()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,144 +1,260 @@
-from fastapi import FastAPI, APIRouter, HTTPException
-from dotenv import load_dotenv
+from fastapi import FastAPI, APIRouter, Depends, Header, HTTPException, Query, Request, Response
+from fastapi.responses import RedirectResponse
 from starlette.middleware.cors import CORSMiddleware
-from motor.motor_asyncio import AsyncIOMotorClient
-import os
+from pymongo.errors import DuplicateKeyError
+from contextlib import asynccontextmanager
+import asyncio
+import hmac
 import logging
-from pathlib import Path
-from pydantic import BaseModel, Field
-from typing import List, Optional
-import uuid
-from datetime import datetime, timezone
+from typing import List, Literal, Optional
 
-ROOT_DIR = Path(__file__).parent
-load_dotenv(ROOT_DIR / '.env')
-
-# MongoDB connection
-mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
-db = client[os.environ['DB_NAME']]
-
-# Create the main app without a prefix
-app = FastAPI()
+from models import (
+    Note, NoteCreate, NoteUpload, Discussion, DiscussionCreate, Reply, ReplyCreate,
+    Feedback, FeedbackCreate,
+)
+from pagination import Page, DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
+from indexes import ensure_indexes, inspect_indexes, is_healthy
+from search import (
+    notes_index, discussions_index, index_note, index_discussion, index_reply, build_indexes,
+    catch_up, watermark, MAX_QUERY_LENGTH,
+)
+from cache import cache_from_env
+from counters import CounterBuffer
+from ingest import ingest_notes, iter_request_rows
+from streaming import wants_ndjson, ndjson_response
+from serialization import OrjsonResponse, json_response
+from fieldsets import resolve_projection, make_excerpt, backfill_excerpts
+from threads import detect_transactions
+from migrate_dates import migrate_dates
+from compression import CompressionMiddleware
+from metrics import MetricsMiddleware, PROMETHEUS_MEDIA_TYPE, registry
+from settings import Settings
+from database import MongoConnection
+from ratelimit import AdmissionMiddleware, limiter_from_env
+from ranking import SORT_FIELDS, claim_decay_pass, hot_score
+from stats import (
+    record as record_stats, notes_changed, feedback_changed, discussion_changed, replies_changed,
+    day_of, rebuild as rebuild_stats, read_stats,
+)
+from catalog import Catalog, record_changes as record_catalog_changes
+from events import hub_from_env, follow_changes
+from idempotency import idempotency_from_env
+from purge import Purger, backfill_live_notes, purge_status
+from blobs import blobs_from_env
+from uploads import UploadCreate, human_size, uploads_from_env
+from processing import DocumentProcessor, default_workers, job_status, thumbnail_response
+from storage import storage_from_settings
+
+# Per-process state, bound by create_app(); handlers read these module globals
+settings: Optional[Settings] = None
+response_cache = None
+upvote_buffer = None
+rate_limiter = None
+catalog = None
+event_hub = None
+idempotency = None
+purger = None
+blob_store = None
+upload_manager = None
+processor = None
+
+# Repositories for notes, discussions, replies and feedback, opened by the lifespan handler
+storage = None
+
+# MongoDB connection, opened with the mongo storage engine only (db is None otherwise);
+# read_db may prefer secondaries
+mongo: Optional[MongoConnection] = None
+client = None
+db = None
+read_db = None
+
+# Default fieldsets per read route; clients override them with ?fields=
+NOTE_FIELDS = list(Note.model_fields)
+DISCUSSION_LIST_FIELDS = ["title", "excerpt", "author", "replies", "upvotes", "created_at"]
+DISCUSSION_FIELDS = [name for name in Discussion.model_fields if name not in ("excerpt", "hot_score")]
+REPLY_FIELDS = list(Reply.model_fields)
+FEEDBACK_FIELDS = list(Feedback.model_fields)
+
+async def _after_counter_flush(batch):
+    """Re-rank flushed discussions and drop cached lists computed against pre-flush data"""
+    tags = set()
+    discussion_ids, reply_ids = [], []
+    for collection, doc_id, _ in batch:
+        if collection == "discussions":
+            tags.add("discussions")
+            discussion_ids.append(doc_id)
+        else:
+            reply_ids.append(doc_id)
+            _, parent = upvote_buffer.known(collection, doc_id)
+            if parent:
+                tags.add(f"replies:{parent}")
+    await storage.discussions.refresh_hot_scores(discussion_ids)
+    if tags:
+        await response_cache.invalidate(*tags)
+    await event_hub.notify_counts(storage, discussion_ids, reply_ids)
+
+async def _after_processing(note, text):
+    """Make a processed note's PDF text searchable and its new fields visible in lists"""
+    index_note(note, text)
+    await response_cache.invalidate("notes")
+
+def limited(route_class: str):
+    """Route dependency spending one token from the caller's bucket for route_class"""
+    async def check(request: Request):
+        await rate_limiter.check(route_class, request)
+    return Depends(check)
+
+def needs_mongo():
+    """Route dependency for features that keep their state in MongoDB collections"""
+    async def check():
+        if db is None:
+            raise HTTPException(status_code=501, detail=f"Not available with STORAGE_ENGINE={storage.engine}")
+    return Depends(check)
+
+def requires_admin():
+    """Route dependency for operator endpoints: Authorization: Bearer <ADMIN_TOKEN>"""
+    async def check(authorization: Optional[str] = Header(None)):
+        if not settings.admin_token:
+            raise HTTPException(status_code=403, detail="Admin endpoints are disabled; set ADMIN_TOKEN")
+        scheme, _, token = (authorization or "").partition(" ")
+        if scheme.lower() != "bearer" or not hmac.compare_digest(token.encode(), settings.admin_token.encode()):
+            raise HTTPException(status_code=401, detail="Admin token required", headers={"WWW-Authenticate": "Bearer"})
+    return Depends(check)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global client, db, read_db
+    await storage.open()
+    if storage.engine == "mongo":
+        client, db, read_db = mongo.client, mongo.db, mongo.reader
+        await mongo.wait_until_ready()
+        await mark_live_notes()
+        await bootstrap_indexes()
+        await migrate_legacy_dates()
+        await backfill_discussion_excerpts()
+        await bootstrap_stats()
+        await detect_transactions(client)
+    search_since = await bootstrap_search()
+    upvote_buffer.start(storage)
+    background = [asyncio.create_task(keep_hot_scores_fresh())]
+    if db is not None:
+        if settings.search_catch_up_seconds > 0:
+            background.append(asyncio.create_task(keep_search_current(search_since)))
+        if event_hub.source == "changestream":
+            background.append(asyncio.create_task(follow_changes(db, event_hub)))
+        background.append(asyncio.create_task(purger.run(db, settings.purge_interval_seconds)))
+        if processor.available:
+            background.append(asyncio.create_task(processor.run(db, settings.processing_poll_seconds)))
+        else:
+            logger.warning("Neither pymupdf nor pypdf is installed; uploaded PDFs stay queued for processing")
+    try:
+        yield
+    finally:
+        event_hub.close()
+        for task in background:
+            task.cancel()
+        # Flush buffered upvotes while the storage is still open
+        await upvote_buffer.stop()
+        await storage.close()
 
 # Create a router with the /api prefix
 api_router = APIRouter(prefix="/api")
 
-# Define Models
-class Note(BaseModel):
-    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
-    title: str
-    subject: str
-    semester: str
-    size: Optional[str] = None
-    file_url: Optional[str] = None
-    uploaded_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
-
-class NoteCreate(BaseModel):
-    title: str
-    subject: str
-    semester: str
-    size: Optional[str] = None
-    file_url: Optional[str] = None
-
-class Discussion(BaseModel):
-    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
-    title: str
-    content: str
-    author: Optional[str] = "Anonymous"
-    replies: int = 0
-    upvotes: int = 0
-    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
-
-class DiscussionCreate(BaseModel):
-    title: str
-    content: str
-    author: Optional[str] = "Anonymous"
-
-class Reply(BaseModel):
-    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
-    discussion_id: str
-    content: str
-    author: Optional[str] = "Anonymous"
-    upvotes: int = 0
-    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
-
-class ReplyCreate(BaseModel):
-    content: str
-    author: Optional[str] = "Anonymous"
-
-class Feedback(BaseModel):
-    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
-    rating: int
-    comment: Optional[str] = None
-    name: Optional[str] = None
-    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
-
-class FeedbackCreate(BaseModel):
-    rating: int
-    comment: Optional[str] = None
-    name: Optional[str] = None
-
-# Helper functions for MongoDB serialization
-def prepare_for_mongo(data):
-    """Convert datetime objects to ISO strings for MongoDB storage"""
-    if isinstance(data, dict):
-        for key, value in data.items():
-            if isinstance(value, datetime):
-                data[key] = value.isoformat()
-    return data
-
-def parse_from_mongo(item):
-    """Parse datetime strings back to datetime objects from MongoDB"""
-    if isinstance(item, dict):
-        for key, value in item.items():
-            if key.endswith('_at') and isinstance(value, str):
-                try:
-                    item[key] = datetime.fromisoformat(value)
-                except:
-                    pass
-    return item
-
 # Routes
 @api_router.get("/")
 async def root():
     return {"message": "KaMaTi Gang Study Hub API v2.0"}
 
+@api_router.get("/health/indexes", dependencies=[needs_mongo()])
+async def index_health():
+    """Report missing, mismatched or undeclared MongoDB indexes"""
+    try:
+        report = await inspect_indexes(db)
+        return {"healthy": is_healthy(report), "collections": report}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
 # Notes endpoints
-@api_router.get("/notes", response_model=List[Note])
-async def get_notes(subject: Optional[str] = None, semester: Optional[str] = None):
-    """Get all notes with optional filters"""
-    try:
-        filter_query = {}
-        if subject:
-            filter_query["subject"] = subject
-        if semester:
-            filter_query["semester"] = semester
-        
-        notes = await db.notes.find(filter_query).sort("uploaded_at", -1).to_list(length=None)
-        return [Note(**parse_from_mongo(note)) for note in notes]
+@api_router.get("/notes", response_model=Page[Note])
+async def get_notes(
+    request: Request,
+    subject: Optional[str] = None,
+    semester: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    stream: bool = False,
+    fields: Optional[str] = None,
+):
+    """Get a page of notes with optional filters, or all of them as NDJSON"""
+    try:
+        note_fields = resolve_projection(Note, fields, NOTE_FIELDS, required=("id", "uploaded_at"))
+        if wants_ndjson(request, stream):
+            return ndjson_response(storage.notes.stream(note_fields, subject=subject, semester=semester))
+
+        async def produce():
+            notes, next_cursor = await storage.notes.page(
+                limit, cursor, note_fields, subject=subject, semester=semester
+            )
+            return {"items": notes, "next_cursor": next_cursor}
+
+        return await response_cache.respond(request, ["notes"], produce)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@api_router.post("/notes", response_model=Note)
-async def create_note(note_data: NoteCreate):
+async def _insert_note(note: Note):
+    """Insert a note and bring search, stats, the catalog and cached lists up to date"""
+    note_dict = note.dict()
+    await storage.notes.insert(note_dict)
+    index_note(note_dict)
+    await record_stats(db, notes_changed([note_dict]))
+    await record_catalog_changes(db, upserted=[note_dict])
+    await response_cache.invalidate("notes")
+
+@api_router.post("/notes", response_model=Note, dependencies=[limited("write")])
+async def create_note(note_data: NoteCreate, idempotency_key: Optional[str] = Header(None)):
     """Create a new note"""
     try:
-        note = Note(**note_data.dict())
-        note_dict = prepare_for_mongo(note.dict())
-        await db.notes.insert_one(note_dict)
-        return note
+        async def perform():
+            note = Note(**note_data.dict())
+            try:
+                await _insert_note(note)
+            except DuplicateKeyError:
+                raise HTTPException(status_code=409, detail="A note with this file_url already exists")
+            return note.dict()
+
+        return await idempotency.run(db, idempotency_key, "notes", note_data.dict(), perform)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@api_router.post("/notes/bulk", dependencies=[limited("write")])
+async def bulk_create_notes(request: Request):
+    """Create notes from a JSON array or NDJSON stream, deduplicated by file_url"""
+    try:
+        report, inserted = await ingest_notes(storage.notes, iter_request_rows(request))
+        for note_dict in inserted:
+            index_note(note_dict)
+        if inserted:
+            await record_stats(db, notes_changed(inserted))
+            await record_catalog_changes(db, upserted=inserted)
+            await response_cache.invalidate("notes")
+        return report
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @api_router.get("/notes/{note_id}", response_model=Note)
-async def get_note(note_id: str):
+async def get_note(note_id: str, fields: Optional[str] = None):
     """Get a specific note by ID"""
     try:
-        note = await db.notes.find_one({"id": note_id})
+        note = await storage.notes.get(note_id, resolve_projection(Note, fields, NOTE_FIELDS))
         if not note:
             raise HTTPException(status_code=404, detail="Note not found")
-        return Note(**parse_from_mongo(note))
+        return json_response(note)
     except HTTPException:
         raise
     except Exception as e:
@@ -146,46 +262,193 @@ async def get_note(note_id: str):
 
 @api_router.delete("/notes/{note_id}")
 async def delete_note(note_id: str):
-    """Delete a note"""
+    """Delete a note; with MongoDB it is tombstoned now and purged in the background"""
     try:
-        result = await db.notes.delete_one({"id": note_id})
-        if result.deleted_count == 0:
+        note = await storage.notes.delete(note_id, {"_id": 0, "subject": 1, "semester": 1})
+        if note is None:
             raise HTTPException(status_code=404, detail="Note not found")
+        notes_index.remove(note_id)
+        await record_stats(db, notes_changed([note], -1))
+        await record_catalog_changes(db, removed=[note_id])
+        await response_cache.invalidate("notes")
+        purger.wake()
         return {"message": "Note deleted successfully"}
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+# Upload endpoints
+@api_router.post("/uploads", dependencies=[limited("write"), needs_mongo()])
+async def create_upload(upload_data: UploadCreate):
+    """Start a resumable upload; chunks are then PUT to /api/uploads/{id}"""
+    try:
+        return json_response(await upload_manager.create(db, upload_data), status_code=201)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@api_router.get("/uploads/{upload_id}", dependencies=[needs_mongo()])
+async def get_upload(upload_id: str):
+    """Upload progress; `offset` is where the next chunk starts"""
+    try:
+        return json_response(await upload_manager.status(db, upload_id))
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@api_router.put("/uploads/{upload_id}", dependencies=[limited("upload"), needs_mongo()])
+async def put_upload_chunk(upload_id: str, request: Request, content_range: Optional[str] = Header(None)):
+    """Append one chunk, streamed to disk as it arrives"""
+    try:
+        return json_response(await upload_manager.write_chunk(db, upload_id, content_range, request.stream()))
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@api_router.post("/uploads/{upload_id}/complete", response_model=Note, dependencies=[limited("write"), needs_mongo()])
+async def complete_upload(upload_id: str, note_data: NoteUpload):
+    """Store the uploaded PDF, deduplicated by SHA-256, and create its note"""
+    try:
+        async def create(note_id, digest, size):
+            # A completion retried after a crash may find its note already written
+            if not await storage.notes.get(note_id, {"id": 1}):
+                await _insert_note(Note(
+                    **note_data.dict(), id=note_id, size=human_size(size), size_bytes=size, sha256=digest,
+                    file_url=f"/api/files/{note_id}",
+                ))
+            await processor.enqueue(db, note_id, digest)
+
+        session = await upload_manager.complete(db, upload_id, create)
+        note = await storage.notes.get(session["note_id"])
+        if not note:
+            raise HTTPException(status_code=404, detail="Note not found")
+        return json_response(note)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+# File endpoints
+@api_router.api_route("/files/{note_id}", methods=["GET", "HEAD"])
+async def download_note_file(note_id: str, request: Request):
+    """A note's file: uploaded ones are served with Range support, external ones redirect"""
+    try:
+        note = await storage.notes.get(note_id, {"_id": 0, "title": 1, "sha256": 1, "file_url": 1})
+        if not note:
+            raise HTTPException(status_code=404, detail="Note not found")
+        if note.get("sha256"):
+            return await blob_store.response(request, note["sha256"], f"{note['title']}.pdf")
+        if (note.get("file_url") or "").startswith(("http://", "https://")):
+            return RedirectResponse(note["file_url"], status_code=307)
+        raise HTTPException(status_code=404, detail="Note has no file")
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@api_router.get("/files/{note_id}/thumbnail", dependencies=[needs_mongo()])
+async def get_note_thumbnail(note_id: str, request: Request):
+    """First-page PNG of an uploaded note, once processing has rendered it"""
+    try:
+        note = await storage.notes.get(note_id, {"_id": 0, "sha256": 1})
+        if not note or not note.get("sha256"):
+            raise HTTPException(status_code=404, detail="Note not found")
+        return await thumbnail_response(request, db, note["sha256"])
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@api_router.get("/notes/{note_id}/processing", dependencies=[needs_mongo()])
+async def get_note_processing(note_id: str):
+    """Where an uploaded note's PDF is in text extraction and thumbnailing"""
+    try:
+        return json_response(await job_status(db, note_id))
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+# Catalog endpoints
+@api_router.get("/catalog")
+async def get_catalog(request: Request, since: Optional[int] = Query(None, ge=0)):
+    """Every note grouped by subject and semester, or only the changes after catalog version `since`"""
+    try:
+        return await catalog.respond(request, db, storage.notes, since)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
 # Discussion endpoints
-@api_router.get("/discussions", response_model=List[Discussion])
-async def get_discussions():
-    """Get all discussions"""
+@api_router.get("/discussions", response_model=Page[Discussion])
+async def get_discussions(
+    request: Request,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    stream: bool = False,
+    fields: Optional[str] = None,
+    sort: Literal["new", "hot", "top", "active"] = "new",
+):
+    """Get a page of discussions ranked by sort (newest first by default), or all of them as NDJSON"""
     try:
-        discussions = await db.discussions.find().sort("created_at", -1).to_list(length=None)
-        return [Discussion(**parse_from_mongo(discussion)) for discussion in discussions]
+        sort_field = SORT_FIELDS[sort]
+        discussion_fields = resolve_projection(
+            Discussion, fields, DISCUSSION_LIST_FIELDS, required=("id", sort_field)
+        )
+        if wants_ndjson(request, stream):
+            return ndjson_response(
+                storage.discussions.stream(sort_field, discussion_fields),
+                lambda doc: upvote_buffer.merge("discussions", [doc])[0],
+            )
+
+        async def produce():
+            discussions, next_cursor = await storage.discussions.page(sort_field, limit, cursor, discussion_fields)
+            upvote_buffer.merge("discussions", discussions)
+            return {"items": discussions, "next_cursor": next_cursor}
+
+        return await response_cache.respond(request, ["discussions"], produce)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@api_router.post("/discussions", response_model=Discussion)
-async def create_discussion(discussion_data: DiscussionCreate):
+@api_router.post("/discussions", response_model=Discussion, dependencies=[limited("write")])
+async def create_discussion(discussion_data: DiscussionCreate, idempotency_key: Optional[str] = Header(None)):
     """Create a new discussion"""
     try:
-        discussion = Discussion(**discussion_data.dict())
-        discussion_dict = prepare_for_mongo(discussion.dict())
-        await db.discussions.insert_one(discussion_dict)
-        return discussion
+        async def perform():
+            discussion = Discussion(**discussion_data.dict(), excerpt=make_excerpt(discussion_data.content))
+            discussion.hot_score = hot_score(0, 0, discussion.created_at)
+            discussion_dict = discussion.dict()
+            await storage.discussions.insert(discussion_dict)
+            index_discussion(discussion_dict)
+            await record_stats(db, discussion_changed(discussion_dict))
+            await response_cache.invalidate("discussions")
+            event_hub.discussion_created(discussion_dict)
+            return discussion.dict()
+
+        return await idempotency.run(db, idempotency_key, "discussions", discussion_data.dict(), perform)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @api_router.get("/discussions/{discussion_id}", response_model=Discussion)
-async def get_discussion(discussion_id: str):
+async def get_discussion(discussion_id: str, fields: Optional[str] = None):
     """Get a specific discussion by ID"""
     try:
-        discussion = await db.discussions.find_one({"id": discussion_id})
+        discussion = await storage.discussions.get(
+            discussion_id, resolve_projection(Discussion, fields, DISCUSSION_FIELDS)
+        )
         if not discussion:
             raise HTTPException(status_code=404, detail="Discussion not found")
-        return Discussion(**parse_from_mongo(discussion))
+        upvote_buffer.merge("discussions", [discussion])
+        return json_response(discussion)
     except HTTPException:
         raise
     except Exception as e:
@@ -193,52 +456,94 @@ async def get_discussion(discussion_id: str):
 
 @api_router.delete("/discussions/{discussion_id}")
 async def delete_discussion(discussion_id: str):
-    """Delete a discussion"""
+    """Delete a discussion and its replies; MongoDB tombstones them now and purges in the background"""
     try:
-        # Also delete all replies to this discussion
-        await db.replies.delete_many({"discussion_id": discussion_id})
-        
-        # Delete the discussion
-        result = await db.discussions.delete_one({"id": discussion_id})
-        if result.deleted_count == 0:
+        discussion = await storage.discussions.delete(discussion_id, {"_id": 0, "created_at": 1})
+        if discussion is None:
             raise HTTPException(status_code=404, detail="Discussion not found")
+        discussions_index.remove(discussion_id)
+        await record_stats(db, discussion_changed(discussion, -1))
+        upvote_buffer.forget("discussions", discussion_id)
+        await response_cache.invalidate("discussions", f"replies:{discussion_id}")
+        event_hub.notify("discussion.deleted", {"id": discussion_id})
+        purger.wake()
         return {"message": "Discussion deleted successfully"}
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@api_router.get("/discussions/{discussion_id}/thread")
+async def get_thread(
+    request: Request,
+    discussion_id: str,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    fields: Optional[str] = None,
+):
+    """Get a discussion with its first page of replies in one round-trip"""
+    try:
+        discussion_fields = resolve_projection(Discussion, None, DISCUSSION_FIELDS)
+        reply_fields = resolve_projection(Reply, fields, REPLY_FIELDS, required=("id", "created_at"))
+
+        async def produce():
+            discussion, replies, next_cursor = await storage.discussions.thread(
+                discussion_id, discussion_fields, reply_fields, limit
+            )
+            if discussion is None:
+                raise HTTPException(status_code=404, detail="Discussion not found")
+            upvote_buffer.merge("discussions", [discussion])
+            upvote_buffer.merge("replies", replies)
+            return {"discussion": discussion, "replies": replies, "next_cursor": next_cursor}
+
+        return await response_cache.respond(request, ["discussions", f"replies:{discussion_id}"], produce)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
 # Reply endpoints
-@api_router.get("/discussions/{discussion_id}/replies", response_model=List[Reply])
-async def get_replies(discussion_id: str):
-    """Get all replies for a discussion"""
+@api_router.get("/discussions/{discussion_id}/replies", response_model=Page[Reply])
+async def get_replies(
+    request: Request,
+    discussion_id: str,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+):
+    """Get a page of replies for a discussion, oldest first"""
     try:
-        replies = await db.replies.find({"discussion_id": discussion_id}).sort("created_at", 1).to_list(length=None)
-        return [Reply(**parse_from_mongo(reply)) for reply in replies]
+        reply_fields = resolve_projection(Reply, fields, REPLY_FIELDS, required=("id", "created_at"))
+
+        async def produce():
+            replies, next_cursor = await storage.replies.page(discussion_id, limit, cursor, reply_fields)
+            return {"items": upvote_buffer.merge("replies", replies), "next_cursor": next_cursor}
+
+        return await response_cache.respond(request, [f"replies:{discussion_id}"], produce)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@api_router.post("/discussions/{discussion_id}/replies", response_model=Reply)
-async def create_reply(discussion_id: str, reply_data: ReplyCreate):
+@api_router.post("/discussions/{discussion_id}/replies", response_model=Reply, dependencies=[limited("write")])
+async def create_reply(discussion_id: str, reply_data: ReplyCreate, idempotency_key: Optional[str] = Header(None)):
     """Create a new reply to a discussion"""
     try:
-        # Check if discussion exists
-        discussion = await db.discussions.find_one({"id": discussion_id})
-        if not discussion:
-            raise HTTPException(status_code=404, detail="Discussion not found")
-        
-        # Create reply
-        reply = Reply(discussion_id=discussion_id, **reply_data.dict())
-        reply_dict = prepare_for_mongo(reply.dict())
-        await db.replies.insert_one(reply_dict)
-        
-        # Update discussion reply count
-        await db.discussions.update_one(
-            {"id": discussion_id},
-            {"$inc": {"replies": 1}}
-        )
-        
-        return reply
+        async def perform():
+            # The counter update doubles as the existence check
+            reply = Reply(discussion_id=discussion_id, **reply_data.dict())
+            reply_dict = reply.dict()
+            if not await storage.replies.insert(reply_dict):
+                raise HTTPException(status_code=404, detail="Discussion not found")
+
+            index_reply(reply_dict)
+            await storage.discussions.refresh_hot_scores([discussion_id])
+            await record_stats(db, replies_changed({day_of(reply.created_at): 1}))
+            await response_cache.invalidate("discussions", f"replies:{discussion_id}")
+            event_hub.reply_created(reply_dict)
+            await event_hub.notify_counts(storage, [discussion_id])
+            return reply.dict()
+
+        return await idempotency.run(db, idempotency_key, f"replies:{discussion_id}", reply_data.dict(), perform)
     except HTTPException:
         raise
     except Exception as e:
@@ -248,19 +553,18 @@ async def create_reply(discussion_id: str, reply_data: ReplyCreate):
 async def delete_reply(reply_id: str):
     """Delete a reply"""
     try:
-        # Get the reply to find which discussion it belongs to
-        reply = await db.replies.find_one({"id": reply_id})
+        # Deleting returns the reply, so we learn its discussion without a lookup
+        reply = await storage.replies.delete(reply_id)
         if not reply:
             raise HTTPException(status_code=404, detail="Reply not found")
         
-        # Delete the reply
-        await db.replies.delete_one({"id": reply_id})
-        
-        # Update discussion reply count
-        await db.discussions.update_one(
-            {"id": reply["discussion_id"]},
-            {"$inc": {"replies": -1}}
-        )
+        discussions_index.retract(reply["discussion_id"], "replies", reply.get("content"))
+        await storage.discussions.refresh_hot_scores([reply["discussion_id"]])
+        await record_stats(db, replies_changed({day_of(reply["created_at"]): 1}, -1))
+        upvote_buffer.forget("replies", reply_id)
+        await response_cache.invalidate("discussions", f"replies:{reply['discussion_id']}")
+        event_hub.notify("reply.deleted", {"id": reply_id, "discussion_id": reply["discussion_id"]})
+        await event_hub.notify_counts(storage, [reply["discussion_id"]])
         
         return {"message": "Reply deleted successfully"}
     except HTTPException:
@@ -269,115 +573,361 @@ async def delete_reply(reply_id: str):
         raise HTTPException(status_code=500, detail=str(e))
 
 # Feedback endpoints
-@api_router.post("/feedback", response_model=Feedback)
-async def submit_feedback(feedback_data: FeedbackCreate):
+@api_router.post("/feedback", response_model=Feedback, dependencies=[limited("write")])
+async def submit_feedback(feedback_data: FeedbackCreate, idempotency_key: Optional[str] = Header(None)):
     """Submit user feedback"""
     try:
-        feedback = Feedback(**feedback_data.dict())
-        feedback_dict = prepare_for_mongo(feedback.dict())
-        await db.feedback.insert_one(feedback_dict)
-        return feedback
+        async def perform():
+            feedback = Feedback(**feedback_data.dict())
+            feedback_dict = feedback.dict()
+            await storage.feedback.insert(feedback_dict)
+            await record_stats(db, feedback_changed(feedback_dict))
+            await response_cache.invalidate("feedback")
+            return feedback.dict()
+
+        return await idempotency.run(db, idempotency_key, "feedback", feedback_data.dict(), perform)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@api_router.get("/feedback", response_model=List[Feedback])
-async def get_feedback():
-    """Get all feedback (admin only)"""
+@api_router.get("/feedback", response_model=Page[Feedback])
+async def get_feedback(
+    request: Request,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    stream: bool = False,
+    fields: Optional[str] = None,
+):
+    """Get a page of feedback newest first, or all of it as NDJSON (admin only)"""
     try:
-        feedback_list = await db.feedback.find().sort("created_at", -1).to_list(length=None)
-        return [Feedback(**parse_from_mongo(feedback)) for feedback in feedback_list]
+        feedback_fields = resolve_projection(Feedback, fields, FEEDBACK_FIELDS, required=("id", "created_at"))
+        if wants_ndjson(request, stream):
+            return ndjson_response(storage.feedback.stream(feedback_fields))
+
+        async def produce():
+            feedback_list, next_cursor = await storage.feedback.page(limit, cursor, feedback_fields)
+            return {"items": feedback_list, "next_cursor": next_cursor}
+
+        return await response_cache.respond(request, ["feedback"], produce)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 # Upvote endpoints
-@api_router.post("/discussions/{discussion_id}/upvote")
+@api_router.post("/discussions/{discussion_id}/upvote", dependencies=[limited("vote")])
 async def upvote_discussion(discussion_id: str):
     """Upvote a discussion"""
     try:
-        result = await db.discussions.update_one(
-            {"id": discussion_id},
-            {"$inc": {"upvotes": 1}}
-        )
-        if result.modified_count == 0:
-            raise HTTPException(status_code=404, detail="Discussion not found")
+        exists, _ = upvote_buffer.known("discussions", discussion_id)
+        if not exists:
+            if not await storage.discussions.exists(discussion_id):
+                raise HTTPException(status_code=404, detail="Discussion not found")
+            upvote_buffer.remember("discussions", discussion_id)
+        upvote_buffer.increment("discussions", discussion_id)
+        await response_cache.invalidate("discussions")
         return {"message": "Discussion upvoted successfully"}
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@api_router.post("/replies/{reply_id}/upvote")
+@api_router.post("/replies/{reply_id}/upvote", dependencies=[limited("vote")])
 async def upvote_reply(reply_id: str):
     """Upvote a reply"""
     try:
-        result = await db.replies.update_one(
-            {"id": reply_id},
-            {"$inc": {"upvotes": 1}}
-        )
-        if result.modified_count == 0:
-            raise HTTPException(status_code=404, detail="Reply not found")
+        exists, discussion_id = upvote_buffer.known("replies", reply_id)
+        if not exists:
+            reply = await storage.replies.get(reply_id, {"_id": 0, "discussion_id": 1})
+            if reply is None:
+                raise HTTPException(status_code=404, detail="Reply not found")
+            discussion_id = reply["discussion_id"]
+            upvote_buffer.remember("replies", reply_id, discussion_id)
+        upvote_buffer.increment("replies", reply_id)
+        await response_cache.invalidate(f"replies:{discussion_id}")
         return {"message": "Reply upvoted successfully"}
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+# Push endpoint
+@api_router.get("/events")
+async def stream_events(request: Request):
+    """Server-Sent Events for discussion, reply and upvote activity"""
+    try:
+        return event_hub.stream(request)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+# Stats endpoints
+@api_router.get("/stats", dependencies=[needs_mongo()])
+async def get_stats(request: Request, days: int = Query(30, ge=1, le=365)):
+    """Notes per subject/semester, feedback ratings and daily discussion activity"""
+    try:
+        async def produce():
+            return await read_stats(db, days)
+
+        return await response_cache.respond(request, ["notes", "discussions", "feedback"], produce)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
 # Search endpoints
-@api_router.get("/search/notes")
-async def search_notes(q: str, subject: Optional[str] = None, semester: Optional[str] = None):
-    """Search notes by title or content"""
-    try:
-        filter_query = {
-            "$or": [
-                {"title": {"$regex": q, "$options": "i"}},
-                {"subject": {"$regex": q, "$options": "i"}}
-            ]
-        }
-        
-        if subject:
-            filter_query["subject"] = subject
-        if semester:
-            filter_query["semester"] = semester
-        
-        notes = await db.notes.find(filter_query).sort("uploaded_at", -1).to_list(length=None)
-        return [Note(**parse_from_mongo(note)) for note in notes]
+async def _fetch_ranked(repo, ranked, fields):
+    """Load ranked ids through the repository, preserving search order"""
+    ids = [doc_id for doc_id, _ in ranked]
+    docs = await repo.find_many(ids, fields)
+    by_id = {doc["id"]: doc for doc in docs}
+    return [by_id[doc_id] for doc_id in ids if doc_id in by_id]
+
+@api_router.get("/search/notes", response_model=List[Note], dependencies=[limited("search")])
+async def search_notes(
+    q: str = Query(..., min_length=1, max_length=MAX_QUERY_LENGTH),
+    subject: Optional[str] = None,
+    semester: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    fields: Optional[str] = None,
+):
+    """Search notes by title or subject, best match first"""
+    try:
+        note_fields = resolve_projection(Note, fields, NOTE_FIELDS)
+        ranked = notes_index.search(q, {"subject": subject, "semester": semester}, limit)
+        return json_response(await _fetch_ranked(storage.notes, ranked, note_fields))
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@api_router.get("/search/discussions")
-async def search_discussions(q: str):
-    """Search discussions by title or content"""
+@api_router.get("/search/discussions", response_model=List[Discussion], dependencies=[limited("search")])
+async def search_discussions(
+    q: str = Query(..., min_length=1, max_length=MAX_QUERY_LENGTH),
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    fields: Optional[str] = None,
+):
+    """Search discussions by title, content or replies, best match first"""
     try:
-        filter_query = {
-            "$or": [
-                {"title": {"$regex": q, "$options": "i"}},
-                {"content": {"$regex": q, "$options": "i"}}
-            ]
-        }
-        
-        discussions = await db.discussions.find(filter_query).sort("created_at", -1).to_list(length=None)
-        return [Discussion(**parse_from_mongo(discussion)) for discussion in discussions]
+        discussion_fields = resolve_projection(Discussion, fields, DISCUSSION_LIST_FIELDS)
+        ranked = discussions_index.search(q, limit=limit)
+        discussions = await _fetch_ranked(storage.discussions, ranked, discussion_fields)
+        return json_response(upvote_buffer.merge("discussions", discussions))
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-# Include the router in the main app
-app.include_router(api_router)
+# Probes and metrics live outside /api
+ops_router = APIRouter()
+
+@ops_router.get("/healthz", include_in_schema=False)
+async def healthz():
+    """Liveness: the process is up and serving"""
+    return {"status": "ok"}
+
+@ops_router.get("/readyz", include_in_schema=False)
+async def readyz():
+    """Readiness: startup finished and the storage engine answers"""
+    status = await storage.check()
+    return json_response(status, status_code=200 if status["ready"] else 503)
+
+@ops_router.get("/metrics", include_in_schema=False)
+async def metrics():
+    """Prometheus scrape endpoint"""
+    return Response(content=registry.render(), media_type=PROMETHEUS_MEDIA_TYPE)
+
+# Operator endpoints, outside /api and behind ADMIN_TOKEN
+@ops_router.post("/admin/stats/rebuild", include_in_schema=False, dependencies=[requires_admin(), needs_mongo()])
+async def rebuild_stats_rollups():
+    """Recompute the stats rollups from the source collections"""
+    try:
+        rollups = await rebuild_stats(db)
+        await response_cache.invalidate("notes", "discussions", "feedback")
+        return {"rollups": rollups}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
 
-app.add_middleware(
-    CORSMiddleware,
-    allow_credentials=True,
-    allow_origins=os.environ.get('CORS_ORIGINS', '*').split(','),
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+@ops_router.get("/admin/purge/status", include_in_schema=False, dependencies=[requires_admin(), needs_mongo()])
+async def get_purge_status():
+    """Deleted notes and discussions still waiting to be purged, with progress"""
+    try:
+        return json_response(await purge_status(db))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
 logger = logging.getLogger(__name__)
 
-@app.on_event("shutdown")
-async def shutdown_db_client():
-    client.close()
\ No newline at end of file
+def create_app(app_settings: Optional[Settings] = None) -> FastAPI:
+    """Build the application and its per-process state
+
+    Nothing connects here; the Motor client is opened by the lifespan
+    handler inside each worker. Handlers share module state, so only one
+    app can be built per process; a second call raises RuntimeError.
+    """
+    global settings, mongo, response_cache, upvote_buffer, rate_limiter, catalog, event_hub, idempotency, purger
+    global blob_store, upload_manager, processor, storage, app
+    if settings is not None:
+        raise RuntimeError("create_app() was already called in this process; its state would be replaced")
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+    settings = app_settings or Settings.from_env()
+    mongo = MongoConnection(settings)
+
+    # Notes, discussions, replies and feedback, in the engine STORAGE_ENGINE names
+    storage = storage_from_settings(settings, mongo)
+
+    # Cached list responses, invalidated by tag from the write handlers
+    response_cache = cache_from_env(settings.compress_min_bytes)
+
+    # Latest rendered catalog snapshot, re-rendered when the catalog version moves
+    catalog = Catalog(settings.compress_min_bytes)
+
+    # Fan-out of discussion activity to /api/events subscribers
+    event_hub = hub_from_env()
+    if event_hub.source == "changestream" and storage.engine != "mongo":
+        logger.warning("EVENTS_SOURCE=changestream needs MongoDB; publishing this worker's writes only")
+        event_hub.source = "local"
+
+    # Stored responses for retried create requests, keyed by Idempotency-Key
+    idempotency = idempotency_from_env(default="mongo" if storage.engine == "mongo" else "memory")
+
+    # Removes tombstoned notes and discussions, and discussions' replies, in throttled batches
+    purger = Purger(settings.purge_batch_size, settings.purge_pause_ms / 1000)
+
+    # Uploaded files, stored once per SHA-256, and the resumable sessions that fill them
+    blob_store = blobs_from_env()
+    upload_manager = uploads_from_env(blob_store)
+
+    # Text, page count and thumbnail of uploaded PDFs, extracted in a process pool
+    processor = DocumentProcessor(
+        blob_store,
+        workers=settings.processing_workers or default_workers(),
+        timeout=settings.processing_timeout_seconds,
+        max_attempts=settings.processing_max_attempts,
+        on_processed=_after_processing,
+    )
+
+    # Per-client token buckets for write, vote and search routes
+    rate_limiter = limiter_from_env()
+
+    # Upvotes are coalesced in memory and flushed in bulk
+    upvote_buffer = CounterBuffer(
+        flush_interval=settings.upvote_flush_ms / 1000,
+        max_pending_ops=settings.upvote_flush_ops,
+        on_flush=_after_counter_flush,
+    )
+
+    # Create the main app without a prefix
+    application = FastAPI(lifespan=lifespan, default_response_class=OrjsonResponse)
+
+    # Include the routers in the main app
+    application.include_router(api_router)
+    application.include_router(ops_router)
+
+    # Inside CORS, so shed responses still carry CORS headers. Event streams stay
+    # open indefinitely and are capped by the hub instead; file transfers (downloads
+    # and chunk PUTs) last as long as the client's connection and would otherwise
+    # hold slots API calls need. Completing an upload hashes the file, so it is admitted.
+    application.add_middleware(
+        AdmissionMiddleware,
+        max_in_flight=settings.max_in_flight,
+        queue_timeout=settings.admission_queue_ms / 1000,
+        exempt_paths=("/healthz", "/readyz", "/metrics", "/api/events"),
+        exempt_prefixes=("/api/files/",),
+        exempt_routes=(("PUT", r"/api/uploads/[^/]+"),),
+    )
+
+    application.add_middleware(
+        CORSMiddleware,
+        allow_credentials=True,
+        allow_origins=settings.cors_origins.split(','),
+        allow_methods=["*"],
+        allow_headers=["*"],
+    )
+
+    # Bodies the cache or catalog already encoded, event streams and file ranges pass through untouched
+    application.add_middleware(CompressionMiddleware, minimum_size=settings.compress_min_bytes)
+
+    # Outermost, so the timings include CORS, compression and error handling
+    application.add_middleware(MetricsMiddleware)
+    app = application
+    return application
+
+def __getattr__(name):
+    # `uvicorn server:app` keeps working; the app is built on first access
+    if name == "app":
+        return create_app()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+# Startup steps, run in order by lifespan() once MongoDB answers
+async def mark_live_notes():
+    # Before the indexes: file_url_unique only covers notes with an explicit deleted_at: null
+    try:
+        await backfill_live_notes(db)
+    except Exception:
+        logger.exception("Live-note backfill failed; older notes are not checked for duplicate URLs")
+
+async def bootstrap_indexes():
+    try:
+        report = await ensure_indexes(db)
+        if not is_healthy(report):
+            logger.warning("Index reconciliation incomplete: %s", report)
+    except Exception:
+        logger.exception("Index bootstrap failed; serving without guaranteed indexes")
+
+async def migrate_legacy_dates():
+    # Rows written before dates were stored natively would sort apart from new ones
+    try:
+        await migrate_dates(db)
+    except Exception:
+        logger.exception("Date migration failed; legacy rows may sort out of order")
+
+async def backfill_discussion_excerpts():
+    try:
+        await backfill_excerpts(db)
+    except Exception:
+        logger.exception("Excerpt backfill failed; older discussions list without an excerpt")
+
+async def bootstrap_stats():
+    # First deploy: build the rollups once; after that the write handlers keep them current
+    try:
+        if await db.stats.estimated_document_count() == 0:
+            logger.info("Built %d stats rollups", await rebuild_stats(db))
+    except Exception:
+        logger.exception("Stats rollup build failed; /api/stats may undercount until rebuilt")
+
+async def bootstrap_search():
+    since = watermark()
+    try:
+        await build_indexes(storage, db)
+        logger.info("Search indexes built: %d notes, %d discussions", len(notes_index), len(discussions_index))
+    except Exception:
+        logger.exception("Search index build failed; search results will be empty")
+    return since
+
+async def keep_hot_scores_fresh():
+    # The first pass also scores discussions created before hot_score existed
+    while True:
+        try:
+            # Every worker runs this loop; on MongoDB only the lease holder decays
+            if db is None or await claim_decay_pass(db, settings.hot_decay_seconds):
+                changed = await storage.discussions.decay_hot_scores()
+                if changed:
+                    await response_cache.invalidate("discussions")
+        except Exception:
+            logger.exception("Hot score decay failed; retrying next interval")
+        await asyncio.sleep(settings.hot_decay_seconds)
+
+async def keep_search_current(since):
+    # Other workers' inserts only reach this worker's index through here
+    while True:
+        await asyncio.sleep(settings.search_catch_up_seconds)
+        try:
+            since = await catch_up(db, since)
+        except Exception:
+            logger.exception("Search catch-up failed; retrying next interval")
@@ -0,0 +1,108 @@
+"""Process configuration, read once from the environment (and backend/.env).
+
+create_app() takes a Settings; the cache, rate limit, event and
+streaming modules still read their own variables with os.environ.get.
+"""
+import os
+from dataclasses import dataclass
+from pathlib import Path
+
+from dotenv import load_dotenv
+
+ROOT_DIR = Path(__file__).parent
+
+
+def _flag(name: str, default: str = 'false') -> bool:
+    return os.environ.get(name, default).strip().lower() in ('1', 'true', 'yes', 'on')
+
+
+@dataclass(frozen=True)
+class Settings:
+    mongo_url: str
+    db_name: str
+    # mongo, memory or sqlite (storage.py); only mongo needs MONGO_URL and DB_NAME
+    storage_engine: str = "mongo"
+    sqlite_path: str = str(ROOT_DIR / "studyhub.db")
+    # Connection pool, per process
+    max_pool_size: int = 100
+    min_pool_size: int = 0
+    max_connecting: int = 2
+    wait_queue_timeout_ms: int = 5000
+    server_selection_timeout_ms: int = 5000
+    # primary, primaryPreferred, secondary, secondaryPreferred or nearest
+    read_preference: str = "primary"
+    # List and search routes read with secondaryPreferred when true
+    secondary_reads: bool = False
+    max_staleness_seconds: int = 0
+    # Cold start: random delay before the first connection, then retries with backoff
+    startup_jitter_ms: int = 1000
+    connect_attempts: int = 6
+    connect_backoff_ms: int = 500
+    connect_backoff_max_ms: int = 10000
+    warmup_connections: int = 0
+    cors_origins: str = "*"
+    # Bearer token for the /admin endpoints; they answer 403 while it is unset
+    admin_token: str = ""
+    upvote_flush_ms: int = 250
+    upvote_flush_ops: int = 500
+    # Requests handled at once before new ones are shed with 503; 0 disables the cap
+    max_in_flight: int = 100
+    admission_queue_ms: int = 50
+    # Response bodies smaller than this are sent uncompressed
+    compress_min_bytes: int = 1024
+    # How often hot_score is re-decayed for the whole recent window
+    hot_decay_seconds: float = 300
+    # With several workers, pull other workers' inserts into the search index this often
+    search_catch_up_seconds: float = 0
+    # Background purge of soft-deleted documents: batch size, minimum pause between batches, idle interval
+    purge_batch_size: int = 500
+    purge_pause_ms: int = 100
+    purge_interval_seconds: float = 30
+    # PDF processing pool per worker (0: half the cores, split across WEB_CONCURRENCY workers)
+    processing_workers: int = 0
+    processing_timeout_seconds: float = 120
+    processing_max_attempts: int = 5
+    processing_poll_seconds: float = 30
+
+    @classmethod
+    def from_env(cls) -> "Settings":
+        load_dotenv(ROOT_DIR / '.env')
+        min_pool_size = int(os.environ.get('MONGO_MIN_POOL_SIZE', '0'))
+        storage_engine = os.environ.get('STORAGE_ENGINE', 'mongo')
+        # The other engines run without a cluster, so only mongo requires its URL
+        needs_mongo = storage_engine == 'mongo'
+        return cls(
+            mongo_url=os.environ['MONGO_URL'] if needs_mongo else os.environ.get('MONGO_URL', ''),
+            db_name=os.environ['DB_NAME'] if needs_mongo else os.environ.get('DB_NAME', ''),
+            storage_engine=storage_engine,
+            sqlite_path=os.environ.get('SQLITE_PATH', str(ROOT_DIR / 'studyhub.db')),
+            max_pool_size=int(os.environ.get('MONGO_MAX_POOL_SIZE', '100')),
+            min_pool_size=min_pool_size,
+            max_connecting=int(os.environ.get('MONGO_MAX_CONNECTING', '2')),
+            wait_queue_timeout_ms=int(os.environ.get('MONGO_WAIT_QUEUE_TIMEOUT_MS', '5000')),
+            server_selection_timeout_ms=int(os.environ.get('MONGO_SERVER_SELECTION_TIMEOUT_MS', '5000')),
+            read_preference=os.environ.get('MONGO_READ_PREFERENCE', 'primary'),
+            secondary_reads=_flag('MONGO_SECONDARY_READS'),
+            max_staleness_seconds=int(os.environ.get('MONGO_MAX_STALENESS_SECONDS', '0')),
+            startup_jitter_ms=int(os.environ.get('MONGO_STARTUP_JITTER_MS', '1000')),
+            connect_attempts=int(os.environ.get('MONGO_CONNECT_ATTEMPTS', '6')),
+            connect_backoff_ms=int(os.environ.get('MONGO_CONNECT_BACKOFF_MS', '500')),
+            connect_backoff_max_ms=int(os.environ.get('MONGO_CONNECT_BACKOFF_MAX_MS', '10000')),
+            warmup_connections=int(os.environ.get('MONGO_WARMUP_CONNECTIONS', str(min_pool_size))),
+            cors_origins=os.environ.get('CORS_ORIGINS', '*'),
+            admin_token=os.environ.get('ADMIN_TOKEN', ''),
+            upvote_flush_ms=int(os.environ.get('UPVOTE_FLUSH_MS', '250')),
+            upvote_flush_ops=int(os.environ.get('UPVOTE_FLUSH_OPS', '500')),
+            max_in_flight=int(os.environ.get('MAX_IN_FLIGHT', os.environ.get('MONGO_MAX_POOL_SIZE', '100'))),
+            admission_queue_ms=int(os.environ.get('ADMISSION_QUEUE_MS', '50')),
+            compress_min_bytes=int(os.environ.get('COMPRESS_MIN_BYTES', '1024')),
+            hot_decay_seconds=float(os.environ.get('HOT_DECAY_SECONDS', '300')),
+            search_catch_up_seconds=float(os.environ.get('SEARCH_CATCH_UP_SECONDS', '0')),
+            purge_batch_size=int(os.environ.get('PURGE_BATCH_SIZE', '500')),
+            purge_pause_ms=int(os.environ.get('PURGE_PAUSE_MS', '100')),
+            purge_interval_seconds=float(os.environ.get('PURGE_INTERVAL_SECONDS', '30')),
+            processing_workers=int(os.environ.get('PROCESSING_WORKERS', '0')),
+            processing_timeout_seconds=float(os.environ.get('PROCESSING_TIMEOUT_SECONDS', '120')),
+            processing_max_attempts=int(os.environ.get('PROCESSING_MAX_ATTEMPTS', '5')),
+            processing_poll_seconds=float(os.environ.get('PROCESSING_POLL_SECONDS', '30')),
+        )
@@ -0,0 +1,220 @@
+"""Rollup counters behind GET /api/stats.
+
+The `stats` collection holds one small document per group, keyed by a
+compound _id:
+
+    {"kind": "notes", "subject": ..., "semester": ...}   count
+    {"kind": "feedback", "rating": ...}                  count
+    {"kind": "activity", "day": "YYYY-MM-DD"}            discussions, replies
+
+Write handlers adjust the matching documents with an upserting $inc, so
+reading the dashboard touches a few hundred tiny documents at most,
+however large the collections grow. A failed rollup write is logged and
+does not fail the request; rebuild() recomputes every rollup from the
+source collections with one $group/$merge pipeline per kind. It builds
+into a scratch collection and renames it over `stats`, so the dashboard
+keeps serving the old rollups until the new ones are complete:
+
+    python stats.py --rebuild
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import uuid
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Dict, Iterable, List, Tuple
+
+from pymongo import UpdateOne
+
+logger = logging.getLogger(__name__)
+
+STATS_COLLECTION = "stats"
+# Same as purge.LIVE; tombstoned documents leave the rollups when deleted, their replies when purged
+LIVE = {"deleted_at": None}
+DAY_FORMAT = "%Y-%m-%d"
+
+Delta = Tuple[dict, Dict[str, int]]
+
+
+def day_of(value: datetime) -> str:
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc)
+    return value.strftime(DAY_FORMAT)
+
+
+def note_key(note: dict) -> dict:
+    return {"kind": "notes", "subject": note.get("subject"), "semester": note.get("semester")}
+
+
+def feedback_key(feedback: dict) -> dict:
+    return {"kind": "feedback", "rating": feedback.get("rating")}
+
+
+def activity_key(day: str) -> dict:
+    return {"kind": "activity", "day": day}
+
+
+async def record(db, deltas: Iterable[Delta]):
+    """Fold the deltas per key and write them in one unordered bulk_write"""
+    if db is None:
+        # Rollups live in MongoDB; the memory and SQLite storage engines keep none
+        return
+    merged: Dict[tuple, Counter] = {}
+    keys = {}
+    for key, inc in deltas:
+        ident = tuple(key.items())
+        keys[ident] = key
+        merged.setdefault(ident, Counter()).update(inc)
+    operations = [
+        UpdateOne({"_id": keys[ident]}, {"$inc": dict(inc)}, upsert=True)
+        for ident, inc in merged.items() if any(inc.values())
+    ]
+    if not operations:
+        return
+    try:
+        await db[STATS_COLLECTION].bulk_write(operations, ordered=False)
+    except Exception:
+        logger.exception("Stats rollup update failed; run `python stats.py --rebuild` to repair")
+
+
+# Deltas for each write path
+
+def notes_changed(notes: Iterable[dict], sign: int = 1) -> List[Delta]:
+    return [(note_key(note), {"count": sign}) for note in notes]
+
+
+def feedback_changed(feedback: dict, sign: int = 1) -> List[Delta]:
+    return [(feedback_key(feedback), {"count": sign})]
+
+
+def discussion_changed(discussion: dict, sign: int = 1) -> List[Delta]:
+    return [(activity_key(day_of(discussion["created_at"])), {"discussions": sign})]
+
+
+def replies_changed(replies_per_day: Dict[str, int], sign: int = 1) -> List[Delta]:
+    return [(activity_key(day), {"replies": sign * count}) for day, count in replies_per_day.items()]
+
+
+# Rebuild
+
+def _merge_into(target: str) -> dict:
+    return {"$merge": {"into": target, "on": "_id", "whenMatched": "merge", "whenNotMatched": "insert"}}
+
+
+# Each pipeline ends with the $merge stage rebuild() appends
+REBUILD_PIPELINES = {
+    "notes": ("notes", [
+        {"$match": LIVE},
+        {"$group": {
+            "_id": {"kind": "notes", "subject": "$subject", "semester": "$semester"},
+            "count": {"$sum": 1},
+        }},
+    ]),
+    "feedback": ("feedback", [
+        {"$group": {"_id": {"kind": "feedback", "rating": "$rating"}, "count": {"$sum": 1}}},
+    ]),
+    "activity.discussions": ("discussions", [
+        {"$match": LIVE},
+        {"$group": {
+            "_id": {"kind": "activity", "day": {"$dateToString": {"format": DAY_FORMAT, "date": "$created_at"}}},
+            "discussions": {"$sum": 1},
+        }},
+    ]),
+    "activity.replies": ("replies", [
+        {"$group": {
+            "_id": {"kind": "activity", "day": {"$dateToString": {"format": DAY_FORMAT, "date": "$created_at"}}},
+            "replies": {"$sum": 1},
+        }},
+    ]),
+}
+
+
+async def rebuild(db) -> int:
+    """Recompute every rollup from the source collections; returns the rollup count
+
+    Writes that land while this runs are not counted; run it again, or
+    off-peak, if exact numbers matter.
+    """
+    scratch = f"{STATS_COLLECTION}_rebuild_{uuid.uuid4().hex[:8]}"
+    try:
+        for source, pipeline in REBUILD_PIPELINES.values():
+            async for _ in db[source].aggregate(pipeline + [_merge_into(scratch)]):
+                pass
+        if scratch not in await db.list_collection_names():
+            # Every source collection is empty, so there is nothing to rename
+            await db[STATS_COLLECTION].delete_many({})
+            return 0
+        await db[scratch].rename(STATS_COLLECTION, dropTarget=True)
+    except Exception:
+        await db.drop_collection(scratch)
+        raise
+    return await db[STATS_COLLECTION].count_documents({})
+
+
+async def read_stats(db, days: int = 30) -> dict:
+    """Shape the rollup documents into the dashboard response"""
+    since = (datetime.now(timezone.utc) - timedelta(days=days - 1)).strftime(DAY_FORMAT)
+    query = {"$or": [
+        {"_id.kind": {"$in": ["notes", "feedback"]}},
+        {"_id.kind": "activity", "_id.day": {"$gte": since}},
+    ]}
+    by_subject, by_semester, by_subject_semester = Counter(), Counter(), []
+    ratings = Counter()
+    activity = []
+    async for doc in db[STATS_COLLECTION].find(query):
+        key = doc["_id"]
+        if key["kind"] == "notes" and doc.get("count", 0) > 0:
+            by_subject[key["subject"]] += doc["count"]
+            by_semester[key["semester"]] += doc["count"]
+            by_subject_semester.append({"subject": key["subject"], "semester": key["semester"], "count": doc["count"]})
+        elif key["kind"] == "feedback" and doc.get("count", 0) > 0:
+            ratings[key["rating"]] += doc["count"]
+        elif key["kind"] == "activity":
+            activity.append({
+                "day": key["day"], "discussions": doc.get("discussions", 0), "replies": doc.get("replies", 0),
+            })
+
+    feedback_total = sum(ratings.values())
+    rating_sum = sum(rating * count for rating, count in ratings.items() if isinstance(rating, (int, float)))
+    return {
+        "notes": {
+            "total": sum(by_subject.values()),
+            "by_subject": dict(sorted(by_subject.items(), key=lambda item: str(item[0]))),
+            "by_semester": dict(sorted(by_semester.items(), key=lambda item: str(item[0]))),
+            "by_subject_semester": sorted(by_subject_semester, key=lambda row: (str(row["subject"]), str(row["semester"]))),
+        },
+        "feedback": {
+            "total": feedback_total,
+            "average_rating": round(rating_sum / feedback_total, 2) if feedback_total else None,
+            "distribution": {str(rating): count for rating, count in sorted(ratings.items(), key=lambda item: str(item[0]))},
+        },
+        "activity": sorted(activity, key=lambda row: row["day"]),
+    }
+
+
+async def _main(args):
+    from dotenv import load_dotenv
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    load_dotenv(Path(__file__).parent / '.env')
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'], tz_aware=True)
+    try:
+        db = client[os.environ['DB_NAME']]
+        if args.rebuild:
+            print(f"Rebuilt {await rebuild(db)} rollup documents")
+        else:
+            print(json.dumps(await read_stats(db, args.days), indent=2))
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Inspect or rebuild the stats rollups")
+    parser.add_argument("--rebuild", action="store_true", help="recompute every rollup from the source collections")
+    parser.add_argument("--days", type=int, default=30, help="days of activity to print")
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    asyncio.run(_main(parser.parse_args()))
@@ -0,0 +1,321 @@
+"""Repositories for notes, discussions, replies and feedback.
+
+Handlers reach the four data collections only through these. The
+engine is picked by STORAGE_ENGINE:
+
+    mongo    MongoStorage    Motor, the production default
+    memory   MemoryStorage   dicts in the API process (storage_memory.py)
+    sqlite   SQLiteStorage   one WAL-mode file at SQLITE_PATH (storage_sqlite.py)
+
+The memory and SQLite engines need no server at all, so the API, its
+benchmarks and small installs can run offline. They keep their data in
+one process: run a single worker with them. Everything else the API
+stores in MongoDB (stats rollups, the catalog change log, upload
+sessions, PDF processing, background purge, change streams) is only
+available with the mongo engine.
+
+Every engine implements the same methods, and
+tests/test_storage_conformance.py checks that they behave the same. Projections are Mongo-style include
+projections as built by fieldsets.resolve_projection; documents come
+back without `_id`. Lists are keyed by (sort field, id) and page with
+the cursors from pagination.py. Deleting a note or discussion hides it
+at once, along with a discussion's replies: MongoDB tombstones them for
+the Purger, the other engines remove them outright.
+
+    notes        insert, insert_batch, get, page, stream, by_subject, find_many, delete
+    discussions  insert, get, exists, page, stream, find_many, delete, thread,
+                 increment, refresh_hot_scores, decay_hot_scores
+    replies      insert, get, page, stream, find_many, delete, increment
+    feedback     insert, page, stream
+"""
+from datetime import datetime, timezone
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+from pymongo import InsertOne, UpdateOne
+from pymongo.errors import BulkWriteError
+
+from pagination import fetch_page, sort_spec
+from purge import LIVE, tombstone
+from ranking import HOT_WINDOW_DAYS, decay_hot_scores, refresh_hot_scores
+from streaming import STREAM_BATCH_SIZE
+from threads import fetch_thread, insert_reply, remove_reply
+
+# insert_batch outcomes; any other value is the error message for that document
+INSERTED = "inserted"
+DUPLICATE = "duplicate"
+
+Deltas = Dict[str, Dict[str, int]]
+
+
+def pick(doc: dict, projection: Optional[dict]) -> dict:
+    """Apply an include projection to a document held in Python"""
+    if not projection:
+        return dict(doc)
+    return {name: doc[name] for name, include in projection.items() if include and name != "_id" and name in doc}
+
+
+def bson_datetime(value: datetime) -> datetime:
+    """A datetime as MongoDB gives it back: UTC, millisecond precision"""
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    value = value.astimezone(timezone.utc)
+    return value.replace(microsecond=value.microsecond // 1000 * 1000)
+
+
+def _without_id(projection: Optional[dict]) -> dict:
+    return {**(projection or {}), "_id": 0}
+
+
+class Storage:
+    """The four repositories of one engine; storage[name] mirrors db[name]"""
+
+    engine = ""
+
+    def __getitem__(self, collection: str):
+        return getattr(self, collection)
+
+    async def open(self):
+        pass
+
+    async def close(self):
+        pass
+
+    async def check(self) -> dict:
+        return {"ready": True}
+
+
+# MongoDB
+
+class MongoNotesRepo:
+    def __init__(self, db, reader):
+        self.db = db
+        self.reader = reader
+
+    async def insert(self, note: dict):
+        # An explicit deleted_at: null puts the note in the live-only file_url_unique index
+        await self.db.notes.insert_one({**note, **LIVE})
+
+    async def insert_batch(self, notes: List[dict]) -> List[str]:
+        """Write notes in one unordered bulk_write, upserting the ones with a file_url on it"""
+        operations = [
+            UpdateOne({"file_url": doc["file_url"], **LIVE}, {"$setOnInsert": {**doc, **LIVE}}, upsert=True)
+            if doc.get("file_url") else InsertOne({**doc, **LIVE})
+            for doc in notes
+        ]
+        failed = {}
+        try:
+            result = await self.db.notes.bulk_write(operations, ordered=False)
+            upserted = set(result.upserted_ids)
+        except BulkWriteError as e:
+            upserted = {entry["index"] for entry in e.details.get("upserted", [])}
+            failed = {error["index"]: error for error in e.details.get("writeErrors", [])}
+
+        outcomes = []
+        for index, operation in enumerate(operations):
+            error = failed.get(index)
+            if error is not None:
+                # Two upserts racing on the same URL surface as a duplicate key
+                outcomes.append(DUPLICATE if error.get("code") == 11000 else error.get("errmsg", "write failed"))
+            elif isinstance(operation, UpdateOne) and index not in upserted:
+                outcomes.append(DUPLICATE)
+            else:
+                outcomes.append(INSERTED)
+        return outcomes
+
+    async def get(self, note_id: str, projection: Optional[dict] = None) -> Optional[dict]:
+        return await self.db.notes.find_one({"id": note_id, **LIVE}, _without_id(projection))
+
+    @staticmethod
+    def _filter(subject: Optional[str], semester: Optional[str]) -> dict:
+        filter_query = dict(LIVE)
+        if subject:
+            filter_query["subject"] = subject
+        if semester:
+            filter_query["semester"] = semester
+        return filter_query
+
+    async def page(self, limit: int, cursor: Optional[str] = None, projection: Optional[dict] = None,
+                   subject: Optional[str] = None, semester: Optional[str] = None):
+        return await fetch_page(
+            self.reader.notes, self._filter(subject, semester), "uploaded_at", limit, cursor,
+            projection=_without_id(projection),
+        )
+
+    def stream(self, projection: Optional[dict] = None, subject: Optional[str] = None,
+               semester: Optional[str] = None) -> AsyncIterator[dict]:
+        return self.reader.notes.find(self._filter(subject, semester), _without_id(projection)).sort(
+            sort_spec("uploaded_at")
+        ).batch_size(STREAM_BATCH_SIZE)
+
+    def by_subject(self, projection: Optional[dict] = None) -> AsyncIterator[dict]:
+        """Every note by subject, then semester, newest first within each"""
+        return self.db.notes.find(LIVE, _without_id(projection)).sort(
+            [("subject", 1), ("semester", 1), ("uploaded_at", -1), ("id", -1)]
+        )
+
+    async def find_many(self, ids: List[str], projection: Optional[dict] = None) -> List[dict]:
+        return await self.reader.notes.find({"id": {"$in": ids}, **LIVE}, _without_id(projection)).to_list(length=len(ids))
+
+    async def delete(self, note_id: str, projection: Optional[dict] = None) -> Optional[dict]:
+        """Delete a note; returns it as it was, or None if there was none"""
+        return await self.db.notes.find_one_and_update({"id": note_id, **LIVE}, tombstone(), _without_id(projection))
+
+
+class MongoDiscussionsRepo:
+    def __init__(self, db, reader):
+        self.db = db
+        self.reader = reader
+
+    async def insert(self, discussion: dict):
+        await self.db.discussions.insert_one(discussion)
+
+    async def get(self, discussion_id: str, projection: Optional[dict] = None) -> Optional[dict]:
+        return await self.db.discussions.find_one({"id": discussion_id, **LIVE}, _without_id(projection))
+
+    async def exists(self, discussion_id: str) -> bool:
+        return await self.db.discussions.find_one({"id": discussion_id, **LIVE}, {"_id": 1}) is not None
+
+    async def page(self, sort_field: str, limit: int, cursor: Optional[str] = None,
+                   projection: Optional[dict] = None):
+        return await fetch_page(self.reader.discussions, LIVE, sort_field, limit, cursor,
+                                projection=_without_id(projection))
+
+    def stream(self, sort_field: str = "created_at", projection: Optional[dict] = None) -> AsyncIterator[dict]:
+        return self.reader.discussions.find(LIVE, _without_id(projection)).sort(
+            sort_spec(sort_field)
+        ).batch_size(STREAM_BATCH_SIZE)
+
+    async def find_many(self, ids: List[str], projection: Optional[dict] = None) -> List[dict]:
+        return await self.reader.discussions.find(
+            {"id": {"$in": ids}, **LIVE}, _without_id(projection)
+        ).to_list(length=len(ids))
+
+    async def delete(self, discussion_id: str, projection: Optional[dict] = None) -> Optional[dict]:
+        """Tombstone a discussion and its replies; returns it as it was, or None if there was none"""
+        deleted = tombstone()
+        discussion = await self.db.discussions.find_one_and_update(
+            {"id": discussion_id, **LIVE}, deleted, _without_id(projection)
+        )
+        if discussion is not None:
+            # Replies inserted from here on fail the live-discussion check in insert_reply
+            await self.db.replies.update_many({"discussion_id": discussion_id, **LIVE}, deleted)
+        return discussion
+
+    async def thread(self, discussion_id: str, discussion_projection: dict, reply_projection: dict,
+                     limit: int) -> Tuple[Optional[dict], List[dict], Optional[str]]:
+        return await fetch_thread(
+            self.db, discussion_id, _without_id(discussion_projection), _without_id(reply_projection), limit
+        )
+
+    async def increment(self, deltas: Deltas):
+        await self.db.discussions.bulk_write(
+            [UpdateOne({"id": doc_id}, {"$inc": fields}) for doc_id, fields in deltas.items()], ordered=False
+        )
+
+    async def refresh_hot_scores(self, discussion_ids: List[str]):
+        await refresh_hot_scores(self.db, discussion_ids)
+
+    async def decay_hot_scores(self, window_days: int = HOT_WINDOW_DAYS) -> int:
+        return await decay_hot_scores(self.db, window_days)
+
+
+class MongoRepliesRepo:
+    def __init__(self, client, db, reader):
+        self.client = client
+        self.db = db
+        self.reader = reader
+
+    async def insert(self, reply: dict) -> bool:
+        """Insert a reply and bump its discussion's counter; False if the discussion is gone"""
+        return await insert_reply(self.client, self.db, reply)
+
+    async def get(self, reply_id: str, projection: Optional[dict] = None) -> Optional[dict]:
+        return await self.db.replies.find_one({"id": reply_id, **LIVE}, _without_id(projection))
+
+    async def page(self, discussion_id: str, limit: int, cursor: Optional[str] = None,
+                   projection: Optional[dict] = None):
+        """Replies oldest first"""
+        return await fetch_page(
+            self.db.replies, {"discussion_id": discussion_id, **LIVE}, "created_at", limit, cursor,
+            descending=False, projection=_without_id(projection),
+        )
+
+    def stream(self, projection: Optional[dict] = None) -> AsyncIterator[dict]:
+        """Every reply, in no particular order"""
+        return self.reader.replies.find(LIVE, _without_id(projection)).batch_size(STREAM_BATCH_SIZE)
+
+    async def find_many(self, ids: List[str], projection: Optional[dict] = None) -> List[dict]:
+        return await self.reader.replies.find(
+            {"id": {"$in": ids}, **LIVE}, _without_id(projection)
+        ).to_list(length=len(ids))
+
+    async def delete(self, reply_id: str) -> Optional[dict]:
+        """Delete a reply and decrement its discussion's counter; returns the deleted reply"""
+        reply = await remove_reply(self.client, self.db, reply_id)
+        if reply is not None:
+            reply.pop("_id", None)
+        return reply
+
+    async def increment(self, deltas: Deltas):
+        await self.db.replies.bulk_write(
+            [UpdateOne({"id": doc_id, **LIVE}, {"$inc": fields}) for doc_id, fields in deltas.items()], ordered=False
+        )
+
+
+class MongoFeedbackRepo:
+    def __init__(self, db, reader):
+        self.db = db
+        self.reader = reader
+
+    async def insert(self, feedback: dict):
+        await self.db.feedback.insert_one(feedback)
+
+    async def page(self, limit: int, cursor: Optional[str] = None, projection: Optional[dict] = None):
+        return await fetch_page(self.reader.feedback, {}, "created_at", limit, cursor,
+                                projection=_without_id(projection))
+
+    def stream(self, projection: Optional[dict] = None) -> AsyncIterator[dict]:
+        return self.reader.feedback.find({}, _without_id(projection)).sort(
+            sort_spec("created_at")
+        ).batch_size(STREAM_BATCH_SIZE)
+
+
+class MongoStorage(Storage):
+    """Repositories over a database.MongoConnection, bound once it is opened"""
+
+    engine = "mongo"
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.notes = self.discussions = self.replies = self.feedback = None
+
+    def bind(self, client, db, reader=None):
+        reader = reader if reader is not None else db
+        self.notes = MongoNotesRepo(db, reader)
+        self.discussions = MongoDiscussionsRepo(db, reader)
+        self.replies = MongoRepliesRepo(client, db, reader)
+        self.feedback = MongoFeedbackRepo(db, reader)
+        return self
+
+    async def open(self):
+        self.connection.open()
+        self.bind(self.connection.client, self.connection.db, self.connection.reader)
+
+    async def close(self):
+        self.connection.close()
+
+    async def check(self) -> dict:
+        return await self.connection.check()
+
+
+def storage_from_settings(settings, connection) -> Storage:
+    """The engine named by settings.storage_engine; connection is only used by mongo"""
+    if settings.storage_engine == "memory":
+        from storage_memory import MemoryStorage
+        return MemoryStorage()
+    if settings.storage_engine == "sqlite":
+        from storage_sqlite import SQLiteStorage
+        return SQLiteStorage(settings.sqlite_path)
+    if settings.storage_engine == "mongo":
+        return MongoStorage(connection)
+    raise ValueError(f"Unknown STORAGE_ENGINE {settings.storage_engine!r}; expected mongo, memory or sqlite")
@@ -0,0 +1,305 @@
+"""In-process storage engine (STORAGE_ENGINE=memory).
+
+Documents are dicts held by the API process and lost when it exits,
+which suits tests, benchmarks and demos. Each method runs without
+awaiting, so on one event loop it is atomic, transactions included.
+A list is served from a sorted (sort key, id) order cached per sort
+field and filter and dropped on the next write, so paging a list that
+is not changing is a bisect rather than a sort.
+
+Dates are stored as MongoDB would store them (UTC, milliseconds), so
+the same documents and cursors come back from every engine.
+"""
+import bisect
+from datetime import datetime, timedelta, timezone
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+from pymongo.errors import DuplicateKeyError
+
+from pagination import decode_cursor, encode_cursor
+from ranking import HOT_WINDOW_DAYS, hot_score
+from storage import DUPLICATE, INSERTED, Deltas, Storage, bson_datetime, pick
+
+
+def _sort_key(value, item_id: str) -> tuple:
+    # Missing values sort lowest, as null does in MongoDB
+    return (value is not None, value, item_id)
+
+
+def _stored(doc: dict) -> dict:
+    return {name: bson_datetime(value) if isinstance(value, datetime) else value for name, value in doc.items()}
+
+
+async def _aiter(docs: List[dict]) -> AsyncIterator[dict]:
+    for doc in docs:
+        yield doc
+
+
+class _Table:
+    """Documents by id, with the sorted orders that lists page through"""
+
+    def __init__(self, unique: Tuple[str, ...] = ()):
+        self.docs: Dict[str, dict] = {}
+        self.unique = {field: {} for field in unique}
+        self._orders: Dict[tuple, Tuple[List[tuple], List[str]]] = {}
+
+    def changed(self):
+        self._orders.clear()
+
+    def insert(self, doc: dict):
+        doc = _stored(doc)
+        if doc["id"] in self.docs:
+            raise DuplicateKeyError(f"E11000 duplicate key error: id {doc['id']!r}")
+        for field, owners in self.unique.items():
+            if isinstance(doc.get(field), str) and doc[field] in owners:
+                raise DuplicateKeyError(f"E11000 duplicate key error: {field} {doc[field]!r}")
+        for field, owners in self.unique.items():
+            if isinstance(doc.get(field), str):
+                owners[doc[field]] = doc["id"]
+        self.docs[doc["id"]] = doc
+        self.changed()
+
+    def remove(self, doc_id: str) -> Optional[dict]:
+        doc = self.docs.pop(doc_id, None)
+        if doc is not None:
+            for field, owners in self.unique.items():
+                if owners.get(doc.get(field)) == doc_id:
+                    del owners[doc[field]]
+            self.changed()
+        return doc
+
+    def order(self, sort_field: str, **match) -> Tuple[List[tuple], List[str]]:
+        """Ascending (sort key, id) order of the documents matching every field in match"""
+        cache_key = (sort_field, tuple(sorted(match.items())))
+        if cache_key not in self._orders:
+            rows = sorted(
+                (_sort_key(doc.get(sort_field), doc["id"]), doc["id"])
+                for doc in self.docs.values()
+                if all(doc.get(field) == value for field, value in match.items())
+            )
+            self._orders[cache_key] = ([key for key, _ in rows], [doc_id for _, doc_id in rows])
+        return self._orders[cache_key]
+
+    def ordered(self, sort_field: str, descending: bool = True, cursor: Optional[str] = None, **match):
+        """Documents in list order, resumed after the cursor position"""
+        keys, ids = self.order(sort_field, **match)
+        if cursor:
+            position = _sort_key(*decode_cursor(cursor, sort_field))
+            if descending:
+                ids = ids[:bisect.bisect_left(keys, position)]
+            else:
+                ids = ids[bisect.bisect_right(keys, position):]
+        return (self.docs[doc_id] for doc_id in (reversed(ids) if descending else ids))
+
+    def page(self, sort_field: str, limit: int, cursor: Optional[str], projection: Optional[dict],
+             descending: bool = True, **match):
+        docs = []
+        for doc in self.ordered(sort_field, descending, cursor, **match):
+            docs.append(doc)
+            if len(docs) > limit:
+                break
+        next_cursor = None
+        if len(docs) > limit:
+            docs = docs[:limit]
+            next_cursor = encode_cursor(sort_field, docs[-1][sort_field], docs[-1]["id"])
+        return [pick(doc, projection) for doc in docs], next_cursor
+
+    def increment(self, deltas: Deltas):
+        for doc_id, fields in deltas.items():
+            doc = self.docs.get(doc_id)
+            if doc is not None:
+                for field, delta in fields.items():
+                    doc[field] = doc.get(field, 0) + delta
+        self.changed()
+
+    def find_many(self, ids: List[str], projection: Optional[dict]) -> List[dict]:
+        return [pick(self.docs[doc_id], projection) for doc_id in dict.fromkeys(ids) if doc_id in self.docs]
+
+
+class MemoryNotesRepo:
+    def __init__(self, notes: _Table):
+        self._notes = notes
+
+    async def insert(self, note: dict):
+        self._notes.insert(note)
+
+    async def insert_batch(self, notes: List[dict]) -> List[str]:
+        outcomes = []
+        for doc in notes:
+            try:
+                self._notes.insert(doc)
+                outcomes.append(INSERTED)
+            except DuplicateKeyError:
+                outcomes.append(DUPLICATE)
+        return outcomes
+
+    async def get(self, note_id: str, projection: Optional[dict] = None) -> Optional[dict]:
+        doc = self._notes.docs.get(note_id)
+        return pick(doc, projection) if doc is not None else None
+
+    @staticmethod
+    def _match(subject: Optional[str], semester: Optional[str]) -> dict:
+        match = {}
+        if subject:
+            match["subject"] = subject
+        if semester:
+            match["semester"] = semester
+        return match
+
+    async def page(self, limit: int, cursor: Optional[str] = None, projection: Optional[dict] = None,
+                   subject: Optional[str] = None, semester: Optional[str] = None):
+        return self._notes.page("uploaded_at", limit, cursor, projection, **self._match(subject, semester))
+
+    def stream(self, projection: Optional[dict] = None, subject: Optional[str] = None,
+               semester: Optional[str] = None) -> AsyncIterator[dict]:
+        docs = self._notes.ordered("uploaded_at", **self._match(subject, semester))
+        return _aiter([pick(doc, projection) for doc in docs])
+
+    def by_subject(self, projection: Optional[dict] = None) -> AsyncIterator[dict]:
+        docs = sorted(self._notes.ordered("uploaded_at"),
+                      key=lambda doc: (_sort_key(doc.get("subject"), ""), _sort_key(doc.get("semester"), "")))
+        return _aiter([pick(doc, projection) for doc in docs])
+
+    async def find_many(self, ids: List[str], projection: Optional[dict] = None) -> List[dict]:
+        return self._notes.find_many(ids, projection)
+
+    async def delete(self, note_id: str, projection: Optional[dict] = None) -> Optional[dict]:
+        doc = self._notes.remove(note_id)
+        return pick(doc, projection) if doc is not None else None
+
+
+class MemoryDiscussionsRepo:
+    def __init__(self, discussions: _Table, replies: _Table):
+        self._discussions = discussions
+        self._replies = replies
+
+    async def insert(self, discussion: dict):
+        self._discussions.insert(discussion)
+
+    async def get(self, discussion_id: str, projection: Optional[dict] = None) -> Optional[dict]:
+        doc = self._discussions.docs.get(discussion_id)
+        return pick(doc, projection) if doc is not None else None
+
+    async def exists(self, discussion_id: str) -> bool:
+        return discussion_id in self._discussions.docs
+
+    async def page(self, sort_field: str, limit: int, cursor: Optional[str] = None,
+                   projection: Optional[dict] = None):
+        return self._discussions.page(sort_field, limit, cursor, projection)
+
+    def stream(self, sort_field: str = "created_at", projection: Optional[dict] = None) -> AsyncIterator[dict]:
+        return _aiter([pick(doc, projection) for doc in self._discussions.ordered(sort_field)])
+
+    async def find_many(self, ids: List[str], projection: Optional[dict] = None) -> List[dict]:
+        return self._discussions.find_many(ids, projection)
+
+    async def delete(self, discussion_id: str, projection: Optional[dict] = None) -> Optional[dict]:
+        doc = self._discussions.remove(discussion_id)
+        if doc is None:
+            return None
+        for reply_id in [r["id"] for r in self._replies.docs.values() if r["discussion_id"] == discussion_id]:
+            self._replies.remove(reply_id)
+        return pick(doc, projection)
+
+    async def thread(self, discussion_id: str, discussion_projection: dict, reply_projection: dict,
+                     limit: int) -> Tuple[Optional[dict], List[dict], Optional[str]]:
+        doc = self._discussions.docs.get(discussion_id)
+        if doc is None:
+            return None, [], None
+        replies, next_cursor = self._replies.page(
+            "created_at", limit, None, reply_projection, descending=False, discussion_id=discussion_id
+        )
+        return pick(doc, discussion_projection), replies, next_cursor
+
+    async def increment(self, deltas: Deltas):
+        self._discussions.increment(deltas)
+
+    async def refresh_hot_scores(self, discussion_ids: List[str]):
+        for discussion_id in discussion_ids:
+            doc = self._discussions.docs.get(discussion_id)
+            if doc is not None:
+                doc["hot_score"] = hot_score(doc.get("upvotes", 0), doc.get("replies", 0), doc["created_at"])
+        self._discussions.changed()
+
+    async def decay_hot_scores(self, window_days: int = HOT_WINDOW_DAYS) -> int:
+        now = datetime.now(timezone.utc)
+        cutoff = now - timedelta(days=window_days)
+        changed = 0
+        for doc in self._discussions.docs.values():
+            if doc["created_at"] >= cutoff:
+                score = hot_score(doc.get("upvotes", 0), doc.get("replies", 0), doc["created_at"], now)
+            else:
+                score = 0.0
+            if doc.get("hot_score") != score:
+                doc["hot_score"] = score
+                changed += 1
+        self._discussions.changed()
+        return changed
+
+
+class MemoryRepliesRepo:
+    def __init__(self, discussions: _Table, replies: _Table):
+        self._discussions = discussions
+        self._replies = replies
+
+    async def insert(self, reply: dict) -> bool:
+        discussion = self._discussions.docs.get(reply["discussion_id"])
+        if discussion is None:
+            return False
+        self._replies.insert(reply)
+        discussion["replies"] = discussion.get("replies", 0) + 1
+        self._discussions.changed()
+        return True
+
+    async def get(self, reply_id: str, projection: Optional[dict] = None) -> Optional[dict]:
+        doc = self._replies.docs.get(reply_id)
+        return pick(doc, projection) if doc is not None else None
+
+    async def page(self, discussion_id: str, limit: int, cursor: Optional[str] = None,
+                   projection: Optional[dict] = None):
+        return self._replies.page("created_at", limit, cursor, projection, descending=False,
+                                  discussion_id=discussion_id)
+
+    def stream(self, projection: Optional[dict] = None) -> AsyncIterator[dict]:
+        return _aiter([pick(doc, projection) for doc in self._replies.docs.values()])
+
+    async def find_many(self, ids: List[str], projection: Optional[dict] = None) -> List[dict]:
+        return self._replies.find_many(ids, projection)
+
+    async def delete(self, reply_id: str) -> Optional[dict]:
+        reply = self._replies.remove(reply_id)
+        if reply is None:
+            return None
+        discussion = self._discussions.docs.get(reply["discussion_id"])
+        if discussion is not None:
+            discussion["replies"] = discussion.get("replies", 0) - 1
+            self._discussions.changed()
+        return dict(reply)
+
+    async def increment(self, deltas: Deltas):
+        self._replies.increment(deltas)
+
+
+class MemoryFeedbackRepo:
+    def __init__(self, feedback: _Table):
+        self._feedback = feedback
+
+    async def insert(self, feedback: dict):
+        self._feedback.insert(feedback)
+
+    async def page(self, limit: int, cursor: Optional[str] = None, projection: Optional[dict] = None):
+        return self._feedback.page("created_at", limit, cursor, projection)
+
+    def stream(self, projection: Optional[dict] = None) -> AsyncIterator[dict]:
+        return _aiter([pick(doc, projection) for doc in self._feedback.ordered("created_at")])
+
+
+class MemoryStorage(Storage):
+    engine = "memory"
+
+    def __init__(self):
+        notes, discussions, replies, feedback = _Table(unique=("file_url",)), _Table(), _Table(), _Table()
+        self.notes = MemoryNotesRepo(notes)
+        self.discussions = MemoryDiscussionsRepo(discussions, replies)
+        self.replies = MemoryRepliesRepo(discussions, replies)
+        self.feedback = MemoryFeedbackRepo(feedback)
@@ -0,0 +1,462 @@
+"""SQLite storage engine (STORAGE_ENGINE=sqlite).
+
+One database file at SQLITE_PATH in WAL mode, so reads never wait for
+the writer. Each document is kept as JSON; the fields lists filter and
+sort on are copied into indexed columns, and the counters (upvotes,
+replies, hot_score) live only in their columns so an increment is an
+UPDATE of one row. Lists are keyset scans of a (sort field, id) index,
+like their MongoDB counterparts.
+
+sqlite3 blocks, so the connection is used from one dedicated thread;
+calls queue up there in order and the event loop never waits on disk.
+Dates are stored as UTC ISO-8601 text with milliseconds, which sorts
+chronologically and matches what MongoDB returns.
+"""
+import asyncio
+import json
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from typing import AsyncIterator, Callable, List, Optional, Tuple
+
+from pymongo.errors import DuplicateKeyError
+
+from pagination import decode_cursor, encode_cursor
+from ranking import HOT_WINDOW_DAYS, hot_score
+from storage import DUPLICATE, INSERTED, Deltas, Storage, bson_datetime, pick
+from streaming import STREAM_BATCH_SIZE
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS notes (
+    id TEXT PRIMARY KEY,
+    subject TEXT,
+    semester TEXT,
+    uploaded_at TEXT,
+    file_url TEXT,
+    doc TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS notes_recent ON notes (uploaded_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS notes_subject_semester_recent ON notes (subject, semester, uploaded_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS notes_semester_recent ON notes (semester, uploaded_at DESC, id DESC);
+CREATE UNIQUE INDEX IF NOT EXISTS notes_file_url ON notes (file_url) WHERE file_url IS NOT NULL;
+
+CREATE TABLE IF NOT EXISTS discussions (
+    id TEXT PRIMARY KEY,
+    created_at TEXT,
+    upvotes INTEGER NOT NULL DEFAULT 0,
+    replies INTEGER NOT NULL DEFAULT 0,
+    hot_score REAL NOT NULL DEFAULT 0,
+    doc TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS discussions_recent ON discussions (created_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS discussions_hot ON discussions (hot_score DESC, id DESC);
+CREATE INDEX IF NOT EXISTS discussions_top ON discussions (upvotes DESC, id DESC);
+CREATE INDEX IF NOT EXISTS discussions_active ON discussions (replies DESC, id DESC);
+
+CREATE TABLE IF NOT EXISTS replies (
+    id TEXT PRIMARY KEY,
+    discussion_id TEXT NOT NULL,
+    created_at TEXT,
+    upvotes INTEGER NOT NULL DEFAULT 0,
+    doc TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS replies_discussion_created ON replies (discussion_id, created_at, id);
+
+CREATE TABLE IF NOT EXISTS feedback (
+    id TEXT PRIMARY KEY,
+    created_at TEXT,
+    doc TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS feedback_recent ON feedback (created_at DESC, id DESC);
+"""
+
+# Indexed copies of document fields, and counters that are kept only in their column
+COLUMNS = {
+    "notes": ("subject", "semester", "uploaded_at", "file_url"),
+    "discussions": ("created_at",),
+    "replies": ("discussion_id", "created_at"),
+    "feedback": ("created_at",),
+}
+COUNTERS = {
+    "notes": (),
+    "discussions": ("upvotes", "replies", "hot_score"),
+    "replies": ("upvotes",),
+    "feedback": (),
+}
+
+
+def _column_value(value):
+    if isinstance(value, datetime):
+        return bson_datetime(value).isoformat(timespec="milliseconds")
+    return value
+
+
+def _encode(value):
+    if isinstance(value, datetime):
+        return {"$date": _column_value(value)}
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+def _decode(obj: dict):
+    if len(obj) == 1 and "$date" in obj:
+        return datetime.fromisoformat(obj["$date"])
+    return obj
+
+
+def _hot_score(upvotes: int, replies: int, created_at: str) -> float:
+    return hot_score(upvotes, replies, datetime.fromisoformat(created_at))
+
+
+class _Database:
+    """The connection and the thread it is used from"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.connection: Optional[sqlite3.Connection] = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite")
+
+    def _connect(self):
+        connection = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        connection.row_factory = sqlite3.Row
+        connection.execute("PRAGMA journal_mode=WAL")
+        # WAL keeps committed writes safe from an application crash without an fsync per commit
+        connection.execute("PRAGMA synchronous=NORMAL")
+        connection.execute("PRAGMA busy_timeout=5000")
+        connection.create_function("hot_score", 3, _hot_score)
+        connection.executescript(SCHEMA)
+        self.connection = connection
+
+    async def open(self):
+        if self.connection is None:
+            await self.run(self._connect)
+
+    async def close(self):
+        if self.connection is not None:
+            await self.run(self.connection.close)
+            self.connection = None
+        self._executor.shutdown(wait=False)
+
+    async def run(self, fn: Callable, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+    async def write(self, fn: Callable, *args):
+        """Run fn(connection, *args) in one transaction"""
+        def transaction():
+            self.connection.execute("BEGIN IMMEDIATE")
+            try:
+                result = fn(self.connection, *args)
+            except BaseException:
+                self.connection.execute("ROLLBACK")
+                raise
+            self.connection.execute("COMMIT")
+            return result
+        return await self.run(transaction)
+
+    async def read(self, sql: str, params: tuple = ()) -> List[sqlite3.Row]:
+        return await self.run(lambda: self.connection.execute(sql, params).fetchall())
+
+
+class _Table:
+    """SQL for one collection, shared by the repositories that touch it"""
+
+    def __init__(self, database: _Database, name: str):
+        self.database = database
+        self.name = name
+        self.columns = COLUMNS[name]
+        self.counters = COUNTERS[name]
+        self.select = f"SELECT {', '.join(('doc',) + self.counters)} FROM {name}"
+
+    def to_doc(self, row: sqlite3.Row, projection: Optional[dict] = None) -> dict:
+        doc = json.loads(row["doc"], object_hook=_decode)
+        for counter in self.counters:
+            doc[counter] = row[counter]
+        return pick(doc, projection)
+
+    def insert(self, connection: sqlite3.Connection, doc: dict, ignore: bool = False) -> bool:
+        stored = {name: value for name, value in doc.items() if name not in self.counters}
+        names = ("id",) + self.columns + self.counters + ("doc",)
+        values = (
+            [doc["id"]]
+            + [_column_value(doc.get(column)) for column in self.columns]
+            + [doc.get(counter) or 0 for counter in self.counters]
+            + [json.dumps(stored, default=_encode, ensure_ascii=False)]
+        )
+        verb = "INSERT OR IGNORE" if ignore else "INSERT"
+        try:
+            cursor = connection.execute(
+                f"{verb} INTO {self.name} ({', '.join(names)}) VALUES ({', '.join('?' * len(names))})", values
+            )
+        except sqlite3.IntegrityError as e:
+            raise DuplicateKeyError(f"E11000 duplicate key error: {e}") from None
+        return cursor.rowcount == 1
+
+    async def get(self, doc_id: str, projection: Optional[dict]) -> Optional[dict]:
+        rows = await self.database.read(f"{self.select} WHERE id = ?", (doc_id,))
+        return self.to_doc(rows[0], projection) if rows else None
+
+    async def page(self, sort_field: str, limit: int, cursor: Optional[str], projection: Optional[dict],
+                   descending: bool = True, **match) -> Tuple[List[dict], Optional[str]]:
+        conditions = [f"{field} = ?" for field in match]
+        params = list(match.values())
+        if cursor:
+            sort_value, item_id = decode_cursor(cursor, sort_field)
+            conditions.append(f"({sort_field}, id) {'<' if descending else '>'} (?, ?)")
+            params += [_column_value(sort_value), item_id]
+        direction = "DESC" if descending else "ASC"
+        where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+        rows = await self.database.read(
+            f"{self.select}{where} ORDER BY {sort_field} {direction}, id {direction} LIMIT ?",
+            tuple(params) + (limit + 1,),
+        )
+        docs = [self.to_doc(row) for row in rows]
+        next_cursor = None
+        if len(docs) > limit:
+            docs = docs[:limit]
+            next_cursor = encode_cursor(sort_field, docs[-1][sort_field], docs[-1]["id"])
+        return [pick(doc, projection) for doc in docs], next_cursor
+
+    async def stream(self, sort_field: str, projection: Optional[dict], **match) -> AsyncIterator[dict]:
+        cursor = None
+        while True:
+            docs, cursor = await self.page(sort_field, STREAM_BATCH_SIZE, cursor, projection and {
+                **projection, sort_field: 1, "id": 1,
+            }, **match)
+            for doc in docs:
+                yield pick(doc, projection)
+            if cursor is None:
+                return
+
+    async def find_many(self, ids: List[str], projection: Optional[dict]) -> List[dict]:
+        if not ids:
+            return []
+        rows = await self.database.read(f"{self.select} WHERE id IN ({', '.join('?' * len(ids))})", tuple(ids))
+        return [self.to_doc(row, projection) for row in rows]
+
+    def remove(self, connection: sqlite3.Connection, doc_id: str) -> Optional[dict]:
+        row = connection.execute(f"{self.select} WHERE id = ?", (doc_id,)).fetchone()
+        if row is None:
+            return None
+        connection.execute(f"DELETE FROM {self.name} WHERE id = ?", (doc_id,))
+        return self.to_doc(row)
+
+    async def increment(self, deltas: Deltas):
+        def apply(connection):
+            for doc_id, fields in deltas.items():
+                assignments = ", ".join(f"{field} = {field} + ?" for field in fields if field in self.counters)
+                if assignments:
+                    connection.execute(
+                        f"UPDATE {self.name} SET {assignments} WHERE id = ?",
+                        [delta for field, delta in fields.items() if field in self.counters] + [doc_id],
+                    )
+        await self.database.write(apply)
+
+
+class SQLiteNotesRepo:
+    def __init__(self, notes: _Table):
+        self._notes = notes
+
+    async def insert(self, note: dict):
+        await self._notes.database.write(self._notes.insert, note)
+
+    async def insert_batch(self, notes: List[dict]) -> List[str]:
+        def insert_all(connection):
+            return [INSERTED if self._notes.insert(connection, doc, ignore=True) else DUPLICATE for doc in notes]
+        return await self._notes.database.write(insert_all)
+
+    async def get(self, note_id: str, projection: Optional[dict] = None) -> Optional[dict]:
+        return await self._notes.get(note_id, projection)
+
+    @staticmethod
+    def _match(subject: Optional[str], semester: Optional[str]) -> dict:
+        match = {}
+        if subject:
+            match["subject"] = subject
+        if semester:
+            match["semester"] = semester
+        return match
+
+    async def page(self, limit: int, cursor: Optional[str] = None, projection: Optional[dict] = None,
+                   subject: Optional[str] = None, semester: Optional[str] = None):
+        return await self._notes.page("uploaded_at", limit, cursor, projection, **self._match(subject, semester))
+
+    def stream(self, projection: Optional[dict] = None, subject: Optional[str] = None,
+               semester: Optional[str] = None) -> AsyncIterator[dict]:
+        return self._notes.stream("uploaded_at", projection, **self._match(subject, semester))
+
+    async def by_subject(self, projection: Optional[dict] = None) -> AsyncIterator[dict]:
+        rows = await self._notes.database.read(
+            f"{self._notes.select} ORDER BY subject, semester, uploaded_at DESC, id DESC"
+        )
+        for row in rows:
+            yield self._notes.to_doc(row, projection)
+
+    async def find_many(self, ids: List[str], projection: Optional[dict] = None) -> List[dict]:
+        return await self._notes.find_many(ids, projection)
+
+    async def delete(self, note_id: str, projection: Optional[dict] = None) -> Optional[dict]:
+        doc = await self._notes.database.write(self._notes.remove, note_id)
+        return pick(doc, projection) if doc is not None else None
+
+
+class SQLiteDiscussionsRepo:
+    def __init__(self, discussions: _Table, replies: _Table):
+        self._discussions = discussions
+        self._replies = replies
+
+    async def insert(self, discussion: dict):
+        await self._discussions.database.write(self._discussions.insert, discussion)
+
+    async def get(self, discussion_id: str, projection: Optional[dict] = None) -> Optional[dict]:
+        return await self._discussions.get(discussion_id, projection)
+
+    async def exists(self, discussion_id: str) -> bool:
+        rows = await self._discussions.database.read("SELECT 1 FROM discussions WHERE id = ?", (discussion_id,))
+        return bool(rows)
+
+    async def page(self, sort_field: str, limit: int, cursor: Optional[str] = None,
+                   projection: Optional[dict] = None):
+        return await self._discussions.page(sort_field, limit, cursor, projection)
+
+    def stream(self, sort_field: str = "created_at", projection: Optional[dict] = None) -> AsyncIterator[dict]:
+        return self._discussions.stream(sort_field, projection)
+
+    async def find_many(self, ids: List[str], projection: Optional[dict] = None) -> List[dict]:
+        return await self._discussions.find_many(ids, projection)
+
+    async def delete(self, discussion_id: str, projection: Optional[dict] = None) -> Optional[dict]:
+        def remove(connection):
+            doc = self._discussions.remove(connection, discussion_id)
+            if doc is not None:
+                connection.execute("DELETE FROM replies WHERE discussion_id = ?", (discussion_id,))
+            return doc
+        doc = await self._discussions.database.write(remove)
+        return pick(doc, projection) if doc is not None else None
+
+    async def thread(self, discussion_id: str, discussion_projection: dict, reply_projection: dict,
+                     limit: int) -> Tuple[Optional[dict], List[dict], Optional[str]]:
+        discussion = await self._discussions.get(discussion_id, discussion_projection)
+        if discussion is None:
+            return None, [], None
+        replies, next_cursor = await self._replies.page(
+            "created_at", limit, None, reply_projection, descending=False, discussion_id=discussion_id
+        )
+        return discussion, replies, next_cursor
+
+    async def increment(self, deltas: Deltas):
+        await self._discussions.increment(deltas)
+
+    async def refresh_hot_scores(self, discussion_ids: List[str]):
+        if not discussion_ids:
+            return
+        def refresh(connection):
+            connection.execute(
+                "UPDATE discussions SET hot_score = hot_score(upvotes, replies, created_at)"
+                f" WHERE id IN ({', '.join('?' * len(discussion_ids))})",
+                tuple(discussion_ids),
+            )
+        await self._discussions.database.write(refresh)
+
+    async def decay_hot_scores(self, window_days: int = HOT_WINDOW_DAYS) -> int:
+        cutoff = _column_value(datetime.now(timezone.utc) - timedelta(days=window_days))
+        def decay(connection):
+            recent = connection.execute(
+                "UPDATE discussions SET hot_score = hot_score(upvotes, replies, created_at) WHERE created_at >= ?",
+                (cutoff,),
+            )
+            aged = connection.execute(
+                "UPDATE discussions SET hot_score = 0 WHERE hot_score > 0 AND created_at < ?", (cutoff,)
+            )
+            return recent.rowcount + aged.rowcount
+        return await self._discussions.database.write(decay)
+
+
+class SQLiteRepliesRepo:
+    def __init__(self, replies: _Table):
+        self._replies = replies
+
+    async def insert(self, reply: dict) -> bool:
+        def insert(connection):
+            bumped = connection.execute(
+                "UPDATE discussions SET replies = replies + 1 WHERE id = ?", (reply["discussion_id"],)
+            )
+            if bumped.rowcount == 0:
+                return False
+            self._replies.insert(connection, reply)
+            return True
+        return await self._replies.database.write(insert)
+
+    async def get(self, reply_id: str, projection: Optional[dict] = None) -> Optional[dict]:
+        return await self._replies.get(reply_id, projection)
+
+    async def page(self, discussion_id: str, limit: int, cursor: Optional[str] = None,
+                   projection: Optional[dict] = None):
+        return await self._replies.page("created_at", limit, cursor, projection, descending=False,
+                                        discussion_id=discussion_id)
+
+    async def stream(self, projection: Optional[dict] = None) -> AsyncIterator[dict]:
+        last = 0
+        while True:
+            rows = await self._replies.database.read(
+                "SELECT rowid, doc, upvotes FROM replies WHERE rowid > ? ORDER BY rowid LIMIT ?",
+                (last, STREAM_BATCH_SIZE),
+            )
+            for row in rows:
+                yield self._replies.to_doc(row, projection)
+            if len(rows) < STREAM_BATCH_SIZE:
+                return
+            last = rows[-1]["rowid"]
+
+    async def find_many(self, ids: List[str], projection: Optional[dict] = None) -> List[dict]:
+        return await self._replies.find_many(ids, projection)
+
+    async def delete(self, reply_id: str) -> Optional[dict]:
+        def remove(connection):
+            reply = self._replies.remove(connection, reply_id)
+            if reply is not None:
+                connection.execute(
+                    "UPDATE discussions SET replies = replies - 1 WHERE id = ?", (reply["discussion_id"],)
+                )
+            return reply
+        return await self._replies.database.write(remove)
+
+    async def increment(self, deltas: Deltas):
+        await self._replies.increment(deltas)
+
+
+class SQLiteFeedbackRepo:
+    def __init__(self, feedback: _Table):
+        self._feedback = feedback
+
+    async def insert(self, feedback: dict):
+        await self._feedback.database.write(self._feedback.insert, feedback)
+
+    async def page(self, limit: int, cursor: Optional[str] = None, projection: Optional[dict] = None):
+        return await self._feedback.page("created_at", limit, cursor, projection)
+
+    def stream(self, projection: Optional[dict] = None) -> AsyncIterator[dict]:
+        return self._feedback.stream("created_at", projection)
+
+
+class SQLiteStorage(Storage):
+    engine = "sqlite"
+
+    def __init__(self, path: str):
+        self.database = _Database(path)
+        tables = {name: _Table(self.database, name) for name in COLUMNS}
+        self.notes = SQLiteNotesRepo(tables["notes"])
+        self.discussions = SQLiteDiscussionsRepo(tables["discussions"], tables["replies"])
+        self.replies = SQLiteRepliesRepo(tables["replies"])
+        self.feedback = SQLiteFeedbackRepo(tables["feedback"])
+
+    async def open(self):
+        await self.database.open()
+
+    async def close(self):
+        await self.database.close()
+
+    async def check(self) -> dict:
+        try:
+            await self.database.read("SELECT 1")
+            return {"ready": True}
+        except Exception as e:
+            return {"ready": False, "reason": f"SQLite unavailable: {e}"}
@@ -0,0 +1,32 @@
+"""NDJSON export for list endpoints.
+
+Clients opt in with `Accept: application/x-ndjson` or `?stream=1`. A
+repository stream (a Motor cursor for MongoDB) is drained in batches of
+STREAM_BATCH_SIZE and every document is serialized and written as soon
+as it arrives, so memory stays flat however large the collection is.
+"""
+import os
+from typing import AsyncIterable, Callable, Optional
+
+from fastapi import Request
+from fastapi.responses import StreamingResponse
+
+from serialization import dumps
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+STREAM_BATCH_SIZE = int(os.environ.get('STREAM_BATCH_SIZE', '500'))
+
+
+def wants_ndjson(request: Request, stream: bool = False) -> bool:
+    return stream or NDJSON_MEDIA_TYPE in request.headers.get("accept", "")
+
+
+def ndjson_response(docs: AsyncIterable[dict], transform: Optional[Callable[[dict], dict]] = None):
+    """Stream documents as one JSON document per line"""
+    async def lines():
+        async for doc in docs:
+            if transform is not None:
+                doc = transform(doc)
+            yield dumps(doc) + b"\n"
+
+    return StreamingResponse(lines(), media_type=NDJSON_MEDIA_TYPE)
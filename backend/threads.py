@@ -0,0 +1,111 @@
+"""Thread reads and reply writes with the fewest round-trips.
+
+A thread (discussion + first page of replies) is one aggregation with a
+bounded $lookup. Creating or deleting a reply adjusts the parent's
+counter in the same transaction when the deployment supports one
+(replica set or sharded cluster). Replies to a busy thread all $inc the
+same discussion, so transactions run through with_transaction(), which
+retries on WriteConflict and other transient errors. On a standalone
+server the counter update doubles as the existence check, and a failed
+insert is compensated.
+"""
+import logging
+from typing import Optional
+
+from pagination import encode_cursor
+from purge import LIVE
+
+logger = logging.getLogger(__name__)
+
+_transactions_supported: Optional[bool] = None
+
+
+async def detect_transactions(client) -> bool:
+    """Probe once whether multi-document transactions are available"""
+    global _transactions_supported
+    try:
+        hello = await client.admin.command("hello")
+        _transactions_supported = bool(hello.get("setName") or hello.get("msg") == "isdbgrid")
+    except Exception:
+        _transactions_supported = False
+    logger.info("Reply writes %s transactions", "use" if _transactions_supported else "do not use")
+    return _transactions_supported
+
+
+async def fetch_thread(db, discussion_id: str, discussion_fields: dict, reply_fields: dict, limit: int):
+    """Discussion with its first `limit` replies; returns (discussion, replies, next_cursor)"""
+    pipeline = [
+        {"$match": {"id": discussion_id, **LIVE}},
+        {"$limit": 1},
+        {"$lookup": {
+            "from": "replies",
+            "localField": "id",
+            "foreignField": "discussion_id",
+            "pipeline": [
+                {"$sort": {"created_at": 1, "id": 1}},
+                {"$limit": limit + 1},
+                {"$project": reply_fields},
+            ],
+            "as": "_replies",
+        }},
+        {"$project": {**discussion_fields, "_replies": 1}},
+    ]
+    docs = await db.discussions.aggregate(pipeline).to_list(length=1)
+    if not docs:
+        return None, [], None
+    discussion = docs[0]
+    replies = discussion.pop("_replies")
+    next_cursor = None
+    if len(replies) > limit:
+        replies = replies[:limit]
+        next_cursor = encode_cursor("created_at", replies[-1]["created_at"], replies[-1]["id"])
+    return discussion, replies, next_cursor
+
+
+async def insert_reply(client, db, reply_dict: dict) -> bool:
+    """Insert a reply and bump its discussion's counter; False if the discussion is gone"""
+    discussion_id = reply_dict["discussion_id"]
+    if _transactions_supported:
+        async def insert(session) -> bool:
+            result = await db.discussions.update_one(
+                {"id": discussion_id, **LIVE}, {"$inc": {"replies": 1}}, session=session
+            )
+            if result.matched_count == 0:
+                # Nothing was written, so committing the empty transaction is the abort
+                return False
+            # The reply's id is fixed before the first attempt, so a retry cannot insert it twice
+            await db.replies.insert_one(dict(reply_dict), session=session)
+            return True
+
+        async with await client.start_session() as session:
+            return await session.with_transaction(insert)
+
+    result = await db.discussions.update_one({"id": discussion_id, **LIVE}, {"$inc": {"replies": 1}})
+    if result.matched_count == 0:
+        return False
+    try:
+        await db.replies.insert_one(reply_dict)
+    except Exception:
+        await db.discussions.update_one({"id": discussion_id}, {"$inc": {"replies": -1}})
+        raise
+    return True
+
+
+async def remove_reply(client, db, reply_id: str) -> Optional[dict]:
+    """Delete a reply and decrement its discussion's counter; returns the deleted reply"""
+    if _transactions_supported:
+        async def remove(session) -> Optional[dict]:
+            reply = await db.replies.find_one_and_delete({"id": reply_id, **LIVE}, session=session)
+            if reply is not None:
+                await db.discussions.update_one(
+                    {"id": reply["discussion_id"]}, {"$inc": {"replies": -1}}, session=session
+                )
+            return reply
+
+        async with await client.start_session() as session:
+            return await session.with_transaction(remove)
+
+    reply = await db.replies.find_one_and_delete({"id": reply_id, **LIVE})
+    if reply is not None:
+        await db.discussions.update_one({"id": reply["discussion_id"]}, {"$inc": {"replies": -1}})
+    return reply
@@ -0,0 +1,300 @@
+"""Chunked, resumable uploads of note PDFs into the blob store.
+
+    POST /api/uploads                  {"size": 52428800, "sha256": "..."?}
+    PUT  /api/uploads/{id}             one chunk; Content-Range: bytes 0-8388607/52428800
+    GET  /api/uploads/{id}             the offset to resume from
+    POST /api/uploads/{id}/complete    {"title", "subject", "semester"} -> the new Note
+
+Each chunk is streamed to a staging file at its offset, and the
+session's `offset` only advances once the whole chunk is on disk, so a
+dropped connection loses at most the chunk in flight: the client reads
+the offset back and sends the rest. A chunk that does not start at the
+offset gets 409 with the offset in `Upload-Offset`; re-sending one that
+was already received is a no-op.
+
+Completion hashes the staged file and moves it into the blob store under
+its SHA-256, where an identical PDF that is already stored is reused and
+the staged copy dropped. A client that declares sha256 up front skips
+the transfer entirely when that blob exists: the session starts out
+"stored" and only needs completing. The note records the stored size in
+size_bytes, with `size` as its human-readable form.
+
+Sessions live in the `uploads` collection, TTL-indexed on expires_at,
+and expire UPLOAD_SESSION_TTL_HOURS after their last chunk; their
+staging files are swept soon after. With several workers
+UPLOAD_STAGING_DIR must be shared, since a session's chunks may reach
+any of them.
+"""
+import asyncio
+import hashlib
+import logging
+import os
+import re
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import AsyncIterator, Awaitable, Callable, Optional, Tuple
+
+from fastapi import HTTPException
+from pydantic import BaseModel, Field
+from pymongo import ReturnDocument
+
+from metrics import UPLOADS_COMPLETED
+
+logger = logging.getLogger(__name__)
+
+SESSIONS_COLLECTION = "uploads"
+PDF_MAGIC = b"%PDF-"
+# How long a completion may run before another request may take it over
+COMPLETION_LEASE = timedelta(minutes=5)
+SWEEP_INTERVAL = 3600
+WRITE_BUFFER_BYTES = 1024 * 1024
+
+_CONTENT_RANGE = re.compile(r"^bytes (\d+)-(\d+)/(\d+)$")
+
+
+class UploadCreate(BaseModel):
+    size: int = Field(gt=0)
+    sha256: Optional[str] = Field(None, pattern=r"^[0-9a-f]{64}$")
+
+
+def human_size(size: int) -> str:
+    """1536 -> '1.5 KB', as the `size` of notes has always been shown"""
+    value = float(size)
+    for unit in ("B", "KB", "MB", "GB"):
+        if value < 1024 or unit == "GB":
+            return f"{value:.0f} {unit}" if unit == "B" else f"{value:.1f} {unit}"
+        value /= 1024
+
+
+def parse_content_range(header: Optional[str]) -> Tuple[int, int, int]:
+    match = _CONTENT_RANGE.match((header or "").strip())
+    if not match:
+        raise HTTPException(status_code=400, detail="Chunks need a 'Content-Range: bytes first-last/total' header")
+    start, end, total = (int(group) for group in match.groups())
+    if start > end or end >= total:
+        raise HTTPException(status_code=400, detail="Content-Range is out of order or past the total size")
+    return start, end, total
+
+
+def _hash_file(path: Path, size: int) -> Tuple[str, bytes]:
+    """(sha256, first bytes) of the staged file, trimmed to the declared size first"""
+    os.truncate(path, size)
+    digest = hashlib.sha256()
+    with open(path, "rb") as staged:
+        head = staged.read(len(PDF_MAGIC))
+        digest.update(head)
+        while chunk := staged.read(1024 * 1024):
+            digest.update(chunk)
+    return digest.hexdigest(), head
+
+
+def _conflict(detail: str, offset: int) -> HTTPException:
+    return HTTPException(status_code=409, detail=detail, headers={"Upload-Offset": str(offset)})
+
+
+class UploadManager:
+    def __init__(self, blobs, staging_dir: Path, max_bytes: int = 100 * 1024 * 1024,
+                 chunk_bytes: int = 8 * 1024 * 1024, session_ttl: timedelta = timedelta(hours=24)):
+        self.blobs = blobs
+        self.staging_dir = Path(staging_dir)
+        self.max_bytes = max_bytes
+        self.chunk_bytes = chunk_bytes
+        self.session_ttl = session_ttl
+        self._last_sweep = 0.0
+
+    def _staged(self, upload_id: str) -> Path:
+        return self.staging_dir / f"{upload_id}.part"
+
+    def view(self, session: dict) -> dict:
+        return {
+            "id": session["_id"],
+            "state": session["state"],
+            "size": session["size"],
+            "offset": session["offset"],
+            "chunk_size": self.chunk_bytes,
+            "note_id": session.get("note_id"),
+            "expires_at": session["expires_at"],
+        }
+
+    def sweep(self):
+        """Remove staging files whose session has expired; runs at most once per SWEEP_INTERVAL"""
+        if time.monotonic() - self._last_sweep < SWEEP_INTERVAL:
+            return
+        self._last_sweep = time.monotonic()
+        cutoff = time.time() - self.session_ttl.total_seconds()
+        try:
+            with os.scandir(self.staging_dir) as entries:
+                for entry in entries:
+                    if entry.name.endswith(".part") and entry.stat().st_mtime < cutoff:
+                        os.unlink(entry.path)
+        except FileNotFoundError:
+            pass
+
+    async def create(self, db, spec: UploadCreate) -> dict:
+        if spec.size > self.max_bytes:
+            raise HTTPException(status_code=413, detail=f"Uploads are limited to {self.max_bytes} bytes")
+        self.sweep()
+        now = datetime.now(timezone.utc)
+        session = {
+            "_id": str(uuid.uuid4()), "state": "open", "size": spec.size, "offset": 0,
+            "declared_sha256": spec.sha256, "created_at": now, "expires_at": now + self.session_ttl,
+        }
+        if spec.sha256:
+            stored_size = await self.blobs.size(spec.sha256)
+            if stored_size is not None:
+                # Already stored: nothing to send, completion just creates the note
+                session.update(state="stored", digest=spec.sha256, size=stored_size, offset=stored_size)
+        await db[SESSIONS_COLLECTION].insert_one(session)
+        return self.view(session)
+
+    async def status(self, db, upload_id: str) -> dict:
+        session = await db[SESSIONS_COLLECTION].find_one({"_id": upload_id})
+        if session is None:
+            raise HTTPException(status_code=404, detail="Upload not found")
+        return self.view(session)
+
+    async def write_chunk(self, db, upload_id: str, content_range: Optional[str],
+                          body: AsyncIterator[bytes]) -> dict:
+        """Stream one chunk to the staging file and advance the session offset past it"""
+        start, end, total = parse_content_range(content_range)
+        if end - start + 1 > self.chunk_bytes:
+            raise HTTPException(status_code=413, detail=f"Chunks are limited to {self.chunk_bytes} bytes")
+        session = await db[SESSIONS_COLLECTION].find_one({"_id": upload_id})
+        if session is None:
+            raise HTTPException(status_code=404, detail="Upload not found")
+        if total != session["size"]:
+            raise HTTPException(status_code=400, detail="Content-Range total does not match the upload size")
+        if end < session["offset"]:
+            # A retry of a chunk whose response was lost
+            return self.view(session)
+        if session["state"] != "open":
+            raise _conflict("Upload is no longer accepting chunks", session["offset"])
+        if start != session["offset"]:
+            raise _conflict("Chunk does not start at the upload offset", session["offset"])
+
+        expected = end - start + 1
+        received = 0
+        self.staging_dir.mkdir(parents=True, exist_ok=True)
+        fd = os.open(self._staged(upload_id), os.O_WRONLY | os.O_CREAT, 0o600)
+        try:
+            buffer = bytearray()
+            async for data in body:
+                received += len(data)
+                if received > expected:
+                    raise HTTPException(status_code=400, detail="Chunk body is longer than its Content-Range")
+                buffer += data
+                if len(buffer) >= WRITE_BUFFER_BYTES:
+                    await asyncio.to_thread(os.pwrite, fd, bytes(buffer), start + received - len(buffer))
+                    buffer.clear()
+            if received != expected:
+                raise HTTPException(status_code=400, detail="Chunk body is shorter than its Content-Range")
+            await asyncio.to_thread(os.pwrite, fd, bytes(buffer), start + received - len(buffer))
+            # The offset promises these bytes survive a crash
+            await asyncio.to_thread(os.fsync, fd)
+        finally:
+            os.close(fd)
+
+        session = await db[SESSIONS_COLLECTION].find_one_and_update(
+            {"_id": upload_id, "state": "open", "offset": start},
+            {"$set": {"offset": end + 1, "expires_at": datetime.now(timezone.utc) + self.session_ttl}},
+            return_document=ReturnDocument.AFTER,
+        )
+        if session is None:
+            current = await db[SESSIONS_COLLECTION].find_one({"_id": upload_id}) or {"offset": 0}
+            raise _conflict("Another request wrote this chunk first", current["offset"])
+        return self.view(session)
+
+    async def _store(self, db, session: dict) -> Tuple[str, int]:
+        """Hash the staged file and move it into the blob store; (digest, size)"""
+        digest = session.get("digest")
+        staged = self._staged(session["_id"])
+        if digest is None:
+            if session["offset"] < session["size"]:
+                raise _conflict("Upload is incomplete", session["offset"])
+            digest, head = await asyncio.to_thread(_hash_file, staged, session["size"])
+            if head != PDF_MAGIC:
+                raise HTTPException(status_code=415, detail="Only PDF files can be uploaded")
+            if session.get("declared_sha256") not in (None, digest):
+                raise HTTPException(status_code=422, detail="Uploaded bytes do not match the declared sha256")
+            # Recorded before the move, so a retry after a crash mid-move finds the blob by digest
+            await db[SESSIONS_COLLECTION].update_one(
+                {"_id": session["_id"]}, {"$set": {"digest": digest, "size": session["size"]}}
+            )
+        if staged.exists():
+            stored = await self.blobs.put(digest, staged)
+            UPLOADS_COMPLETED.inc("stored" if stored else "deduplicated")
+        elif await self.blobs.size(digest) is None:
+            raise HTTPException(status_code=410, detail="The uploaded bytes are gone; start a new upload")
+        return digest, session["size"]
+
+    async def _discard(self, db, upload_id: str):
+        await db[SESSIONS_COLLECTION].delete_one({"_id": upload_id})
+        self._staged(upload_id).unlink(missing_ok=True)
+
+    async def complete(self, db, upload_id: str,
+                       create_note: Callable[[str, str, int], Awaitable[None]]) -> dict:
+        """Store the blob and create its note via create_note(note_id, digest, size), once per session"""
+        now = datetime.now(timezone.utc)
+        # The note id is fixed at the first claim, so a completion retried after a crash cannot create two notes
+        session = await db[SESSIONS_COLLECTION].find_one_and_update(
+            {"_id": upload_id, "$or": [
+                {"state": {"$in": ["open", "stored"]}},
+                {"state": "completing", "lease_until": {"$lt": now}},
+            ]},
+            [{"$set": {
+                "state": "completing",
+                "lease_until": now + COMPLETION_LEASE,
+                "note_id": {"$ifNull": ["$note_id", str(uuid.uuid4())]},
+            }}],
+            return_document=ReturnDocument.AFTER,
+        )
+        if session is None:
+            existing = await db[SESSIONS_COLLECTION].find_one({"_id": upload_id})
+            if existing is None:
+                raise HTTPException(status_code=404, detail="Upload not found")
+            if existing["state"] == "complete":
+                return self.view(existing)
+            raise HTTPException(status_code=409, detail="Upload is already being completed",
+                                headers={"Retry-After": "1"})
+
+        digest = session.get("digest")
+        try:
+            digest, size = await self._store(db, session)
+            await create_note(session["note_id"], digest, size)
+        except HTTPException as e:
+            if e.status_code in (410, 415, 422):
+                # The bytes themselves are wrong or lost; the client starts a new upload
+                await self._discard(db, upload_id)
+            else:
+                await self._release(db, upload_id, digest)
+            raise
+        except Exception:
+            await self._release(db, upload_id, digest)
+            raise
+
+        session = await db[SESSIONS_COLLECTION].find_one_and_update(
+            {"_id": upload_id},
+            {"$set": {"state": "complete", "expires_at": datetime.now(timezone.utc) + self.session_ttl},
+             "$unset": {"lease_until": ""}},
+            return_document=ReturnDocument.AFTER,
+        )
+        return self.view(session)
+
+    async def _release(self, db, upload_id: str, digest: Optional[str]):
+        await db[SESSIONS_COLLECTION].update_one(
+            {"_id": upload_id, "state": "completing"},
+            {"$set": {"state": "stored" if digest else "open"}, "$unset": {"lease_until": ""}},
+        )
+
+
+def uploads_from_env(blobs) -> UploadManager:
+    default_staging = Path(os.environ.get('BLOB_DIR', str(Path(__file__).parent / 'blobs'))) / '.staging'
+    return UploadManager(
+        blobs,
+        Path(os.environ.get('UPLOAD_STAGING_DIR', str(default_staging))),
+        max_bytes=int(os.environ.get('UPLOAD_MAX_BYTES', str(100 * 1024 * 1024))),
+        chunk_bytes=int(os.environ.get('UPLOAD_CHUNK_BYTES', str(8 * 1024 * 1024))),
+        session_ttl=timedelta(hours=float(os.environ.get('UPLOAD_SESSION_TTL_HOURS', '24'))),
+    )
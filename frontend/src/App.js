@@ -1,5 +1,5 @@
 
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useRef } from 'react';
 import './App.css';
 import { BrowserRouter, Routes, Route } from 'react-router-dom';
 import axios from 'axios';
@@ -13,7 +13,9 @@ import { Dialog, DialogContent, DialogHeader, DialogTitle, DialogTrigger } from
 import { Select, SelectContent, SelectItem, SelectTrigger, SelectValue } from './components/ui/select';
 import { Tabs, TabsContent, TabsList, TabsTrigger } from './components/ui/tabs';
 import { Home, BookOpen, Users, Mail, MessageCircle, Star, Eye, Info, Phone, Sun, Moon, Search, Trash2, Reply, Send } from 'lucide-react';
-import notesData from './notes/notesData';
+import { loadCatalog } from './notes/catalog';
+import { applyDiscussionEvent, subscribeToDiscussions } from './lib/discussionEvents';
+import { idempotentPost } from './lib/idempotentPost';
 // Semester to subjects mapping
 const semesterSubjects = {
   3: [
@@ -58,18 +60,6 @@ const API = `${BACKEND_URL}/api`;
 
 const KaMaTi = () => {
   const [activeSection, setActiveSection] = useState('home');
-  // Flatten notesData into a single array for easier filtering
-  const allNotes = Object.entries(notesData).flatMap(([subject, notes]) =>
-    notes.map((note, idx) => ({
-      id: `${subject}-${idx}`,
-      title: note.title,
-      semester: note.semester,
-      subject,
-      size: note.size || '2 MB',
-      file_url: note.url,
-      uploaded_at: note.uploaded_at || '',
-    }))
-  );
   const [showSplash, setShowSplash] = useState(true);
 
   useEffect(() => {
@@ -77,7 +67,7 @@ const KaMaTi = () => {
     return () => clearTimeout(timer);
   }, []);
 
-  const [notes, setNotes] = useState(allNotes);
+  const [notes, setNotes] = useState([]);
   const [discussions, setDiscussions] = useState([]);
   const [showFeedback, setShowFeedback] = useState(false);
   const [showNotesModal, setShowNotesModal] = useState(false);
@@ -88,8 +78,15 @@ const KaMaTi = () => {
   const [theme, setTheme] = useState('dark'); // 'light' or 'dark'
   const [searchQuery, setSearchQuery] = useState('');
   const [replyingTo, setReplyingTo] = useState(null);
+  // The expanded discussion: the list only has an excerpt, the thread has the full text and replies
+  const [openThread, setOpenThread] = useState(null);
   const [newReply, setNewReply] = useState('');
   const [showDeleteConfirm, setShowDeleteConfirm] = useState(null);
+  // True while /api/events is connected; writes then arrive as events instead of a reload
+  const liveRef = useRef(false);
+  // Discussions page with a keyset cursor; reloads fetch as many pages as are showing
+  const [discussionsCursor, setDiscussionsCursor] = useState(null);
+  const discussionPagesRef = useRef(1);
 
   // Sample notes data - will be replaced with real database data
   const sampleNotes = [
@@ -160,25 +157,76 @@ const KaMaTi = () => {
       }, 300000); // 5 minutes
       return () => clearTimeout(timer);
     }
-    // Load discussions only (notes are static from notesData)
-    loadDiscussions();
-    setNotes(allNotes);
   }, [theme]);
 
+  useEffect(() => {
+    // The stream's first event is a resync, which loads the list; a refused stream loads it directly
+    return subscribeToDiscussions(API, {
+      onResync: loadDiscussions,
+      onEvent: (type, data) => setDiscussions((current) => applyDiscussionEvent(current, type, data)),
+      onStatus: (live) => { liveRef.current = live; },
+    });
+  }, []);
+
+  useEffect(() => {
+    // Notes come from the server catalog, refreshed with deltas on later visits
+    loadCatalog(API).then(setNotes);
+  }, []);
+
   const loadDiscussions = async () => {
     try {
-      const response = await axios.get(`${API}/discussions`);
-      setDiscussions(response.data);
+      let items = [];
+      let cursor = null;
+      for (let page = 0; page < discussionPagesRef.current; page += 1) {
+        const response = await axios.get(`${API}/discussions`, { params: cursor ? { cursor } : {} });
+        items = items.concat(response.data.items);
+        cursor = response.data.next_cursor;
+        if (!cursor) break;
+      }
+      setDiscussions(items);
+      setDiscussionsCursor(cursor);
     } catch (error) {
       console.error('Error loading discussions:', error);
     }
   };
 
+  const loadMoreDiscussions = async () => {
+    if (!discussionsCursor) return;
+    try {
+      const response = await axios.get(`${API}/discussions`, { params: { cursor: discussionsCursor } });
+      discussionPagesRef.current += 1;
+      setDiscussions((current) => [
+        ...current,
+        ...response.data.items.filter((item) => !current.some((discussion) => discussion.id === item.id)),
+      ]);
+      setDiscussionsCursor(response.data.next_cursor);
+    } catch (error) {
+      console.error('Error loading more discussions:', error);
+    }
+  };
+
+  const loadThread = async (discussionId) => {
+    try {
+      const response = await axios.get(`${API}/discussions/${discussionId}/thread`);
+      setOpenThread({ id: discussionId, ...response.data });
+    } catch (error) {
+      console.error('Error loading discussion:', error);
+    }
+  };
+
+  const toggleThread = (discussionId) => {
+    if (openThread?.id === discussionId) {
+      setOpenThread(null);
+    } else {
+      loadThread(discussionId);
+    }
+  };
+
   // Remove loadNotes, not needed anymore
 
   const submitFeedback = async () => {
     try {
-      await axios.post(`${API}/feedback`, feedback);
+      await idempotentPost(`${API}/feedback`, feedback);
       setShowFeedback(false);
       localStorage.setItem('feedbackSubmitted', 'true');
       // Open WhatsApp channel
@@ -192,9 +240,9 @@ const KaMaTi = () => {
     if (!newDiscussion.title.trim() || !newDiscussion.content.trim()) return;
     
     try {
-      await axios.post(`${API}/discussions`, newDiscussion);
+      await idempotentPost(`${API}/discussions`, newDiscussion);
       setNewDiscussion({ title: '', content: '' });
-      loadDiscussions();
+      if (!liveRef.current) loadDiscussions();
     } catch (error) {
       console.error('Error creating discussion:', error);
     }
@@ -204,13 +252,14 @@ const KaMaTi = () => {
     if (!newReply.trim()) return;
     
     try {
-      await axios.post(`${API}/discussions/${discussionId}/replies`, {
+      await idempotentPost(`${API}/discussions/${discussionId}/replies`, {
         content: newReply,
         author: 'Anonymous'
       });
       setNewReply('');
       setReplyingTo(null);
-      loadDiscussions();
+      if (!liveRef.current) loadDiscussions();
+      if (openThread?.id === discussionId) loadThread(discussionId);
     } catch (error) {
       console.error('Error creating reply:', error);
     }
@@ -219,7 +268,7 @@ const KaMaTi = () => {
   const deleteDiscussion = async (discussionId) => {
     try {
       await axios.delete(`${API}/discussions/${discussionId}`);
-      loadDiscussions();
+      if (!liveRef.current) loadDiscussions();
       setShowDeleteConfirm(null);
     } catch (error) {
       console.error('Error deleting discussion:', error);
@@ -241,7 +290,7 @@ const KaMaTi = () => {
     </div>
   );
 
-  // Fix filtering logic for new notesData structure
+  // Filter the catalog notes by search text, semester and subject
   const filteredNotes = notes.filter(note => {
     const matchesSearch = note.title.toLowerCase().includes(searchQuery.toLowerCase()) ||
       note.subject.toLowerCase().includes(searchQuery.toLowerCase());
@@ -377,10 +426,32 @@ const KaMaTi = () => {
                               </Button>
                             </div>
                           </div>
-                          <p>{discussion.content}</p>
+                          <p>
+                            {openThread?.id === discussion.id
+                              ? openThread.discussion.content
+                              : discussion.excerpt ?? discussion.content}
+                          </p>
+                          {openThread?.id === discussion.id && openThread.replies.length > 0 && (
+                            <div className="thread-replies">
+                              {openThread.replies.map((reply) => (
+                                <div key={reply.id} className="thread-reply">
+                                  <span className="thread-reply-author">{reply.author || 'Anonymous'}</span>
+                                  <p>{reply.content}</p>
+                                </div>
+                              ))}
+                            </div>
+                          )}
                           <div className="discussion-meta">
                             <Badge variant="secondary">{discussion.replies || 0} replies</Badge>
                             <Badge variant="outline">{discussion.upvotes || 0} upvotes</Badge>
+                            <Button
+                              size="sm"
+                              variant="ghost"
+                              onClick={() => toggleThread(discussion.id)}
+                              className="reply-btn read-more-btn"
+                            >
+                              {openThread?.id === discussion.id ? 'Show less' : 'Read more'}
+                            </Button>
                           </div>
 
                           {/* Reply Form */}
@@ -419,6 +490,11 @@ const KaMaTi = () => {
                       </Card>
                     ))
                   )}
+                  {discussionsCursor && (
+                    <Button variant="outline" onClick={loadMoreDiscussions} className="load-more-btn">
+                      Load more
+                    </Button>
+                  )}
                 </div>
               </div>
 
@@ -0,0 +1,60 @@
+// Live discussion updates from GET /api/events (Server-Sent Events).
+// Events carry absolute counts, so applying one the list already
+// reflects is harmless. A `resync` event (sent on every new connection)
+// means the list should be reloaded.
+
+export const applyDiscussionEvent = (discussions, type, data) => {
+  switch (type) {
+    case 'discussion.created':
+      if (discussions.some((discussion) => discussion.id === data.discussion.id)) return discussions;
+      return [data.discussion, ...discussions];
+    case 'discussion.updated':
+      return discussions.map((discussion) =>
+        discussion.id === data.id ? { ...discussion, upvotes: data.upvotes, replies: data.replies } : discussion
+      );
+    case 'discussion.deleted':
+      return discussions.filter((discussion) => discussion.id !== data.id);
+    default:
+      return discussions;
+  }
+};
+
+const EVENT_TYPES = ['discussion.created', 'discussion.updated', 'discussion.deleted'];
+// After the stream is refused outright, wait this long before opening a new one
+const RECONNECT_MS = 30000;
+
+// Returns a function that closes the stream. onStatus(true/false) reports
+// whether updates are currently arriving, so callers can fall back to reloading.
+export const subscribeToDiscussions = (api, { onResync, onEvent, onStatus = () => {} }) => {
+  if (typeof EventSource === 'undefined') {
+    onResync();
+    return () => {};
+  }
+  let source = null;
+  let retry = null;
+
+  const connect = () => {
+    source = new EventSource(`${api}/events`);
+    source.onopen = () => onStatus(true);
+    source.onerror = () => {
+      onStatus(false);
+      // A dropped connection is retried by EventSource itself, resuming from the
+      // last event id. A refused one (503 at capacity, a proxy without SSE) is
+      // CLOSED for good and no resync will come, so load the list now and retry later.
+      if (source.readyState === EventSource.CLOSED) {
+        onResync();
+        retry = setTimeout(connect, RECONNECT_MS);
+      }
+    };
+    source.addEventListener('resync', () => onResync());
+    EVENT_TYPES.forEach((type) => {
+      source.addEventListener(type, (event) => onEvent(type, JSON.parse(event.data)));
+    });
+  };
+
+  connect();
+  return () => {
+    clearTimeout(retry);
+    source.close();
+  };
+};
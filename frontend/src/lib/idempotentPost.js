@@ -0,0 +1,27 @@
+// POST with retries that cannot duplicate the write: every attempt of one
+// call carries the same Idempotency-Key, so the server answers a retry
+// with the stored response of the attempt that already went through.
+import axios from 'axios';
+
+const RETRIES = 3;
+const RETRY_DELAY_MS = 500;
+
+const newKey = () =>
+  (window.crypto && window.crypto.randomUUID)
+    ? window.crypto.randomUUID()
+    : `${Date.now()}-${Math.random().toString(36).slice(2)}`;
+
+// No response (network drop, timeout) or 409 (first attempt still running)
+const shouldRetry = (error) => !error.response || error.response.status === 409;
+
+export const idempotentPost = async (url, data) => {
+  const headers = { 'Idempotency-Key': newKey() };
+  for (let attempt = 0; ; attempt += 1) {
+    try {
+      return await axios.post(url, data, { headers });
+    } catch (error) {
+      if (attempt >= RETRIES || !shouldRetry(error)) throw error;
+      await new Promise((resolve) => setTimeout(resolve, RETRY_DELAY_MS * 2 ** attempt));
+    }
+  }
+};
@@ -0,0 +1,78 @@
+// Notes catalog, fetched from GET /api/catalog instead of being bundled.
+// The last catalog is kept in localStorage with its version; later visits
+// ask only for the changes since that version.
+import axios from 'axios';
+
+const STORAGE_KEY = 'notesCatalog';
+
+const readStored = () => {
+  try {
+    const stored = JSON.parse(localStorage.getItem(STORAGE_KEY));
+    return stored && typeof stored.version === 'number' && stored.notes ? stored : null;
+  } catch (error) {
+    return null;
+  }
+};
+
+const writeStored = (catalog) => {
+  try {
+    localStorage.setItem(STORAGE_KEY, JSON.stringify(catalog));
+  } catch (error) {
+    // Storage full or disabled: the next visit fetches the whole catalog again
+  }
+};
+
+// { subject: { semester: [note] } } -> { id: note }
+const flattenSnapshot = (subjects) => {
+  const notes = {};
+  Object.entries(subjects).forEach(([subject, semesters]) => {
+    Object.entries(semesters).forEach(([semester, entries]) => {
+      entries.forEach((entry) => {
+        notes[entry.id] = { ...entry, subject, semester };
+      });
+    });
+  });
+  return notes;
+};
+
+const applyChanges = (notes, changes) => {
+  const next = { ...notes };
+  changes.forEach((change) => {
+    if (change.op === 'upsert') {
+      next[change.note.id] = change.note;
+    } else if (change.op === 'remove') {
+      delete next[change.id];
+    }
+  });
+  return next;
+};
+
+// Uploaded notes link to the API's own /api/files/{id}, relative to the backend
+const resolveFileUrl = (api, fileUrl) =>
+  fileUrl && fileUrl.startsWith('/') ? `${api.replace(/\/api$/, '')}${fileUrl}` : fileUrl;
+
+const toListItem = (api) => (note) => ({
+  id: note.id,
+  title: note.title,
+  semester: note.semester,
+  subject: note.subject,
+  size: note.size || '2 MB',
+  file_url: resolveFileUrl(api, note.file_url),
+  uploaded_at: note.uploaded_at ? note.uploaded_at.slice(0, 10) : '',
+});
+
+// Resolves to the flat list of notes the notes window filters on
+export const loadCatalog = async (api) => {
+  const stored = readStored();
+  const params = stored ? { since: stored.version } : {};
+  let catalog = stored;
+  try {
+    const { data } = await axios.get(`${api}/catalog`, { params });
+    const notes = data.full ? flattenSnapshot(data.subjects) : applyChanges(stored.notes, data.changes);
+    catalog = { version: data.version, notes };
+    writeStored(catalog);
+  } catch (error) {
+    console.error('Error loading notes catalog:', error);
+  }
+  return catalog ? Object.values(catalog.notes).map(toListItem(api)) : [];
+};
@@ -1,5 +1,5 @@
-// This file contains the notes data for all subjects and semesters.
-// Import and use in NotesWindow or other components as needed.
+// Seed data for the notes collection; the app reads notes from GET /api/catalog.
+// Load it with: python backend/ingest.py frontend/src/notes/notesData.js
 
   const notesData = {
     "Syllabus": [
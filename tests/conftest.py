@@ -0,0 +1,22 @@
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+# The backend is a flat set of modules run from backend/, not an installed package
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+ADMIN_TOKEN = "test-admin-token"
+
+
+@pytest.fixture(scope="session")
+def client():
+    """The API on the in-memory storage engine; create_app() may only run once per process"""
+    os.environ.update(STORAGE_ENGINE="memory", RATE_LIMITS="", ADMIN_TOKEN=ADMIN_TOKEN, MONGO_STARTUP_JITTER_MS="0")
+    from fastapi.testclient import TestClient
+
+    import server
+
+    with TestClient(server.create_app()) as test_client:
+        yield test_client
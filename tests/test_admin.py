@@ -0,0 +1,31 @@
+import dataclasses
+
+import pytest
+
+from tests.conftest import ADMIN_TOKEN
+
+ADMIN_ROUTES = [("post", "/admin/stats/rebuild"), ("get", "/admin/purge/status")]
+
+
+@pytest.mark.parametrize("method, path", ADMIN_ROUTES)
+def test_admin_routes_need_the_token(client, method, path):
+    assert client.request(method, path).status_code == 401
+    response = client.request(method, path, headers={"Authorization": "Bearer wrong"})
+    assert response.status_code == 401
+    # Past the guard; these routes keep their state in MongoDB
+    response = client.request(method, path, headers={"Authorization": f"Bearer {ADMIN_TOKEN}"})
+    assert response.status_code == 501
+
+
+@pytest.mark.parametrize("method, path", ADMIN_ROUTES)
+def test_admin_routes_are_disabled_without_a_token(client, monkeypatch, method, path):
+    import server
+
+    monkeypatch.setattr(server, "settings", dataclasses.replace(server.settings, admin_token=""))
+    response = client.request(method, path, headers={"Authorization": "Bearer "})
+    assert response.status_code == 403
+
+
+@pytest.mark.parametrize("method, path", [("post", "/api/stats/rebuild"), ("get", "/api/purge/status")])
+def test_admin_routes_left_the_public_api(client, method, path):
+    assert client.request(method, path).status_code in (404, 405)
@@ -0,0 +1,117 @@
+import asyncio
+import uuid
+
+from starlette.requests import Request
+
+from cache import MemoryBackend, ResponseCache
+
+BODY = {"items": [{"id": str(i), "title": "Lecture notes " * 4} for i in range(50)]}
+
+
+def _request(path="/api/notes", **headers):
+    return Request({
+        "type": "http", "method": "GET", "path": path, "query_string": b"limit=50",
+        "headers": [(name.replace("_", "-").encode(), value.encode()) for name, value in headers.items()],
+    })
+
+
+def test_matching_etag_is_answered_with_304():
+    async def scenario():
+        cache = ResponseCache(MemoryBackend())
+        calls = []
+
+        async def produce():
+            calls.append(1)
+            return BODY
+
+        first = await cache.respond(_request(), ["notes"], produce)
+        revalidated = await cache.respond(_request(if_none_match=first.headers["etag"]), ["notes"], produce)
+        other = await cache.respond(_request(if_none_match='"something-else"'), ["notes"], produce)
+        return first, revalidated, other, len(calls)
+
+    first, revalidated, other, produced = asyncio.run(scenario())
+    assert first.status_code == 200
+    assert revalidated.status_code == 304 and revalidated.body == b""
+    assert revalidated.headers["etag"] == first.headers["etag"]
+    assert other.status_code == 200 and other.body == first.body
+    assert produced == 1
+
+
+def test_gzip_and_identity_have_different_etags():
+    async def scenario():
+        cache = ResponseCache(MemoryBackend())
+
+        async def produce():
+            return BODY
+
+        identity = await cache.respond(_request(accept_encoding="identity"), ["notes"], produce)
+        gzipped = await cache.respond(_request(accept_encoding="gzip"), ["notes"], produce)
+        return identity, gzipped
+
+    identity, gzipped = asyncio.run(scenario())
+    assert "content-encoding" not in identity.headers
+    assert gzipped.headers["content-encoding"] == "gzip"
+    assert identity.headers["etag"] != gzipped.headers["etag"]
+
+
+def test_invalidating_a_tag_produces_a_fresh_body():
+    async def scenario():
+        cache = ResponseCache(MemoryBackend())
+        version = {"n": 0}
+
+        async def produce():
+            return {"version": version["n"]}
+
+        before = await cache.respond(_request(), ["notes", "discussions"], produce)
+        version["n"] = 1
+        cached = await cache.respond(_request(), ["notes", "discussions"], produce)
+        await cache.invalidate("discussions")
+        after = await cache.respond(_request(if_none_match=before.headers["etag"]), ["notes", "discussions"], produce)
+        return before, cached, after
+
+    before, cached, after = asyncio.run(scenario())
+    assert cached.body == before.body
+    assert after.status_code == 200 and after.body == b'{"version":1}'
+    assert after.headers["etag"] != before.headers["etag"]
+
+
+def _revalidate(client, path, etag):
+    return client.get(path, headers={"If-None-Match": etag, "Accept-Encoding": "identity"})
+
+
+def test_note_write_invalidates_the_notes_list(client):
+    listed = client.get("/api/notes", headers={"Accept-Encoding": "identity"})
+    assert _revalidate(client, "/api/notes", listed.headers["etag"]).status_code == 304
+    created = client.post("/api/notes", json={
+        "title": "Cache notes", "subject": "Physics", "semester": "1",
+        "file_url": f"https://example.com/{uuid.uuid4().hex}.pdf",
+    }).json()
+    fresh = _revalidate(client, "/api/notes", listed.headers["etag"])
+    assert fresh.status_code == 200
+    assert created["id"] in [note["id"] for note in fresh.json()["items"]]
+
+
+def test_discussion_write_invalidates_the_discussions_list(client):
+    listed = client.get("/api/discussions", headers={"Accept-Encoding": "identity"})
+    assert _revalidate(client, "/api/discussions", listed.headers["etag"]).status_code == 304
+    created = client.post("/api/discussions", json={"title": "Cached?", "content": "Is this list cached?"}).json()
+    fresh = _revalidate(client, "/api/discussions", listed.headers["etag"])
+    assert fresh.status_code == 200
+    assert created["id"] in [discussion["id"] for discussion in fresh.json()["items"]]
+
+
+def test_reply_write_invalidates_replies_and_thread(client):
+    discussion = client.post("/api/discussions", json={"title": "Thread", "content": "Replies below"}).json()
+    replies_path = f"/api/discussions/{discussion['id']}/replies"
+    thread_path = f"/api/discussions/{discussion['id']}/thread"
+    replies = client.get(replies_path, headers={"Accept-Encoding": "identity"})
+    thread = client.get(thread_path, headers={"Accept-Encoding": "identity"})
+    assert _revalidate(client, replies_path, replies.headers["etag"]).status_code == 304
+    assert _revalidate(client, thread_path, thread.headers["etag"]).status_code == 304
+
+    reply = client.post(replies_path, json={"content": "First!"}).json()
+    fresh_replies = _revalidate(client, replies_path, replies.headers["etag"])
+    fresh_thread = _revalidate(client, thread_path, thread.headers["etag"])
+    assert fresh_replies.status_code == 200 and fresh_thread.status_code == 200
+    assert [item["id"] for item in fresh_replies.json()["items"]] == [reply["id"]]
+    assert fresh_thread.json()["discussion"]["replies"] == 1
@@ -0,0 +1,74 @@
+import asyncio
+import gzip
+import zlib
+
+from starlette.requests import Request
+
+from cache import MemoryBackend, ResponseCache
+from compression import CompressionMiddleware, encoded_etag
+
+BODY = {"items": [{"id": str(i), "title": "Lecture notes " * 4} for i in range(50)]}
+
+
+def _request(**headers):
+    return Request({
+        "type": "http", "method": "GET", "path": "/api/notes", "query_string": b"limit=50",
+        "headers": [(name.replace("_", "-").encode(), value.encode()) for name, value in headers.items()],
+    })
+
+
+def test_encoded_etag_is_distinct_per_encoding():
+    assert encoded_etag('"abc"', "gzip") == '"abc-gzip"'
+    assert encoded_etag('W/"abc"', "br") == 'W/"abc-br"'
+    assert encoded_etag('"abc"', None) == '"abc"'
+
+
+def test_cached_encodings_carry_their_own_etag():
+    async def scenario():
+        cache = ResponseCache(MemoryBackend())
+
+        async def produce():
+            return BODY
+
+        identity = await cache.respond(_request(accept_encoding="identity"), ["notes"], produce)
+        gzipped = await cache.respond(_request(accept_encoding="gzip"), ["notes"], produce)
+        # The identity validator must not revalidate the gzip bytes, and vice versa
+        stale = await cache.respond(_request(accept_encoding="gzip", if_none_match=identity.headers["etag"]),
+                                    ["notes"], produce)
+        fresh = await cache.respond(_request(accept_encoding="gzip", if_none_match=gzipped.headers["etag"]),
+                                    ["notes"], produce)
+        return identity, gzipped, stale, fresh
+
+    identity, gzipped, stale, fresh = asyncio.run(scenario())
+    assert gzipped.headers["content-encoding"] == "gzip"
+    assert gzipped.headers["etag"] == encoded_etag(identity.headers["etag"], "gzip")
+    assert gzip.decompress(gzipped.body) == identity.body
+    assert (stale.status_code, fresh.status_code) == (200, 304)
+
+
+def test_streamed_body_is_flushed_per_chunk_with_an_encoded_etag():
+    lines = [b'{"id": "%d", "title": "Lecture notes"}\n' % i for i in range(3)]
+
+    async def app(scope, receive, send):
+        await send({"type": "http.response.start", "status": 200,
+                    "headers": [(b"content-type", b"application/x-ndjson"), (b"etag", b'"export"')]})
+        for line in lines:
+            await send({"type": "http.response.body", "body": line, "more_body": True})
+        await send({"type": "http.response.body", "body": b""})
+
+    sent = []
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {"type": "http", "method": "GET", "path": "/api/notes", "headers": [(b"accept-encoding", b"gzip")]}
+    asyncio.run(CompressionMiddleware(app)(scope, None, send))
+
+    start, *chunks = sent
+    assert dict(start["headers"])[b"etag"] == b'"export-gzip"'
+    decoder = zlib.decompressobj(zlib.MAX_WBITS | 16)
+    for line, chunk in zip(lines, chunks):
+        # Everything sent so far decodes without waiting for the end of the stream
+        assert decoder.decompress(chunk["body"]) == line
+    assert decoder.decompress(b"".join(chunk["body"] for chunk in chunks[len(lines):])) == b""
+    assert decoder.eof
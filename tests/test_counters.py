@@ -0,0 +1,77 @@
+import asyncio
+
+from counters import CounterBuffer
+
+
+class SlowRepo:
+    def __init__(self, fail: bool = False):
+        self.fail = fail
+        self.started = asyncio.Event()
+        self.release = asyncio.Event()
+        self.written = []
+
+    async def increment(self, deltas):
+        self.started.set()
+        await self.release.wait()
+        if self.fail:
+            raise RuntimeError("write failed")
+        self.written.append(deltas)
+
+
+def _flush_while_reading(fail: bool):
+    async def scenario():
+        repo = SlowRepo(fail)
+        buffer = CounterBuffer()
+        buffer._storage = {"discussions": repo}
+        buffer.increment("discussions", "d1", amount=3)
+        flush = asyncio.create_task(buffer.flush())
+        await repo.started.wait()
+        during = buffer.merge("discussions", [{"id": "d1", "upvotes": 10}])[0]["upvotes"]
+        repo.release.set()
+        await flush
+        return buffer, repo, during
+
+    return asyncio.run(scenario())
+
+
+def test_merge_counts_batch_being_written():
+    buffer, repo, during = _flush_while_reading(fail=False)
+    assert during == 13
+    assert repo.written == [{"d1": {"upvotes": 3}}]
+    assert buffer.pending("discussions", "d1") == 0
+
+
+def test_failed_write_is_requeued():
+    buffer, repo, during = _flush_while_reading(fail=True)
+    assert during == 13
+    assert buffer.pending("discussions", "d1") == 3
+
+
+def test_on_flush_reports_only_written_collections():
+    class Repo:
+        def __init__(self, fail):
+            self.fail = fail
+
+        async def increment(self, deltas):
+            if self.fail:
+                raise RuntimeError("write failed")
+
+    async def scenario():
+        flushed = []
+
+        async def on_flush(batch):
+            flushed.append(dict(batch))
+
+        buffer = CounterBuffer(on_flush=on_flush)
+        buffer._storage = {"discussions": Repo(fail=False), "replies": Repo(fail=True)}
+        buffer.increment("discussions", "d1", amount=2)
+        buffer.increment("replies", "r1")
+        await buffer.flush()
+        buffer._storage["replies"].fail = False
+        await buffer.flush()
+        return flushed
+
+    assert asyncio.run(scenario()) == [
+        {("discussions", "d1", "upvotes"): 2},
+        {("replies", "r1", "upvotes"): 1},
+    ]
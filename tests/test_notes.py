@@ -0,0 +1,21 @@
+import uuid
+
+
+def _note(file_url):
+    return {"title": "Unit 1 notes", "subject": "Mathematics", "semester": "3", "file_url": file_url}
+
+
+def test_posting_a_note_twice_is_a_conflict(client):
+    file_url = f"https://example.com/{uuid.uuid4().hex}.pdf"
+    created = client.post("/api/notes", json=_note(file_url))
+    assert created.status_code == 200
+    again = client.post("/api/notes", json=_note(file_url))
+    assert again.status_code == 409
+    assert "file_url" in again.json()["detail"]
+
+
+def test_a_deleted_note_url_can_be_posted_again(client):
+    file_url = f"https://example.com/{uuid.uuid4().hex}.pdf"
+    note = client.post("/api/notes", json=_note(file_url)).json()
+    assert client.delete(f"/api/notes/{note['id']}").status_code == 200
+    assert client.post("/api/notes", json=_note(file_url)).status_code == 200
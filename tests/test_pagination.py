@@ -0,0 +1,27 @@
+from datetime import datetime, timezone
+
+import pytest
+from fastapi import HTTPException
+
+from pagination import decode_cursor, encode_cursor, seek_filter
+
+
+def test_cursor_roundtrip_keeps_dates():
+    created_at = datetime(2025, 9, 1, 12, 30, tzinfo=timezone.utc)
+    cursor = encode_cursor("created_at", created_at, "abc")
+    assert decode_cursor(cursor, "created_at") == (created_at, "abc")
+
+
+def test_cursor_from_another_sort_is_rejected():
+    cursor = encode_cursor("created_at", datetime(2025, 9, 1, tzinfo=timezone.utc), "abc")
+    with pytest.raises(HTTPException) as error:
+        seek_filter("hot_score", cursor)
+    assert error.value.status_code == 400
+    assert "different sort" in error.value.detail
+
+
+@pytest.mark.parametrize("cursor", ["not-a-cursor", encode_cursor("upvotes", 3, "abc")[:-4]])
+def test_malformed_cursor_is_rejected(cursor):
+    with pytest.raises(HTTPException) as error:
+        decode_cursor(cursor, "upvotes")
+    assert error.value.status_code == 400
@@ -0,0 +1,92 @@
+import asyncio
+
+from starlette.requests import Request
+
+from ratelimit import AdmissionMiddleware, MemoryBucketBackend, RateLimiter
+
+
+def _request(headers=(), client=("10.0.0.2", 5000)):
+    return Request({
+        "type": "http", "method": "GET", "path": "/", "client": client,
+        "headers": [(name.encode(), value.encode()) for name, value in headers],
+    })
+
+
+def test_client_key_defaults_to_socket_peer():
+    limiter = RateLimiter(MemoryBucketBackend(), {})
+    request = _request([("x-forwarded-for", "203.0.113.9")])
+    assert limiter.client_key(request) == "10.0.0.2"
+
+
+def test_client_key_reads_address_appended_by_ingress():
+    limiter = RateLimiter(MemoryBucketBackend(), {}, trusted_proxy_hops=1)
+    request = _request([("x-forwarded-for", "203.0.113.9, 198.51.100.4")])
+    assert limiter.client_key(request) == "198.51.100.4"
+    assert limiter.client_key(_request()) == "10.0.0.2"
+
+
+def test_client_key_without_trusted_hops_warns_behind_proxy(caplog):
+    limiter = RateLimiter(MemoryBucketBackend(), {}, trusted_proxy_hops=0)
+    request = _request([("x-forwarded-for", "203.0.113.9")])
+    assert limiter.client_key(request) == "10.0.0.2"
+    assert "TRUSTED_PROXY_HOPS=0" in caplog.text
+
+
+def test_streamed_response_releases_admission_slot_when_it_starts():
+    async def scenario():
+        reading = asyncio.Event()
+        finish = asyncio.Event()
+
+        async def app(scope, receive, send):
+            await send({"type": "http.response.start", "status": 200, "headers": []})
+            if scope["path"] == "/api/notes":
+                await send({"type": "http.response.body", "body": b"{}\n", "more_body": True})
+                reading.set()
+                await finish.wait()
+            await send({"type": "http.response.body", "body": b""})
+
+        sent = []
+
+        async def send(message):
+            sent.append(message)
+
+        middleware = AdmissionMiddleware(app, max_in_flight=1, queue_timeout=0.01)
+        stream = asyncio.create_task(middleware({"type": "http", "path": "/api/notes"}, None, send))
+        await reading.wait()
+        # The export is still being read, yet a second request is admitted
+        await middleware({"type": "http", "path": "/api/discussions"}, None, send)
+        finish.set()
+        await stream
+        return [message["status"] for message in sent if message["type"] == "http.response.start"]
+
+    assert asyncio.run(scenario()) == [200, 200]
+
+
+def test_only_exempt_routes_skip_admission_under_a_shared_prefix():
+    async def scenario():
+        holding = asyncio.Event()
+        finish = asyncio.Event()
+
+        async def app(scope, receive, send):
+            if scope["path"] == "/api/notes":
+                holding.set()
+                await finish.wait()
+            await send({"type": "http.response.start", "status": 200, "headers": []})
+            await send({"type": "http.response.body", "body": b""})
+
+        sent = []
+
+        async def send(message):
+            sent.append(message)
+
+        middleware = AdmissionMiddleware(app, max_in_flight=1, queue_timeout=0.01,
+                                         exempt_routes=(("PUT", r"/api/uploads/[^/]+"),))
+        held = asyncio.create_task(middleware({"type": "http", "method": "GET", "path": "/api/notes"}, None, send))
+        await holding.wait()
+        await middleware({"type": "http", "method": "PUT", "path": "/api/uploads/u1"}, None, send)
+        await middleware({"type": "http", "method": "POST", "path": "/api/uploads/u1/complete"}, None, send)
+        finish.set()
+        await held
+        return [message["status"] for message in sent if message["type"] == "http.response.start"]
+
+    assert asyncio.run(scenario()) == [200, 503, 200]
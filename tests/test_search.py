@@ -0,0 +1,119 @@
+import asyncio
+
+import pytest
+
+from models import Discussion, Note, Reply
+from search import SearchIndex, build_indexes, discussions_index, notes_index, stem
+from storage_memory import MemoryStorage
+
+
+def _titles(*titles):
+    index = SearchIndex({"title": 1.0})
+    for number, title in enumerate(titles):
+        index.add(f"d{number}", {"title": title})
+    return index
+
+
+def _ids(results):
+    return [doc_id for doc_id, _ in results]
+
+
+@pytest.fixture
+def storage():
+    """A memory store; build it into the module indexes with build_indexes"""
+    return MemoryStorage()
+
+
+def _build(storage):
+    asyncio.run(build_indexes(storage))
+
+
+def test_bm25_prefers_the_shorter_match_and_skips_non_matches():
+    index = _titles("graph theory", "graph algorithms graph colouring exercises worked solutions appendix",
+                    "linear algebra")
+    assert _ids(index.search("graph")) == ["d0", "d1"]
+
+
+def test_rarer_terms_weigh_more():
+    index = _titles("matrix notes", "matrix eigenvalues", "matrix determinants")
+    # "eigenvalues" is in one document, "matrix" in all three
+    assert _ids(index.search("matrix eigenvalues"))[0] == "d1"
+
+
+def test_title_outweighs_subject(storage):
+    async def seed():
+        await storage.notes.insert(Note(title="Thermodynamics", subject="Physics", semester="2").model_dump())
+        await storage.notes.insert(Note(title="Unit 4", subject="Thermodynamics", semester="2").model_dump())
+    asyncio.run(seed())
+    _build(storage)
+    results = notes_index.search("thermodynamics")
+    assert len(results) == 2
+    top, _ = results[0]
+    assert asyncio.run(storage.notes.get(top))["title"] == "Thermodynamics"
+
+
+def test_stemming_joins_word_forms():
+    assert stem("sorting") == stem("sorted") == stem("sorts") == "sort"
+    index = _titles("Sorting algorithms")
+    assert _ids(index.search("sorted algorithm")) == ["d0"]
+
+
+def test_only_the_last_token_matches_as_a_prefix():
+    index = _titles("probability", "statistics")
+    assert _ids(index.search("prob")) == ["d0"]
+    assert set(_ids(index.search("statistics prob"))) == {"d0", "d1"}
+    # Not being typed any more: "prob" must match a whole word
+    assert _ids(index.search("prob statistics")) == ["d1"]
+
+
+def test_one_edit_typos_are_expanded():
+    index = _titles("thermodynamics", "algorithm")
+    assert _ids(index.search("thermodynamcs")) == ["d0"]
+    assert _ids(index.search("algorithn")) == ["d1"]
+    # Two edits away, and short words are never fuzzed
+    assert index.search("algoritnn") == []
+    assert _titles("cat").search("bat") == []
+
+
+def test_whole_words_outrank_prefix_matches():
+    index = _titles("probability", "prob")
+    assert _ids(index.search("prob")) == ["d1", "d0"]
+
+
+def test_filters_by_subject_and_semester(storage):
+    async def seed():
+        for subject, semester in [("Physics", "1"), ("Physics", "3"), ("Chemistry", "3")]:
+            await storage.notes.insert(Note(title="Lab manual", subject=subject, semester=semester).model_dump())
+    asyncio.run(seed())
+    _build(storage)
+
+    def found(**filters):
+        return sorted((doc["subject"], doc["semester"]) for doc in asyncio.run(
+            storage.notes.find_many(_ids(notes_index.search("lab", filters)))))
+
+    assert found() == [("Chemistry", "3"), ("Physics", "1"), ("Physics", "3")]
+    assert found(subject="Physics") == [("Physics", "1"), ("Physics", "3")]
+    assert found(subject="Physics", semester="3") == [("Physics", "3")]
+    assert found(semester="2") == []
+
+
+def test_deleted_replies_and_discussions_leave_the_index(storage):
+    discussion = Discussion(title="Exam doubts", content="Which chapters are in the syllabus?").model_dump()
+    reply = Reply(discussion_id=discussion["id"], content="Eigenvalues are in unit three").model_dump()
+
+    async def seed():
+        await storage.discussions.insert(dict(discussion))
+        await storage.replies.insert(dict(reply))
+    asyncio.run(seed())
+    _build(storage)
+    assert _ids(discussions_index.search("eigenvalues")) == [discussion["id"]]
+
+    # What the reply and discussion delete handlers do
+    removed = asyncio.run(storage.replies.delete(reply["id"]))
+    discussions_index.retract(removed["discussion_id"], "replies", removed["content"])
+    assert discussions_index.search("eigenvalues") == []
+    assert _ids(discussions_index.search("syllabus")) == [discussion["id"]]
+
+    discussions_index.remove(discussion["id"])
+    assert discussions_index.search("syllabus") == []
+    assert discussion["id"] not in discussions_index
@@ -0,0 +1,354 @@
+"""Conformance checks shared by every storage engine.
+
+Each check gets a fresh, empty storage and drives the repositories the
+way the API does: inserts, keyset paging under every sort, projections,
+counters, reply bookkeeping, hot scores and deletes. An engine conforms
+when every check passes, so the API behaves the same whichever engine
+STORAGE_ENGINE picks. Memory and SQLite always run; set TEST_MONGO_URL
+to also check MongoDB, in a scratch database that is dropped after each
+check.
+"""
+import asyncio
+import os
+import tempfile
+import uuid
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import AsyncIterator, Callable, List
+
+import pytest
+from fastapi import HTTPException
+from pymongo.errors import DuplicateKeyError
+
+from models import Discussion, Feedback, Note, Reply
+from ranking import SORT_FIELDS, hot_score
+from storage import DUPLICATE, INSERTED, bson_datetime
+
+NOW = datetime.now(timezone.utc).replace(microsecond=123456)
+
+
+# Engines, each yielding an empty storage per check
+
+@asynccontextmanager
+async def memory_engine():
+    from storage_memory import MemoryStorage
+    yield MemoryStorage()
+
+
+@asynccontextmanager
+async def sqlite_engine():
+    from storage_sqlite import SQLiteStorage
+    with tempfile.TemporaryDirectory() as directory:
+        storage = SQLiteStorage(str(Path(directory) / "conformance.db"))
+        await storage.open()
+        try:
+            yield storage
+        finally:
+            await storage.close()
+
+
+@asynccontextmanager
+async def mongo_engine():
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    from indexes import REQUIRED_INDEXES
+    from storage import MongoStorage
+    from threads import detect_transactions
+
+    client = AsyncIOMotorClient(os.environ['TEST_MONGO_URL'], tz_aware=True)
+    name = f"conformance_{uuid.uuid4().hex[:8]}"
+    try:
+        db = client[name]
+        for collection in ("notes", "discussions", "replies", "feedback"):
+            await db[collection].create_indexes(REQUIRED_INDEXES[collection])
+        await detect_transactions(client)
+        yield MongoStorage(None).bind(client, db)
+    finally:
+        await client.drop_database(name)
+        client.close()
+
+
+ENGINES = {"memory": memory_engine, "sqlite": sqlite_engine, "mongo": mongo_engine}
+
+
+@pytest.fixture(params=list(ENGINES))
+def engine(request):
+    # Not MONGO_URL: importing the server loads backend/.env, which would point the checks at the app's database
+    if request.param == "mongo" and not os.environ.get("TEST_MONGO_URL"):
+        pytest.skip("set TEST_MONGO_URL to check the mongo engine")
+    return ENGINES[request.param]
+
+
+def conformance(check):
+    """A test running `check` against a fresh storage of every engine"""
+    def test(engine):
+        async def scenario():
+            async with engine() as storage:
+                await check(storage)
+        asyncio.run(scenario())
+    test.__name__ = check.__name__
+    return test
+
+
+# Helpers
+
+def stored(doc: dict) -> dict:
+    """A document as every engine should return it"""
+    return {name: bson_datetime(value) if isinstance(value, datetime) else value for name, value in doc.items()}
+
+
+def projection(*fields: str) -> dict:
+    return {"_id": 0, **{name: 1 for name in fields}}
+
+
+def ids(docs) -> List[str]:
+    return [doc["id"] for doc in docs]
+
+
+async def walk(fetch: Callable, limit: int) -> List[dict]:
+    """Every page of a keyset list, checking the cursor contract on the way"""
+    docs, cursor = await fetch(limit, None)
+    pages = [docs]
+    while cursor is not None:
+        assert len(pages[-1]) == limit, "only full pages may carry a next_cursor"
+        docs, cursor = await fetch(limit, cursor)
+        pages.append(docs)
+    assert len(pages[-1]) <= limit
+    return [doc for page in pages for doc in page]
+
+
+async def collect(iterator: AsyncIterator[dict]) -> List[dict]:
+    return [doc async for doc in iterator]
+
+
+def make_note(index: int, **fields) -> dict:
+    note = dict(
+        title=f"Note {index}", subject=fields.pop("subject", "Mathematics"), semester=fields.pop("semester", "1"),
+        file_url=f"https://example.com/{uuid.uuid4().hex}.pdf", uploaded_at=NOW - timedelta(hours=index),
+    )
+    note.update(fields)
+    return Note(**note).model_dump()
+
+
+def make_discussion(index: int, **fields) -> dict:
+    discussion = dict(title=f"Discussion {index}", content="content " * index, created_at=NOW - timedelta(hours=index))
+    discussion.update(fields)
+    return Discussion(**discussion).model_dump()
+
+
+def make_reply(discussion_id: str, index: int) -> dict:
+    reply = Reply(discussion_id=discussion_id, content=f"Reply {index}", created_at=NOW + timedelta(minutes=index))
+    return reply.model_dump()
+
+
+# Checks
+
+@conformance
+async def test_note_roundtrip(storage):
+    note = make_note(1, size="2 MB")
+    await storage.notes.insert(dict(note))
+    assert await storage.notes.get(note["id"]) == stored(note)
+    assert await storage.notes.get(note["id"], projection("id", "title")) == {"id": note["id"], "title": note["title"]}
+    assert await storage.notes.get("missing") is None
+    with pytest.raises(DuplicateKeyError):
+        await storage.notes.insert(make_note(2, file_url=note["file_url"]))
+
+
+@conformance
+async def test_note_paging(storage):
+    notes = [make_note(i, subject="Physics" if i % 3 else "Chemistry", semester=str(i % 2 + 1)) for i in range(11)]
+    # Same upload time: the id breaks the tie
+    notes.append(make_note(20, uploaded_at=notes[4]["uploaded_at"], subject="Physics", semester="1"))
+    for note in notes:
+        await storage.notes.insert(dict(note))
+
+    def newest_first(docs):
+        return ids(sorted(docs, key=lambda doc: (bson_datetime(doc["uploaded_at"]), doc["id"]), reverse=True))
+
+    for subject, semester in [(None, None), ("Physics", None), (None, "2"), ("Physics", "1"), ("Biology", None)]:
+        expected = newest_first(note for note in notes
+                                if (subject is None or note["subject"] == subject)
+                                and (semester is None or note["semester"] == semester))
+        for limit in (1, 3, 50):
+            docs = await walk(lambda n, c: storage.notes.page(n, c, projection("id", "uploaded_at"),
+                                                               subject=subject, semester=semester), limit)
+            assert ids(docs) == expected, f"subject={subject} semester={semester} limit={limit}"
+        streamed = await collect(storage.notes.stream(projection("id"), subject=subject, semester=semester))
+        assert ids(streamed) == expected
+        assert all(set(doc) == {"id"} for doc in streamed)
+
+    grouped = await collect(storage.notes.by_subject(projection("id", "subject", "semester", "uploaded_at")))
+    expected = sorted(notes, key=lambda doc: (bson_datetime(doc["uploaded_at"]), doc["id"]), reverse=True)
+    expected = sorted(expected, key=lambda doc: (doc["subject"], doc["semester"]))
+    assert ids(grouped) == ids(expected)
+
+
+@conformance
+async def test_note_batch(storage):
+    existing = make_note(1)
+    await storage.notes.insert(dict(existing))
+    first, second, no_url = make_note(2), make_note(3), make_note(4, file_url=None)
+    twin = make_note(5, file_url=first["file_url"])
+    again = make_note(6, file_url=existing["file_url"])
+    outcomes = await storage.notes.insert_batch([dict(first), dict(again), dict(no_url), dict(twin), dict(second)])
+    assert outcomes == [INSERTED, DUPLICATE, INSERTED, DUPLICATE, INSERTED]
+    found = await storage.notes.find_many([first["id"], twin["id"], no_url["id"], "missing"], projection("id"))
+    assert sorted(ids(found)) == sorted([first["id"], no_url["id"]])
+
+
+@conformance
+async def test_note_delete(storage):
+    keep, gone = make_note(1), make_note(2, subject="Physics", semester="3")
+    await storage.notes.insert(dict(keep))
+    await storage.notes.insert(dict(gone))
+    assert await storage.notes.delete(gone["id"], projection("subject", "semester")) == {"subject": "Physics",
+                                                                                          "semester": "3"}
+    assert await storage.notes.get(gone["id"]) is None
+    assert await storage.notes.delete(gone["id"]) is None
+    docs, _ = await storage.notes.page(10, projection=projection("id"))
+    assert ids(docs) == [keep["id"]]
+    assert await storage.notes.find_many([gone["id"]]) == []
+    assert len(await collect(storage.notes.by_subject())) == 1
+
+
+@conformance
+async def test_discussion_sorts(storage):
+    discussions = [make_discussion(i, upvotes=i % 4, replies=i % 3, hot_score=float(i % 5)) for i in range(13)]
+    for discussion in discussions:
+        await storage.discussions.insert(dict(discussion))
+    assert await storage.discussions.get(discussions[0]["id"]) == stored(discussions[0])
+    assert await storage.discussions.exists(discussions[0]["id"])
+    assert not await storage.discussions.exists("missing")
+
+    for sort, field in SORT_FIELDS.items():
+        expected = ids(sorted(discussions, key=lambda doc: (doc[field], doc["id"]), reverse=True))
+        for limit in (1, 4, 50):
+            docs = await walk(lambda n, c: storage.discussions.page(field, n, c, projection("id", field)), limit)
+            assert ids(docs) == expected, f"sort={sort} limit={limit}"
+        streamed = await collect(storage.discussions.stream(field, projection("id")))
+        assert ids(streamed) == expected, f"streamed sort={sort}"
+
+
+@conformance
+async def test_cursor_from_another_sort_is_rejected(storage):
+    for i in range(3):
+        await storage.discussions.insert(make_discussion(i, upvotes=i, hot_score=float(i)))
+    _, cursor = await storage.discussions.page(SORT_FIELDS["new"], 1, projection=projection("id"))
+    for sort in ("hot", "top"):
+        with pytest.raises(HTTPException) as error:
+            await storage.discussions.page(SORT_FIELDS[sort], 1, cursor, projection("id"))
+        assert error.value.status_code == 400, sort
+
+
+@conformance
+async def test_replies(storage):
+    discussion = make_discussion(1)
+    await storage.discussions.insert(dict(discussion))
+    assert not await storage.replies.insert(make_reply("missing", 0))
+    replies = [make_reply(discussion["id"], i) for i in range(7)]
+    # Same time as another reply: the id breaks the tie
+    tie = Reply(discussion_id=discussion["id"], content="Tie", created_at=replies[2]["created_at"])
+    replies.append(tie.model_dump())
+    for reply in replies:
+        assert await storage.replies.insert(dict(reply))
+    assert (await storage.discussions.get(discussion["id"], projection("replies")))["replies"] == len(replies)
+    assert await storage.replies.get(replies[0]["id"]) == stored(replies[0])
+
+    expected = ids(sorted(replies, key=lambda doc: (bson_datetime(doc["created_at"]), doc["id"])))
+    docs = await walk(lambda n, c: storage.replies.page(discussion["id"], n, c, projection("id", "created_at")), 3)
+    assert ids(docs) == expected
+    streamed = await collect(storage.replies.stream(projection("id")))
+    assert sorted(ids(streamed)) == sorted(expected)
+
+    thread, first_page, cursor = await storage.discussions.thread(
+        discussion["id"], projection("id", "title", "replies"), projection("id", "content"), 3
+    )
+    assert thread == {"id": discussion["id"], "title": discussion["title"], "replies": len(replies)}
+    assert ids(first_page) == expected[:3]
+    rest, _ = await storage.replies.page(discussion["id"], 50, cursor, projection("id"))
+    assert ids(rest) == expected[3:]
+    assert await storage.discussions.thread("missing", projection("id"), projection("id"), 3) == (None, [], None)
+
+    assert await storage.replies.delete(replies[0]["id"]) == stored(replies[0])
+    assert await storage.replies.delete(replies[0]["id"]) is None
+    assert (await storage.discussions.get(discussion["id"], projection("replies")))["replies"] == len(replies) - 1
+
+
+@conformance
+async def test_counters(storage):
+    discussion, other = make_discussion(1), make_discussion(2)
+    for doc in (discussion, other):
+        await storage.discussions.insert(dict(doc))
+    reply = make_reply(discussion["id"], 0)
+    await storage.replies.insert(dict(reply))
+
+    await storage.discussions.increment({discussion["id"]: {"upvotes": 3}, other["id"]: {"upvotes": 1},
+                                         "missing": {"upvotes": 1}})
+    await storage.discussions.increment({discussion["id"]: {"upvotes": -1}})
+    await storage.replies.increment({reply["id"]: {"upvotes": 2}})
+    counts = await storage.discussions.find_many([discussion["id"], other["id"], "missing"],
+                                                 projection("id", "upvotes", "replies"))
+    assert sorted(counts, key=lambda doc: doc["id"]) == sorted([
+        {"id": discussion["id"], "upvotes": 2, "replies": 1},
+        {"id": other["id"], "upvotes": 1, "replies": 0},
+    ], key=lambda doc: doc["id"])
+    assert await storage.replies.find_many([reply["id"]], projection("id", "discussion_id", "upvotes")) == [
+        {"id": reply["id"], "discussion_id": discussion["id"], "upvotes": 2}]
+
+    await storage.discussions.refresh_hot_scores([discussion["id"]])
+    score = (await storage.discussions.get(discussion["id"], projection("hot_score")))["hot_score"]
+    assert score == pytest.approx(hot_score(2, 1, bson_datetime(discussion["created_at"])), abs=1e-6)
+
+
+@conformance
+async def test_hot_decay(storage):
+    fresh = make_discussion(1, upvotes=5, hot_score=0.0)
+    aged = make_discussion(2, upvotes=5, hot_score=3.0, created_at=NOW - timedelta(days=45))
+    for doc in (fresh, aged):
+        await storage.discussions.insert(dict(doc))
+    assert await storage.discussions.decay_hot_scores(30) >= 2
+    scores = {doc["id"]: doc["hot_score"] for doc in await storage.discussions.find_many(
+        [fresh["id"], aged["id"]], projection("id", "hot_score"))}
+    assert scores[fresh["id"]] == pytest.approx(hot_score(5, 0, bson_datetime(fresh["created_at"])), abs=1e-3)
+    assert scores[aged["id"]] == 0.0
+    docs, _ = await storage.discussions.page("hot_score", 10, projection=projection("id"))
+    assert ids(docs) == [fresh["id"], aged["id"]]
+
+
+@conformance
+async def test_discussion_delete(storage):
+    discussion, keep = make_discussion(1), make_discussion(2)
+    for doc in (discussion, keep):
+        await storage.discussions.insert(dict(doc))
+    reply = make_reply(discussion["id"], 0)
+    await storage.replies.insert(dict(reply))
+    deleted = await storage.discussions.delete(discussion["id"], projection("created_at"))
+    assert deleted == {"created_at": bson_datetime(discussion["created_at"])}
+    assert await storage.discussions.get(discussion["id"]) is None
+    assert not await storage.discussions.exists(discussion["id"])
+    assert await storage.discussions.delete(discussion["id"]) is None
+    assert not await storage.replies.insert(make_reply(discussion["id"], 1))
+    assert (await storage.discussions.thread(discussion["id"], projection("id"), projection("id"), 5))[0] is None
+    for field in SORT_FIELDS.values():
+        docs, _ = await storage.discussions.page(field, 10, projection=projection("id"))
+        assert ids(docs) == [keep["id"]], field
+    assert await storage.discussions.find_many([discussion["id"]]) == []
+    # Its replies go with it: unreadable and no longer counted or deletable
+    await storage.replies.increment({reply["id"]: {"upvotes": 1}})
+    assert await storage.replies.get(reply["id"]) is None
+    assert (await storage.replies.page(discussion["id"], 10))[0] == []
+    assert await storage.replies.find_many([reply["id"]]) == []
+    assert [doc async for doc in storage.replies.stream(projection("id"))] == []
+    assert await storage.replies.delete(reply["id"]) is None
+
+
+@conformance
+async def test_feedback(storage):
+    feedback = [Feedback(rating=i % 5 + 1, comment=f"Comment {i}", created_at=NOW - timedelta(minutes=i)).model_dump()
+                for i in range(9)]
+    for doc in feedback:
+        await storage.feedback.insert(dict(doc))
+    docs = await walk(lambda n, c: storage.feedback.page(n, c, projection("id", "created_at")), 4)
+    assert ids(docs) == ids(feedback)
+    assert await collect(storage.feedback.stream()) == [stored(doc) for doc in feedback]
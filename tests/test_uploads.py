@@ -0,0 +1,78 @@
+import asyncio
+import hashlib
+import os
+from datetime import datetime, timedelta, timezone
+
+from mongomock_motor import AsyncMongoMockClient
+
+from blobs import LocalBlobStore
+from uploads import SESSIONS_COLLECTION, UploadCreate, UploadManager
+
+PDF = b"%PDF-1.4\n" + os.urandom(4096)
+
+
+async def _body(data: bytes):
+    yield data
+
+
+async def _uploaded(manager: UploadManager, db) -> str:
+    upload = await manager.create(db, UploadCreate(size=len(PDF)))
+    await manager.write_chunk(db, upload["id"], f"bytes 0-{len(PDF) - 1}/{len(PDF)}", _body(PDF))
+    return upload["id"]
+
+
+class CrashAfterPut(LocalBlobStore):
+    """The worker dies once the staged file has been moved into the store"""
+
+    crashed = False
+
+    async def put(self, digest, staged):
+        stored = await super().put(digest, staged)
+        if not self.crashed:
+            self.crashed = True
+            raise asyncio.CancelledError()
+        return stored
+
+
+def test_completion_retried_after_crash_mid_store_finds_the_blob(tmp_path):
+    async def scenario():
+        db = AsyncMongoMockClient()["uploads_test"]
+        blobs = CrashAfterPut(tmp_path / "blobs")
+        manager = UploadManager(blobs, tmp_path / "staging")
+        upload_id = await _uploaded(manager, db)
+        notes = []
+
+        async def create_note(note_id, digest, size):
+            notes.append((note_id, digest, size))
+
+        try:
+            await manager.complete(db, upload_id, create_note)
+        except asyncio.CancelledError:
+            pass
+        # The dead worker's lease runs out
+        expired = datetime.now(timezone.utc) - timedelta(minutes=1)
+        await db[SESSIONS_COLLECTION].update_one({"_id": upload_id}, {"$set": {"lease_until": expired}})
+        view = await manager.complete(db, upload_id, create_note)
+        return view, notes, blobs
+
+    view, notes, blobs = asyncio.run(scenario())
+    digest = hashlib.sha256(PDF).hexdigest()
+    assert view["state"] == "complete"
+    assert [(digest, len(PDF))] == [(d, size) for _, d, size in notes]
+    assert blobs.path(digest).read_bytes() == PDF
+
+
+def test_completion_with_staged_bytes_lost_is_gone(tmp_path):
+    async def scenario():
+        db = AsyncMongoMockClient()["uploads_test"]
+        manager = UploadManager(LocalBlobStore(tmp_path / "blobs"), tmp_path / "staging")
+        upload_id = await _uploaded(manager, db)
+        digest = hashlib.sha256(PDF).hexdigest()
+        await db[SESSIONS_COLLECTION].update_one({"_id": upload_id}, {"$set": {"digest": digest}})
+        manager._staged(upload_id).unlink()
+        try:
+            await manager.complete(db, upload_id, None)
+        except Exception as e:
+            return e.status_code, await db[SESSIONS_COLLECTION].find_one({"_id": upload_id})
+
+    assert asyncio.run(scenario()) == (410, None)